@@ -0,0 +1,115 @@
+"""
+Microbenchmark de las reglas de fusion
+Compara CompositeRule (lista de dicts por regla) con CompiledRuleChain sobre
+dicts y con el camino de /alert (columnas de inferencia -> evaluate_mask ->
+dicts solo de las que pasan), para distintos tamaños de lote
+
+Uso:
+    python benchmarks/bench_rules.py --sizes 100 1000 10000 100000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "fusion"))
+from rules import (ClassFilterRule, CompiledRuleChain, CompositeRule, DetectionBatch,  # noqa: E402
+                   ThresholdRule, evaluate_mask)
+
+CLASSES = ['person', 'car', 'dog', 'cat', 'bicycle', 'truck', 'bird', 'motorcycle']
+
+SPECS = [
+    {'type': 'confidence', 'min': 0.5, 'per_class': {'person': 0.4}},
+    {'type': 'classes', 'allow': ['person', 'car', 'dog', 'truck']},
+    {'type': 'bbox_area', 'min': 1500},
+    {'type': 'bbox_aspect', 'max': 4.0},
+]
+
+
+def make_detections(count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 1200, (count, 2))
+    wh = rng.uniform(5, 300, (count, 2))
+    classes = rng.integers(0, len(CLASSES), count)
+    confidences = rng.uniform(0.05, 1.0, count)
+    return [
+        {
+            "class": int(cls),
+            "class_name": CLASSES[cls],
+            "confidence": float(conf),
+            "bbox": {"x1": float(x), "y1": float(y), "x2": float(x + w), "y2": float(y + h)},
+        }
+        for cls, conf, (x, y), (w, h) in zip(classes, confidences, xy, wh)
+    ]
+
+
+def to_columns(detections: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Mismo lote en el formato columnar de inferencia"""
+    return {
+        "class_name": [det["class_name"] for det in detections],
+        "confidence": [det["confidence"] for det in detections],
+        "bbox": [[det["bbox"][k] for k in ("x1", "y1", "x2", "y2")] for det in detections],
+    }
+
+
+def alert_path(chain: CompiledRuleChain, columns: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Lo que hace process_alert: lote columnar, máscara y dicts de las que pasan"""
+    batch = DetectionBatch.from_columns(columns)
+    return batch.select(evaluate_mask(chain, batch))
+
+
+def measure(fn: Callable[[], Any], min_time: float) -> float:
+    """Segundos por llamada (mejor de varias rondas)"""
+    best = float('inf')
+    deadline = time.perf_counter() + min_time
+    while True:
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+        if time.perf_counter() >= deadline:
+            return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark de reglas de fusion")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('--min-time', type=float, default=1.0, help="Segundos por medición")
+    args = parser.parse_args()
+
+    # Misma cadena con el API anterior (confianza + clases; área y aspecto no existían)
+    legacy = CompositeRule([ThresholdRule(0.5), ClassFilterRule(['person', 'car', 'dog', 'truck'])])
+    equivalent = CompiledRuleChain([{'type': 'confidence', 'min': 0.5}, SPECS[1]])
+    compiled = CompiledRuleChain(SPECS)
+
+    print("Millones de detecciones por segundo (mejor ronda)")
+    print(f"{'detecciones':>12} {'composite':>10} {'compilada':>10} {'completa':>10} "
+          f"{'columnar':>10} {'máscara':>10}")
+    for size in args.sizes:
+        detections = make_detections(size)
+        columns = to_columns(detections)
+        batch = DetectionBatch.from_columns(columns)
+        # Los caminos deben coincidir antes de medirlos
+        assert legacy.evaluate(detections) == equivalent.evaluate(detections)
+        assert [det["class_name"] for det in compiled.evaluate(detections)] == [
+            det["class_name"] for det in alert_path(compiled, columns)]
+
+        timings = [
+            measure(lambda: legacy.evaluate(detections), args.min_time),
+            measure(lambda: equivalent.evaluate(detections), args.min_time),
+            measure(lambda: compiled.evaluate(detections), args.min_time),
+            measure(lambda: alert_path(compiled, columns), args.min_time),
+            measure(lambda: evaluate_mask(compiled, batch), args.min_time),
+        ]
+        print(f"{size:>12} " + " ".join(f"{size / seconds / 1e6:>10.2f}" for seconds in timings))
+    print("composite: CompositeRule(Threshold, ClassFilter) sobre dicts")
+    print("compilada: la misma cadena en CompiledRuleChain, sobre dicts (los convierte a arrays)")
+    print("completa:  cadena con per_class, área y aspecto, sobre dicts")
+    print("columnar:  cadena completa como en /alert (listas por campo -> arrays -> dicts que pasan)")
+    print("máscara:   cadena completa sobre arrays ya armados")
+
+
+if __name__ == "__main__":
+    main()
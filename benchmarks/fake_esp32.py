@@ -0,0 +1,147 @@
+"""
+Cámara ESP32 simulada para benchmarks
+Sirve /capture (puerto P) y el stream multipart /stream (puerto P+1) como el firmware
+"""
+import argparse
+import asyncio
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import cv2
+import numpy as np
+from aiohttp import web
+
+# Mismo boundary y formato de parte que el firmware CameraWebServer del ESP32
+BOUNDARY = "123456789000000000000987654321"
+
+
+def synthetic_frames(width: int, height: int, count: int = 60, quality: int = 80) -> List[bytes]:
+    """Secuencia de JPEGs con un objeto que se desplaza sobre un fondo con textura"""
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (0, 0), 5)
+    frames = []
+    for i in range(count):
+        image = background.copy()
+        x = int((i / count) * (width - width // 5))
+        y = height // 3
+        cv2.rectangle(image, (x, y), (x + width // 5, y + height // 2), (40, 80, 200), -1)
+        cv2.putText(image, str(i), (10, height - 10), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        frames.append(buffer.tobytes())
+    return frames
+
+
+def load_frames(jpeg_dir: Optional[str], width: int, height: int) -> List[bytes]:
+    """JPEGs de un directorio (re-escalados a width x height) o sintéticos"""
+    if not jpeg_dir:
+        return synthetic_frames(width, height)
+    frames = []
+    for path in sorted(Path(jpeg_dir).glob('*.jp*g')):
+        image = cv2.imread(str(path))
+        if image is None:
+            continue
+        if (image.shape[1], image.shape[0]) != (width, height):
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        frames.append(cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes())
+    if not frames:
+        raise ValueError(f"No hay JPEGs en {jpeg_dir}")
+    return frames
+
+
+class FakeCamera:
+    """Una cámara: dos servidores aiohttp con la misma secuencia de frames"""
+
+    def __init__(self, frames: List[bytes], fps: float, port: int, host: str = '127.0.0.1'):
+        self.frames = frames
+        self.fps = fps
+        self.port = port
+        self.host = host
+        self.frames_served = 0
+        self._runners = []
+
+    def _frame_at(self, now: float) -> bytes:
+        return self.frames[int(now * self.fps) % len(self.frames)]
+
+    async def capture(self, request):
+        self.frames_served += 1
+        return web.Response(body=self._frame_at(time.time()), content_type='image/jpeg')
+
+    async def stream(self, request):
+        response = web.StreamResponse(headers={
+            'Content-Type': f'multipart/x-mixed-replace;boundary={BOUNDARY}',
+            'Access-Control-Allow-Origin': '*',
+        })
+        await response.prepare(request)
+        interval = 1.0 / self.fps
+        next_at = time.monotonic()
+        try:
+            while True:
+                frame = self._frame_at(time.time())
+                await response.write(
+                    b"Content-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(frame)
+                    + frame + b"\r\n--" + BOUNDARY.encode() + b"\r\n"
+                )
+                self.frames_served += 1
+                next_at += interval
+                await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        return response
+
+    async def start(self):
+        for port, route, handler in ((self.port, '/capture', self.capture),
+                                     (self.port + 1, '/stream', self.stream)):
+            app = web.Application()
+            app.router.add_get(route, handler)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, self.host, port).start()
+            self._runners.append(runner)
+
+    @property
+    def stream_url(self) -> str:
+        return f"http://{self.host}:{self.port + 1}/stream"
+
+    @property
+    def capture_url(self) -> str:
+        return f"http://{self.host}:{self.port}/capture"
+
+    async def stop(self):
+        for runner in self._runners:
+            await runner.cleanup()
+        self._runners = []
+
+
+async def start_cameras(count: int, base_port: int, fps: float, width: int, height: int,
+                        jpeg_dir: Optional[str] = None) -> List[FakeCamera]:
+    """Lanza `count` cámaras en los puertos base_port, base_port+2, ..."""
+    frames = load_frames(jpeg_dir, width, height)
+    cameras = [FakeCamera(frames, fps, base_port + 2 * i) for i in range(count)]
+    for camera in cameras:
+        await camera.start()
+    return cameras
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Cámaras ESP32 simuladas")
+    parser.add_argument('--cameras', type=int, default=1)
+    parser.add_argument('--base-port', type=int, default=18080)
+    parser.add_argument('--fps', type=float, default=10)
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--height', type=int, default=600)
+    parser.add_argument('--jpeg-dir', help="Directorio de JPEGs (por defecto frames sintéticos)")
+    args = parser.parse_args()
+
+    cameras = await start_cameras(args.cameras, args.base_port, args.fps, args.width, args.height, args.jpeg_dir)
+    for camera in cameras:
+        print(f"stream: {camera.stream_url}  capture: {camera.capture_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for camera in cameras:
+            await camera.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
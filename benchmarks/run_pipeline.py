@@ -0,0 +1,402 @@
+"""
+Benchmark de punta a punta: cámaras simuladas -> ingesta -> inferencia -> fusion -> Telegram simulado
+Todo corre en local, sin red ni hardware. Los resultados se guardan en JSON para comparar corridas.
+
+Uso:
+    python benchmarks/run_pipeline.py --cameras 1 2 4 --duration 60 --model /ruta/yolov8n.pt
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+import yaml
+
+from fake_esp32 import start_cameras
+from stub_telegram import StubTelegram
+
+REPO = Path(__file__).resolve().parent.parent
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+SERVICES = {
+    # nombre: (directorio, módulo:app)
+    'fusion': ('fusion', 'alert_service:app'),
+    'inferencia': ('inferencia', 'service:app'),
+    'ingesta': ('ingesta', 'server:app'),
+}
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"count": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    ordered = sorted(values)
+    last = len(ordered) - 1
+
+    def pick(q: float) -> float:
+        return round(ordered[min(last, int(round(q * last)))] * 1000, 2)
+
+    return {"count": len(ordered), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+# --- CPU y memoria desde /proc (incluye procesos hijos, p. ej. workers de inferencia) ---
+
+def _descendants(pid: int) -> List[int]:
+    pids = [pid]
+    index = 0
+    while index < len(pids):
+        task_dir = Path(f"/proc/{pids[index]}/task")
+        index += 1
+        try:
+            for task in task_dir.iterdir():
+                children = (task / "children").read_text().split()
+                pids.extend(int(child) for child in children)
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+    return pids
+
+
+def _proc_usage(pid: int):
+    """(segundos de CPU, bytes RSS) de un proceso"""
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime + stime
+        rss = int(Path(f"/proc/{pid}/statm").read_text().split()[1]) * PAGE_SIZE
+        return cpu, rss
+    except (FileNotFoundError, ProcessLookupError, IndexError):
+        return 0.0, 0
+
+
+class ResourceSampler(threading.Thread):
+    """Muestrea CPU (%) y RSS de cada servicio y sus hijos a intervalos fijos"""
+
+    def __init__(self, pids: Dict[str, int], interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.pids = pids
+        self.interval = interval
+        self.samples: Dict[str, List[Dict[str, float]]] = {name: [] for name in pids}
+        self._stop_event = threading.Event()
+        self._last: Dict[str, tuple] = {}
+
+    def _sample(self):
+        now = time.monotonic()
+        for name, pid in self.pids.items():
+            cpu, rss = 0.0, 0
+            for child in _descendants(pid):
+                child_cpu, child_rss = _proc_usage(child)
+                cpu += child_cpu
+                rss += child_rss
+            previous = self._last.get(name)
+            self._last[name] = (now, cpu)
+            if previous is not None and now > previous[0]:
+                self.samples[name].append({
+                    "at": time.time(),
+                    "cpu_pct": 100 * (cpu - previous[1]) / (now - previous[0]),
+                    "rss_mb": rss / (1024 * 1024),
+                })
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._sample()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def summary(self, since: float, until: float) -> Dict[str, Any]:
+        result = {}
+        for name, samples in self.samples.items():
+            window = [s for s in samples if since <= s["at"] <= until]
+            if not window:
+                result[name] = None
+                continue
+            cpu = [s["cpu_pct"] for s in window]
+            result[name] = {
+                "cpu_avg_pct": round(sum(cpu) / len(cpu), 1),
+                "cpu_max_pct": round(max(cpu), 1),
+                "rss_max_mb": round(max(s["rss_mb"] for s in window), 1),
+            }
+        return result
+
+
+# --- Configuración y servicios ---
+
+def write_configs(workdir: Path, args, cameras, ports: Dict[str, int], telegram_url: str) -> Path:
+    config_dir = workdir / "config"
+    config_dir.mkdir(parents=True, exist_ok=True)
+    system_config = {
+        'services': {
+            'inference_url': f"http://127.0.0.1:{ports['inferencia']}/infer",
+            'fusion_url': f"http://127.0.0.1:{ports['fusion']}/alert",
+            'transport': args.transport,
+        },
+        'ingesta': {
+            'fps': args.fps,
+            'max_inflight': args.max_inflight,
+            'discovery': {'cache_path': ''},
+            'recorder': {'enabled': False},
+        },
+        'cameras': [
+            {'id': f"bench{i}", 'url': camera.stream_url, 'method': 'mjpeg_http', 'fps': args.fps}
+            for i, camera in enumerate(cameras)
+        ],
+        'inferencia': {
+            'alert_queue': {'spool_dir': str(workdir / "spool")},
+        },
+        'fusion': {
+            'alert_threshold': args.alert_threshold,
+            'enabled_classes': [],
+        },
+    }
+    yolo_config = {
+        'model_path': args.model,
+        'conf_threshold': args.conf,
+        'iou_threshold': 0.45,
+        'imgsz': args.imgsz,
+        'device': 'cpu',
+        'classes': None,
+        'backend': args.backend,
+        'precision': args.precision,
+        'workers': {'processes': args.workers, 'threads_per_worker': args.threads_per_worker},
+    }
+    with open(config_dir / "system_config.yaml", 'w') as f:
+        yaml.safe_dump(system_config, f)
+    with open(config_dir / "yolov8_config.yaml", 'w') as f:
+        yaml.safe_dump(yolo_config, f)
+    return config_dir
+
+
+def start_service(name: str, port: int, workdir: Path, config_dir: Path, env_extra: Dict[str, str]):
+    directory, app = SERVICES[name]
+    log_dir = workdir / "logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
+    env = dict(os.environ)
+    env.update({
+        'CONFIG_DIR': str(config_dir),
+        'LOG_DIR': str(log_dir),
+        'PYTHONPATH': os.pathsep.join([str(REPO / "utils"), env.get('PYTHONPATH', '')]),
+    })
+    env.update(env_extra)
+    output = open(log_dir / f"{name}.stdout", 'w')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', app, '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=REPO / directory, env=env, stdout=output, stderr=subprocess.STDOUT
+    )
+
+
+async def wait_for(session: aiohttp.ClientSession, url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=2)) as response:
+                if response.status == 200:
+                    return await response.json()
+        except aiohttp.ClientError:
+            pass
+        except asyncio.TimeoutError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"{url} no respondió en {timeout}s")
+
+
+def stop_process(process: subprocess.Popen, timeout: float = 15):
+    if process.poll() is not None:
+        return
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def read_alert_latencies(log_file: Path, since: float, until: float) -> List[float]:
+    """Captura -> alerta registrada en fusion, a partir de alerts.jsonl"""
+    latencies = []
+    if not log_file.exists():
+        return latencies
+    with open(log_file, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                frame_ts = entry.get("metadata", {}).get("frame_timestamp")
+                logged_at = datetime.fromisoformat(entry["timestamp"]).timestamp()
+            except (ValueError, KeyError, TypeError):
+                continue
+            if frame_ts and since <= frame_ts <= until:
+                latencies.append(logged_at - frame_ts)
+    return latencies
+
+
+def camera_totals(status: Dict[str, Any]) -> Dict[str, int]:
+    totals = {"frames_captured": 0, "frames_sent": 0, "errors": 0, "frames_dropped": 0}
+    for camera in status.get("cameras", []):
+        for key in totals:
+            totals[key] += camera.get(key, 0) or 0
+    return totals
+
+
+async def run_scenario(args, camera_count: int) -> Dict[str, Any]:
+    ports = {'ingesta': args.base_port, 'inferencia': args.base_port + 1, 'fusion': args.base_port + 2}
+    telegram = StubTelegram(args.base_port + 3, delay=args.telegram_delay)
+    await telegram.start()
+    cameras = await start_cameras(camera_count, args.base_port + 10, args.camera_fps,
+                                  args.width, args.height, args.jpeg_dir)
+    workdir = Path(tempfile.mkdtemp(prefix=f"bench-{camera_count}cam-"))
+    config_dir = write_configs(workdir, args, cameras, ports, telegram.url)
+
+    processes = {}
+    sampler = None
+    try:
+        async with aiohttp.ClientSession() as session:
+            processes['fusion'] = start_service('fusion', ports['fusion'], workdir, config_dir, {
+                'BOT_TOKEN': 'bench', 'CHAT_ID': '1', 'TELEGRAM_API_URL': telegram.url,
+            })
+            processes['inferencia'] = start_service('inferencia', ports['inferencia'], workdir, config_dir, {})
+            await wait_for(session, f"http://127.0.0.1:{ports['fusion']}/health", 60)
+            ready = await wait_for(session, f"http://127.0.0.1:{ports['inferencia']}/ready", args.startup_timeout)
+            processes['ingesta'] = start_service('ingesta', ports['ingesta'], workdir, config_dir, {})
+            await wait_for(session, f"http://127.0.0.1:{ports['ingesta']}/health", 60)
+
+            sampler = ResourceSampler({name: p.pid for name, p in processes.items()})
+            sampler.start()
+
+            status_url = f"http://127.0.0.1:{ports['ingesta']}/status"
+            print(f"[{camera_count} cámaras] calentando {args.warmup}s, midiendo {args.duration}s")
+            await asyncio.sleep(args.warmup)
+            async with session.get(status_url) as response:
+                before = camera_totals(await response.json())
+            started = time.time()
+            await asyncio.sleep(args.duration)
+            finished = time.time()
+            async with session.get(status_url) as response:
+                after_status = await response.json()
+            after = camera_totals(after_status)
+            async with session.get(f"http://127.0.0.1:{ports['inferencia']}/health") as response:
+                inferencia_health = await response.json()
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        for name in ('ingesta', 'inferencia', 'fusion'):
+            if name in processes:
+                stop_process(processes[name])
+        for camera in cameras:
+            await camera.stop()
+        await telegram.stop()
+
+    duration = finished - started
+    delta = {key: after[key] - before[key] for key in after}
+    # Percentiles por etapa según ingesta (ventana de sus últimos frames), agregando cámaras
+    stage_latency = {}
+    for camera in after_status.get("cameras", []):
+        for stage, window in (camera.get("latency") or {}).items():
+            stage_latency.setdefault(stage, []).append(window)
+
+    alert_latencies = read_alert_latencies(workdir / "logs" / "alerts.jsonl", started, finished)
+    return {
+        "cameras": camera_count,
+        "duration_s": round(duration, 2),
+        "throughput": {
+            "frames_captured_per_s": round(delta["frames_captured"] / duration, 3),
+            "frames_inferred_per_s": round(delta["frames_sent"] / duration, 3),
+            "frames_dropped": delta["frames_dropped"],
+            "errors": delta["errors"],
+            "alerts_per_s": round(len(alert_latencies) / duration, 3),
+            "telegram": telegram.summary(started, finished),
+        },
+        "latency": {
+            "per_camera_stage": stage_latency,
+            "capture_to_alert": percentiles(alert_latencies),
+        },
+        "resources": sampler.summary(started, finished) if sampler else {},
+        "startup": ready.get("steps"),
+        "inferencia": {key: inferencia_health.get(key) for key in ("queued", "alerts", "result_cache")},
+        "workdir": str(workdir),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def print_summary(result: Dict[str, Any]):
+    throughput = result["throughput"]
+    e2e = result["latency"]["capture_to_alert"]
+    print(f"  {result['cameras']} cámaras: {throughput['frames_inferred_per_s']} frames/s inferidos, "
+          f"{throughput['alerts_per_s']} alertas/s, captura→alerta p50 {e2e['p50_ms']} ms "
+          f"p95 {e2e['p95_ms']} ms p99 {e2e['p99_ms']} ms")
+    for name, usage in (result["resources"] or {}).items():
+        if usage:
+            print(f"    {name}: CPU {usage['cpu_avg_pct']}% (máx {usage['cpu_max_pct']}%), "
+                  f"RSS máx {usage['rss_max_mb']} MB")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark de punta a punta del pipeline")
+    parser.add_argument('--cameras', type=int, nargs='+', default=[1], help="Cantidades de cámaras a medir")
+    parser.add_argument('--duration', type=float, default=30, help="Segundos de medición por escenario")
+    parser.add_argument('--warmup', type=float, default=5, help="Segundos descartados al inicio")
+    parser.add_argument('--fps', type=float, default=2, help="fps de procesamiento por cámara (ingesta)")
+    parser.add_argument('--camera-fps', type=float, default=10, help="fps del stream simulado")
+    parser.add_argument('--width', type=int, default=800)
+    parser.add_argument('--height', type=int, default=600)
+    parser.add_argument('--jpeg-dir', help="JPEGs para las cámaras (por defecto sintéticos)")
+    parser.add_argument('--model', default=str(REPO / "inferencia" / "models" / "yolov8n.pt"))
+    parser.add_argument('--backend', default='pytorch')
+    parser.add_argument('--precision', default='fp32')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--alert-threshold', type=float, default=0.5)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads-per-worker', type=int, default=2)
+    parser.add_argument('--max-inflight', type=int, default=4)
+    parser.add_argument('--transport', default='binary')
+    parser.add_argument('--telegram-delay', type=float, default=0.0)
+    parser.add_argument('--startup-timeout', type=float, default=300)
+    parser.add_argument('--base-port', type=int, default=18000)
+    parser.add_argument('--output', help="Archivo JSON de resultados")
+    args = parser.parse_args()
+
+    scenarios = []
+    for count in args.cameras:
+        result = await run_scenario(args, count)
+        print_summary(result)
+        scenarios.append(result)
+
+    report = {
+        "benchmark": "pipeline",
+        "created_at": datetime.now().isoformat(),
+        "git_revision": git_revision(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(),
+                 "cpu_count": os.cpu_count()},
+        "args": vars(args),
+        "scenarios": scenarios,
+    }
+    output = Path(args.output) if args.output else (
+        Path(__file__).resolve().parent / "results" / f"pipeline-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados: {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
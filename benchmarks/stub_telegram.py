@@ -0,0 +1,94 @@
+"""
+API de Telegram simulada para benchmarks
+Responde sendMessage/sendPhoto como la API real y cuenta lo recibido;
+opcionalmente responde 429 como Telegram al superar un mensaje por intervalo
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, List
+
+from aiohttp import web
+
+
+class StubTelegram:
+    """Servidor local; fusion lo usa con TELEGRAM_API_URL=http://host:puerto"""
+
+    def __init__(self, port: int, host: str = '127.0.0.1', delay: float = 0.0, min_interval: float = 0.0):
+        self.port = port
+        self.host = host
+        self.delay = delay  # latencia artificial por petición (segundos)
+        self.min_interval = min_interval  # segundos mínimos entre mensajes aceptados (0 = sin límite)
+        self.requests: List[Dict[str, Any]] = []
+        self.rejected = 0
+        self._last_accepted = 0.0
+        self._runner = None
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        body = await request.read()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        now = time.monotonic()
+        if self.min_interval and now - self._last_accepted < self.min_interval:
+            self.rejected += 1
+            retry_after = max(1, round(self.min_interval - (now - self._last_accepted)))
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }, status=429)
+        self._last_accepted = now
+        self.requests.append({"method": method, "bytes": len(body), "received_at": time.time()})
+        return web.json_response({"ok": True, "result": {"message_id": len(self.requests)}})
+
+    async def stats(self, request):
+        return web.json_response(self.summary())
+
+    def summary(self, since: float = 0.0, until: float = float('inf')) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        total_bytes = 0
+        for entry in self.requests:
+            if since <= entry["received_at"] <= until:
+                counts[entry["method"]] = counts.get(entry["method"], 0) + 1
+                total_bytes += entry["bytes"]
+        return {"requests": sum(counts.values()), "by_method": counts, "bytes": total_bytes,
+                "rejected": self.rejected}
+
+    async def start(self):
+        app = web.Application(client_max_size=20 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/stats', self.stats)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="API de Telegram simulada")
+    parser.add_argument('--port', type=int, default=18443)
+    parser.add_argument('--delay', type=float, default=0.0, help="Latencia artificial (s)")
+    parser.add_argument('--min-interval', type=float, default=0.0,
+                        help="Responde 429 a mensajes más seguidos que este intervalo (s)")
+    args = parser.parse_args()
+
+    stub = StubTelegram(args.port, delay=args.delay, min_interval=args.min_interval)
+    await stub.start()
+    print(f"TELEGRAM_API_URL={stub.url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stub.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,188 +1,301 @@
 import asyncio
 import json
 from datetime import datetime
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.responses import JSONResponse
 from pathlib import Path
 import sys
 import yaml
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 # Agregar utils y rules al path
 sys.path.append('/app/utils')
 sys.path.append('/app')
 from logger import setup_logger
-from rules import DetectionRule, ThresholdRule, ClassFilterRule, CompositeRule
+from transport import read_batch_request, read_image_request
+from rules import DetectionBatch, RuleSet
+from alert_store import DEFAULT_ALERT_STORE_CONFIG, AlertStore, entry_time, parse_time
+from stats import DEFAULT_STATS_CONFIG, AlertStats, write_checkpoint
+from alert_writer import DEFAULT_ALERT_WRITER_CONFIG, AlertWriter, WriterUnavailableError, journal_segments
+from notifier import DEFAULT_NOTIFIER_CONFIG, TelegramNotifier
 
 app = FastAPI(title="Fusion Service", version="1.0.0")
 logger = setup_logger("fusion")
 
 # Cargar configuración
-config_path = Path("/app/config/system_config.yaml")
+config_path = Path(os.getenv("CONFIG_DIR", "/app/config")) / "system_config.yaml"
 if config_path.exists():
     with open(config_path, 'r') as f:
         config = yaml.safe_load(f)
-        alert_threshold = config.get('fusion', {}).get('alert_threshold', 0.5)
-        enabled_classes = config.get('fusion', {}).get('enabled_classes', [])
+        fusion_config = config.get('fusion', {}) or {}
+        store_config = config.get('fusion', {}).get('store', {})
+        stats_config = config.get('fusion', {}).get('stats', {})
+        writer_config = config.get('fusion', {}).get('writer', {})
+        notifier_config = config.get('fusion', {}).get('telegram', {})
 else:
-    alert_threshold = 0.5
-    enabled_classes = []
+    fusion_config = {}
+    store_config = {}
+    stats_config = {}
+    writer_config = {}
+    notifier_config = {}
+store_config = {**DEFAULT_ALERT_STORE_CONFIG, **(store_config or {})}
+stats_config = {**DEFAULT_STATS_CONFIG, **(stats_config or {})}
+writer_config = {**DEFAULT_ALERT_WRITER_CONFIG, **(writer_config or {})}
+notifier_config = {**DEFAULT_NOTIFIER_CONFIG, **(notifier_config or {})}
 
 # Cargar configuración de Telegram
 telegram_token = os.getenv('BOT_TOKEN', '')
 telegram_chat_id = os.getenv('CHAT_ID', '')
+# URL base de la API (sobrescribible para pruebas contra un servidor local)
+notifier_config['api_url'] = os.getenv('TELEGRAM_API_URL', notifier_config['api_url'])
+notifier = TelegramNotifier(telegram_token, telegram_chat_id, notifier_config)
 
 # Directorio de logs
-logs_dir = Path("/app/logs")
+logs_dir = Path(os.getenv("LOG_DIR", "/app/logs"))
 logs_dir.mkdir(exist_ok=True)
 log_file = logs_dir / "alerts.jsonl"
 
-# Configurar reglas de detección
-rules = CompositeRule([
-    ThresholdRule(threshold=alert_threshold),
-    ClassFilterRule(allowed_classes=enabled_classes) if enabled_classes else None
-])
-rules = CompositeRule([r for r in rules.rules if r is not None])
-
-async def send_telegram_alert(detections: List[Dict], image_b64: str = None):
-    """Envía alerta a Telegram"""
-    if not telegram_token or not telegram_chat_id:
-        logger.warning("Telegram no configurado")
-        return False
+# Índice de alertas (se abre en startup; alerts.jsonl se mantiene como journal)
+alert_store: Optional[AlertStore] = None
+# Contadores y series en memoria (checkpoint periódico en disco)
+alert_stats = AlertStats(stats_config['retention'])
+stats_checkpoint = Path(stats_config.get('checkpoint_path') or logs_dir / "stats.json")
+checkpoint_task: Optional[asyncio.Task] = None
+# Escritor en segundo plano: journal + almacén por lotes
+alert_writer: Optional[AlertWriter] = None
+
+# Configurar reglas de detección (cadena por defecto y cadenas por cámara)
+rules = RuleSet(fusion_config)
+
+async def log_alert(detections: List[Dict], metadata: Dict = None):
+    """Encola la alerta para el escritor (journal + almacén)
+
+    Si el escritor no acepta alertas lanza WriterUnavailableError: el llamador
+    responde 503 para que inferencia respalde y reintente.
+    """
+    alert_entry = {
+        "timestamp": datetime.now().isoformat(),
+        "detections": detections,
+        "count": len(detections),
+        "metadata": metadata or {}
+    }
+    
+    await alert_writer.submit(alert_entry)
     
+    logger.info(f"Alerta registrada: {len(detections)} detecciones")
+
+def record_stats(entries: List[Dict], ids: List[Optional[int]]):
+    """Cuenta en las estadísticas las alertas ya escritas"""
+    for entry, alert_id in zip(entries, ids):
+        alert_stats.record(entry, entry_time(entry), alert_id)
+
+def _as_epoch(value: Any) -> Optional[float]:
     try:
-        import aiohttp
-        
-        # Preparar mensaje
-        class_counts = {}
-        for det in detections:
-            class_name = det.get('class_name', 'unknown')
-            class_counts[class_name] = class_counts.get(class_name, 0) + 1
-        
-        message = "🚨 ALERTA DE DETECCIÓN\n\n"
-        message += f"📊 Detecciones: {len(detections)}\n"
-        for class_name, count in class_counts.items():
-            message += f"  • {class_name}: {count}\n"
-        message += f"\n⏰ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        
-        # Enviar mensaje de texto
-        url = f"https://api.telegram.org/bot{telegram_token}/sendMessage"
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json={
-                "chat_id": telegram_chat_id,
-                "text": message
-            }) as response:
-                if response.status == 200:
-                    logger.info("Alerta enviada a Telegram")
-                    
-                    # Si hay imagen, enviarla
-                    if image_b64:
-                        photo_url = f"https://api.telegram.org/bot{telegram_token}/sendPhoto"
-                        import base64
-                        from io import BytesIO
-                        from PIL import Image
-                        
-                        image_data = base64.b64decode(image_b64)
-                        image = Image.open(BytesIO(image_data))
-                        bio = BytesIO()
-                        image.save(bio, format='JPEG')
-                        bio.seek(0)
-                        
-                        form_data = aiohttp.FormData()
-                        form_data.add_field('chat_id', telegram_chat_id)
-                        form_data.add_field('photo', bio, filename='detection.jpg')
-                        
-                        async with session.post(photo_url, data=form_data) as photo_response:
-                            if photo_response.status == 200:
-                                logger.info("Imagen enviada a Telegram")
-                    
-                    return True
-                else:
-                    logger.error(f"Error enviando a Telegram: {response.status}")
-                    return False
-    except Exception as e:
-        logger.error(f"Error en Telegram: {e}")
-        return False
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+async def process_alert(image_data: bytes, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Aplica reglas, registra y notifica una alerta"""
+    detections = payload.get("detections", [])
+    timestamp = payload.get("timestamp", asyncio.get_event_loop().time())
+    camera_id = payload.get("camera_id")
+    # Clip de ingesta (GET /clips/{clip_id}) que cubre esta alerta, si se graba
+    clip_id = payload.get("clip_id")
+    
+    # Inferencia envía columnas; las reglas se evalúan como máscara sobre el lote
+    batch = DetectionBatch.from_payload(detections)
+    if not len(batch):
+        return {"status": "no_detections"}
+    
+    # Aplicar reglas de detección
+    mask = rules.evaluate_mask(batch, camera_id)
+    if not mask.any():
+        logger.debug("Detecciones filtradas por reglas")
+        return {"status": "filtered"}
+    
+    # Solo las detecciones que pasan se convierten a dicts para registro y Telegram
+    filtered_detections = batch.select(mask)
+    
+    # Registrar alerta
+    await log_alert(filtered_detections, {
+        "timestamp": timestamp,
+        "frame_timestamp": payload.get("frame_timestamp"),
+        "camera_id": camera_id,
+        "clip_id": clip_id
+    })
+    
+    # Enviar a Telegram; con tracking en inferencia solo notifican los tracks nuevos.
+    # La ventana de tiempo se mide con la hora del frame y solo limita las notificaciones:
+    # un respaldo reenviado de golpe se registra completo
+    notify = [det for det in filtered_detections if det.get("track_event", "new") == "new"]
+    notify = rules.throttle(notify, camera_id, _as_epoch(payload.get("frame_timestamp")))
+    if notify:
+        notifier.notify(notify, image_data, camera_id)
+    
+    return {
+        "status": "alert_sent",
+        "detections_count": len(filtered_detections)
+    }
+
+def load_stats(store: AlertStore) -> AlertStats:
+    """Checkpoint de estadísticas puesto al día con el almacén (o reconstruido completo)"""
+    stats = AlertStats.load(stats_checkpoint, stats_config['retention'])
+    if stats is None or stats.last_id > store.max_id():
+        # Sin checkpoint, o el checkpoint es de otra base: se recuenta todo
+        stats = AlertStats(stats_config['retention'])
+    counted = stats.catch_up(store.iter_after(stats.last_id))
+    logger.info(f"Estadísticas cargadas: {stats.total_alerts} alertas ({counted} contadas desde el almacén)")
+    return stats
 
-def log_alert(detections: List[Dict], metadata: Dict = None):
-    """Registra alerta en archivo de logs"""
+async def save_stats():
+    """Copia las estadísticas en el event loop y las escribe en un hilo"""
+    data = alert_stats.checkpoint()
     try:
-        alert_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "detections": detections,
-            "count": len(detections),
-            "metadata": metadata or {}
-        }
-        
-        with open(log_file, 'a') as f:
-            f.write(json.dumps(alert_entry) + '\n')
-        
-        logger.info(f"Alerta registrada: {len(detections)} detecciones")
-    except Exception as e:
-        logger.error(f"Error registrando alerta: {e}")
+        await asyncio.to_thread(write_checkpoint, stats_checkpoint, data)
+    except Exception:
+        # Se reintenta en el próximo checkpoint
+        alert_stats.dirty = True
+        raise
+
+async def checkpoint_loop():
+    """Guarda las estadísticas periódicamente si cambiaron"""
+    while True:
+        await asyncio.sleep(stats_config['checkpoint_interval'])
+        if alert_stats.dirty:
+            try:
+                await save_stats()
+            except Exception as e:
+                logger.error(f"Error guardando estadísticas: {e}")
+
+@app.on_event("startup")
+async def startup_event():
+    """Abre el almacén (importa el journal la primera vez), carga estadísticas e inicia el escritor"""
+    global alert_store, alert_stats, checkpoint_task, alert_writer
+    store_path = store_config.get('path') or logs_dir / "alerts.db"
+    alert_store = AlertStore(store_path)
+    segments = journal_segments(log_file)
+    if store_config.get('import_jsonl', True) and alert_store.count() == 0 and segments:
+        for segment in segments:
+            logger.info(f"Importando {segment} a {store_path}...")
+            imported = await asyncio.get_event_loop().run_in_executor(
+                None, alert_store.import_jsonl, segment, store_config.get('import_batch', 5000)
+            )
+            logger.info(f"Alertas importadas: {imported}")
+    alert_stats = await asyncio.get_event_loop().run_in_executor(None, load_stats, alert_store)
+    checkpoint_task = asyncio.create_task(checkpoint_loop())
+    alert_writer = AlertWriter(log_file, alert_store, record_stats, writer_config)
+    alert_writer.start()
+    notifier.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Envía y escribe lo pendiente, guarda las estadísticas y cierra el almacén"""
+    await notifier.stop()
+    if alert_writer is not None:
+        await alert_writer.stop()
+    if checkpoint_task:
+        checkpoint_task.cancel()
+    if alert_stats.dirty:
+        try:
+            await save_stats()
+        except Exception as e:
+            logger.error(f"Error guardando estadísticas: {e}")
+    if alert_store is not None:
+        alert_store.close()
+
+def require_writer():
+    """503 si el escritor se detuvo: inferencia respalda y reintenta en lugar de perder la alerta"""
+    if alert_writer is None or not alert_writer.accepting:
+        raise HTTPException(status_code=503, detail="Escritor de alertas no disponible")
 
 @app.post("/alert")
-async def alert(request: dict):
-    """Endpoint principal de alertas"""
+async def alert(request: Request):
+    """Endpoint principal de alertas (multipart metadatos+JPEG o JSON base64)"""
     try:
-        detections = request.get("detections", [])
-        image_b64 = request.get("image", "")
-        timestamp = request.get("timestamp", asyncio.get_event_loop().time())
-        
-        if not detections:
-            return JSONResponse(content={"status": "no_detections"})
-        
-        # Aplicar reglas de detección
-        filtered_detections = rules.evaluate(detections)
-        
-        if not filtered_detections:
-            logger.debug("Detecciones filtradas por reglas")
-            return JSONResponse(content={"status": "filtered"})
-        
-        # Registrar alerta
-        log_alert(filtered_detections, {"timestamp": timestamp})
-        
-        # Enviar a Telegram
-        await send_telegram_alert(filtered_detections, image_b64)
-        
-        return JSONResponse(content={
-            "status": "alert_sent",
-            "detections_count": len(filtered_detections)
-        })
+        require_writer()
+        try:
+            image_data, payload = await read_image_request(request)
+            result = await process_alert(image_data, payload)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Petición inválida: {e}")
+        return JSONResponse(content=result)
         
+    except HTTPException:
+        raise
+    except WriterUnavailableError as e:
+        logger.error(f"Alerta no registrada: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error procesando alerta: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/alert/batch")
+async def alert_batch(request: Request):
+    """Varias alertas en un solo POST (cola de envío de inferencia)"""
+    try:
+        require_writer()
+        try:
+            items = await read_batch_request(request)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Petición inválida: {e}")
+        results = []
+        for image_data, payload in items:
+            try:
+                results.append(await process_alert(image_data, payload))
+            except WriterUnavailableError as e:
+                # No quedó registrada: inferencia la respalda y la reenvía
+                logger.error(f"Alerta del lote no registrada: {e}")
+                results.append({"status": "error", "detail": str(e), "retry": True})
+            except Exception as e:
+                # Una alerta con error no debe provocar el reenvío del lote completo
+                logger.error(f"Error procesando alerta del lote: {e}")
+                results.append({"status": "error", "detail": str(e)})
+        return JSONResponse(content={"results": results, "count": len(results)})
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error procesando lote de alertas: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/health")
 async def health():
     """Health check endpoint"""
-    telegram_configured = bool(telegram_token and telegram_chat_id)
-    return {
-        "status": "healthy",
+    telegram_configured = notifier.configured
+    # Sin el escritor las alertas no se registran: el servicio no está sano
+    writer_ok = alert_writer is not None and alert_writer.accepting
+    return JSONResponse(status_code=200 if writer_ok else 503, content={
+        "status": "healthy" if writer_ok else "unhealthy",
         "service": "fusion",
-        "telegram_configured": telegram_configured
-    }
+        "telegram_configured": telegram_configured,
+        "writer": alert_writer.status() if alert_writer is not None else None,
+        "telegram": notifier.status()
+    })
 
 @app.get("/alerts")
-async def get_alerts(limit: int = 100):
-    """Obtiene alertas recientes"""
+async def get_alerts(
+    limit: int = 100,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    camera_id: Optional[str] = None,
+    class_name: Optional[str] = Query(None, alias="class")
+):
+    """Alertas recientes, opcionalmente por rango de tiempo (epoch o ISO), cámara y clase"""
     try:
-        alerts = []
-        if log_file.exists():
-            with open(log_file, 'r') as f:
-                lines = f.readlines()
-                for line in lines[-limit:]:
-                    try:
-                        alerts.append(json.loads(line.strip()))
-                    except:
-                        continue
+        try:
+            since_ts, until_ts = parse_time(since), parse_time(until)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Fecha inválida: {e}")
+        alerts = alert_store.query(limit, since_ts, until_ts, camera_id, class_name)
         
         return JSONResponse(content={
             "alerts": alerts,
             "count": len(alerts)
         })
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error obteniendo alertas: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -190,34 +303,22 @@ async def get_alerts(limit: int = 100):
 @app.get("/stats")
 async def stats():
     """Estadísticas de alertas"""
+    return JSONResponse(content=alert_stats.snapshot())
+
+@app.get("/stats/series")
+async def stats_series(
+    resolution: str = "hour",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    camera_id: Optional[str] = None,
+    class_name: Optional[str] = Query(None, alias="class")
+):
+    """Alertas y detecciones por minuto/hora/día para gráficos del dashboard"""
     try:
-        stats_data = {
-            "total_alerts": 0,
-            "class_counts": {},
-            "last_alert": None
-        }
-        
-        if log_file.exists():
-            with open(log_file, 'r') as f:
-                for line in f:
-                    try:
-                        alert = json.loads(line.strip())
-                        stats_data["total_alerts"] += 1
-                        
-                        for det in alert.get("detections", []):
-                            class_name = det.get("class_name", "unknown")
-                            stats_data["class_counts"][class_name] = \
-                                stats_data["class_counts"].get(class_name, 0) + 1
-                        
-                        if not stats_data["last_alert"]:
-                            stats_data["last_alert"] = alert.get("timestamp")
-                    except:
-                        continue
-        
-        return JSONResponse(content=stats_data)
-    except Exception as e:
-        logger.error(f"Error obteniendo estadísticas: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        points = alert_stats.series(resolution, parse_time(since), parse_time(until), camera_id, class_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content={"resolution": resolution, "points": points, "count": len(points)})
 
 if __name__ == "__main__":
     import uvicorn
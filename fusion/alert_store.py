@@ -0,0 +1,185 @@
+"""
+Almacén indexado de alertas sobre SQLite (modo WAL)
+alerts.jsonl sigue siendo el journal; la base permite consultas por tiempo,
+clase y cámara sin releer el archivo completo
+"""
+import gzip
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+DEFAULT_ALERT_STORE_CONFIG = {
+    'path': None,            # por defecto <logs_dir>/alerts.db
+    'import_jsonl': True,    # importar alerts.jsonl si la base está vacía
+    'import_batch': 5000,    # alertas por transacción al importar
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    camera_id TEXT,
+    count INTEGER NOT NULL,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alerts_ts ON alerts (ts);
+CREATE INDEX IF NOT EXISTS alerts_camera ON alerts (camera_id, id);
+CREATE TABLE IF NOT EXISTS alert_classes (
+    alert_id INTEGER NOT NULL,
+    class_name TEXT NOT NULL,
+    camera_id TEXT,
+    ts REAL NOT NULL,
+    detections INTEGER NOT NULL,
+    PRIMARY KEY (class_name, alert_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS alert_classes_ts ON alert_classes (class_name, ts);
+"""
+
+
+def entry_time(entry: Dict[str, Any]) -> float:
+    """Segundos epoch del timestamp ISO de una alerta"""
+    return datetime.fromisoformat(entry["timestamp"]).timestamp()
+
+
+def parse_time(value: Union[str, float, None]) -> Optional[float]:
+    """Acepta segundos epoch o fecha ISO (p. ej. 2024-05-01T12:00:00)"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(str(value)).timestamp()
+
+
+class AlertStore:
+    """Alertas en SQLite con índices por tiempo, cámara y clase
+
+    Cada consulta recorre solo las filas que retorna: "últimas N" usa la
+    clave primaria, los rangos el índice de tiempo y los filtros por clase
+    la tabla `alert_classes` (una fila por clase presente en la alerta).
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+    def _insert(self, entry: Dict[str, Any]) -> int:
+        ts = entry_time(entry)
+        camera_id = (entry.get("metadata") or {}).get("camera_id")
+        cursor = self._conn.execute(
+            "INSERT INTO alerts (ts, camera_id, count, entry) VALUES (?, ?, ?, ?)",
+            (ts, camera_id, entry.get("count", len(entry.get("detections", []))), json.dumps(entry))
+        )
+        alert_id = cursor.lastrowid
+        per_class: Dict[str, int] = {}
+        for det in entry.get("detections", []):
+            class_name = det.get("class_name", "unknown")
+            per_class[class_name] = per_class.get(class_name, 0) + 1
+        self._conn.executemany(
+            "INSERT INTO alert_classes (alert_id, class_name, camera_id, ts, detections) VALUES (?, ?, ?, ?, ?)",
+            [(alert_id, name, camera_id, ts, count) for name, count in per_class.items()]
+        )
+        return alert_id
+
+    def add(self, entry: Dict[str, Any]) -> int:
+        return self.add_many([entry])[-1]
+
+    def add_many(self, entries: Iterable[Dict[str, Any]]) -> List[int]:
+        """Inserta varias alertas en una sola transacción"""
+        with self._lock, self._conn:
+            return [self._insert(entry) for entry in entries]
+
+    def _query(self, sql: str, params: list) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        # Las consultas recorren de la más nueva a la más vieja; se retornan en orden cronológico
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def query(self, limit: int = 100, since: Optional[float] = None, until: Optional[float] = None,
+              camera_id: Optional[str] = None, class_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Las `limit` alertas más recientes que cumplen los filtros, en orden cronológico"""
+        table = "alert_classes" if class_name else "alerts"
+        key = "alert_id" if class_name else "id"
+        conditions, params = [], []
+        if class_name:
+            conditions.append("class_name = ?")
+            params.append(class_name)
+        if camera_id:
+            conditions.append("camera_id = ?")
+            params.append(camera_id)
+        if since is not None:
+            conditions.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("ts <= ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        if class_name:
+            sql = (f"SELECT a.entry FROM (SELECT {key} FROM {table} {where} ORDER BY ts DESC, {key} DESC LIMIT ?) c "
+                   f"JOIN alerts a ON a.id = c.{key} ORDER BY a.id DESC")
+        else:
+            order = "ts DESC, id DESC" if since is not None or until is not None else "id DESC"
+            sql = f"SELECT entry FROM {table} {where} ORDER BY {order} LIMIT ?"
+        return self._query(sql, params + [limit])
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM alerts").fetchone()[0]
+
+    def max_id(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM alerts").fetchone()[0]
+
+    def iter_after(self, alert_id: int = 0, batch_size: int = 5000) -> Iterator[Tuple[int, float, Dict[str, Any]]]:
+        """(id, ts, alerta) con id mayor a `alert_id`, en orden de inserción"""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, ts, entry FROM alerts WHERE id > ? ORDER BY id LIMIT ?",
+                    (alert_id, batch_size)
+                ).fetchall()
+            for row_id, ts, entry in rows:
+                yield row_id, ts, json.loads(entry)
+            if len(rows) < batch_size:
+                return
+            alert_id = rows[-1][0]
+
+    def import_jsonl(self, jsonl_path: Union[str, Path], batch_size: int = 5000) -> int:
+        """Carga un segmento del journal (.jsonl o .jsonl.gz); retorna las alertas importadas
+
+        Las líneas dañadas se omiten. Se llama solo con la base vacía, así que
+        borrar alerts.db reconstruye el índice desde el journal.
+        """
+        jsonl_path = Path(jsonl_path)
+        if not jsonl_path.exists():
+            return 0
+        imported, batch = 0, []
+        opener = gzip.open if jsonl_path.suffix == '.gz' else open
+        with opener(jsonl_path, 'rt') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    entry_time(entry)
+                except (ValueError, KeyError, TypeError):
+                    continue
+                batch.append(entry)
+                if len(batch) >= batch_size:
+                    imported += len(self.add_many(batch))
+                    batch = []
+        if batch:
+            imported += len(self.add_many(batch))
+        return imported
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,323 @@
+"""
+Escritura de alertas en segundo plano con group commit
+Una tarea consume una cola acotada y escribe lotes en alerts.jsonl y en el
+almacén SQLite; el handler de /alert solo encola
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger("fusion")
+
+DEFAULT_ALERT_WRITER_CONFIG = {
+    'max_queue': 10000,          # alertas pendientes antes de frenar a /alert
+    'max_batch': 500,            # alertas por group commit
+    'fsync_every': 100,          # fsync tras N alertas escritas...
+    'fsync_interval_ms': 1000,   # ...o tras T ms con alertas sin sincronizar
+    'rotate_mb': 100,            # tamaño máximo del segmento activo (0 = sin límite)
+    'rotate_interval': 86400,    # antigüedad máxima del segmento en segundos (0 = sin límite)
+    'compress': True,            # gzip de los segmentos rotados
+    'keep_segments': 0,          # segmentos rotados a conservar (0 = todos)
+    'store_retry_ms': 1000,      # espera antes de reintentar lotes que SQLite no aceptó
+}
+
+_STOP = object()
+
+
+class WriterUnavailableError(RuntimeError):
+    """El escritor no puede aceptar alertas (tarea detenida o journal sin escribir)"""
+
+
+def journal_segments(log_file: Path) -> List[Path]:
+    """Segmentos rotados (más viejos primero) seguidos del archivo activo"""
+    rotated = sorted(
+        path for path in log_file.parent.glob(f"{log_file.stem}-*")
+        # Un .gz junto a su original es una compresión interrumpida: vale el original
+        if path.name.endswith(log_file.suffix)
+        or (path.name.endswith(log_file.suffix + '.gz') and not path.with_suffix('').exists())
+    )
+    return rotated + ([log_file] if log_file.exists() else [])
+
+
+def _first_timestamp(path: Path) -> Optional[float]:
+    try:
+        with open(path, 'r') as f:
+            return datetime.fromisoformat(json.loads(f.readline())["timestamp"]).timestamp()
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+class AlertWriter:
+    """Journal JSONL + almacén escritos por lotes desde una cola acotada
+
+    Cada lote se escribe con un solo write, una transacción SQLite y, según
+    la política, un fsync. `on_commit(entries, ids)` corre en el event loop
+    después de cada lote (p. ej. para actualizar estadísticas). Si la
+    transacción falla, las alertas (ya en el journal) se reintentan junto con
+    el lote siguiente o tras `store_retry_ms`; lo mismo si falla el journal
+    (disco lleno, EIO), antes del lote siguiente. Con `max_queue` alertas sin
+    escribir en el journal el escritor deja de aceptar (`accepting`).
+    """
+
+    def __init__(self, log_file: Path, store=None,
+                 on_commit: Optional[Callable[[List[Dict[str, Any]], List[Optional[int]]], None]] = None,
+                 config: Optional[Dict[str, Any]] = None):
+        self.log_file = Path(log_file)
+        self.store = store
+        self.on_commit = on_commit
+        self.config = dict(DEFAULT_ALERT_WRITER_CONFIG)
+        self.config.update(config or {})
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._file = None
+        self._segment_started = 0.0
+        self._unsynced = 0
+        self._last_sync = 0.0
+        self._compressions: List[asyncio.Future] = []
+        self._prune_lock = threading.Lock()
+        # Alertas que el journal no pudo escribir y las que el almacén aún no aceptó
+        self._unjournaled: List[Dict[str, Any]] = []
+        self._unstored: List[Dict[str, Any]] = []
+        self.stats = {"written": 0, "stored": 0, "batches": 0, "fsyncs": 0, "rotations": 0,
+                      "errors": 0, "journal_errors": 0, "store_errors": 0, "max_batch_seen": 0}
+
+    def start(self):
+        # La cola se crea dentro del event loop en ejecución
+        self.queue = asyncio.Queue(maxsize=self.config['max_queue'])
+        self._open()
+        self._task = asyncio.create_task(self._run())
+        self._task.add_done_callback(self._on_task_done)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def accepting(self) -> bool:
+        """En ejecución y con el journal al día (o con margen para reintentar)"""
+        return self.running and len(self._unjournaled) < self.config['max_queue']
+
+    def _on_task_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"El escritor de alertas se detuvo: {task.exception()!r}")
+
+    async def submit(self, entry: Dict[str, Any]):
+        """Encola una alerta; solo espera si la cola está llena"""
+        if not self.running:
+            # Sin consumidor la cola se llenaría y /alert quedaría bloqueado
+            raise WriterUnavailableError("El escritor de alertas no está en ejecución")
+        if not self.accepting:
+            raise WriterUnavailableError(f"{len(self._unjournaled)} alertas sin escribir en el journal")
+        await self.queue.put(entry)
+
+    def _open(self):
+        self.log_file.parent.mkdir(parents=True, exist_ok=True)
+        existing = self.log_file.exists() and self.log_file.stat().st_size > 0
+        self._file = open(self.log_file, 'a')
+        self._segment_started = (_first_timestamp(self.log_file) if existing else None) or time.time()
+        self._last_sync = time.monotonic()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self.stats["fsyncs"] += 1
+
+    def _should_rotate(self) -> bool:
+        rotate_bytes = self.config['rotate_mb'] * 1024 * 1024
+        if rotate_bytes and self._file.tell() >= rotate_bytes:
+            return True
+        interval = self.config['rotate_interval']
+        return bool(interval) and self._file.tell() > 0 and time.time() - self._segment_started >= interval
+
+    def _rotate(self) -> Optional[Path]:
+        """Cierra el segmento activo y lo renombra con su fecha de inicio"""
+        self._sync()
+        self._file.close()
+        stamp = datetime.fromtimestamp(self._segment_started).strftime('%Y%m%d-%H%M%S-%f')
+        rotated = self.log_file.with_name(f"{self.log_file.stem}-{stamp}{self.log_file.suffix}")
+        suffix = 1
+        while rotated.exists() or rotated.with_name(rotated.name + '.gz').exists():
+            rotated = self.log_file.with_name(f"{self.log_file.stem}-{stamp}-{suffix}{self.log_file.suffix}")
+            suffix += 1
+        os.replace(self.log_file, rotated)
+        self._open()
+        self.stats["rotations"] += 1
+        logger.info(f"Segmento de alertas rotado: {rotated.name}")
+        return rotated
+
+    def _compress(self, path: Path):
+        target = path.with_name(path.name + '.gz')
+        with open(path, 'rb') as src, gzip.open(target, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+        keep = self.config['keep_segments']
+        if keep:
+            # Varias compresiones pueden terminar juntas: se poda de a una
+            with self._prune_lock:
+                for old in journal_segments(self.log_file)[:-1][:-keep]:
+                    old.unlink(missing_ok=True)
+
+    def _write_journal(self, batch: List[Dict[str, Any]]):
+        """Corre en un hilo: un write al journal y fsync según política"""
+        start = self._file.tell()
+        try:
+            self._file.write(''.join(json.dumps(entry) + '\n' for entry in batch))
+            self._file.flush()
+        except Exception:
+            try:
+                # Sin media línea en el journal: el reintento escribe el lote completo
+                self._file.truncate(start)
+            except Exception:
+                pass
+            raise
+        self._unsynced += len(batch)
+        if self._unsynced >= self.config['fsync_every'] or self._sync_due():
+            self._sync()
+
+    def _sync_due(self) -> bool:
+        return self._unsynced > 0 and \
+            (time.monotonic() - self._last_sync) * 1000 >= self.config['fsync_interval_ms']
+
+    async def _collect(self) -> List[Dict[str, Any]]:
+        """Espera la primera alerta (o el plazo de fsync o de reintento) y toma las que ya estén en cola"""
+        timeouts = []
+        if self._unsynced:
+            timeouts.append(self.config['fsync_interval_ms'] / 1000 - (time.monotonic() - self._last_sync))
+        if self._unstored or self._unjournaled:
+            timeouts.append(self.config['store_retry_ms'] / 1000)
+        if timeouts:
+            try:
+                first = await asyncio.wait_for(self.queue.get(), max(min(timeouts), 0.001))
+            except asyncio.TimeoutError:
+                return []
+        else:
+            first = await self.queue.get()
+        batch = [first]
+        while len(batch) < self.config['max_batch'] and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _store_pending(self):
+        """Inserta en el almacén lo que está en el journal y aún no se guardó"""
+        pending, self._unstored = self._unstored, []
+        if not pending:
+            return
+        try:
+            ids = await asyncio.to_thread(self.store.add_many, pending) if self.store is not None \
+                else [None] * len(pending)
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.stats["store_errors"] += 1
+            # Las nuevas pudieron llegar mientras tanto: se conserva el orden del journal
+            self._unstored = pending + self._unstored
+            overflow = len(self._unstored) - self.config['max_queue']
+            if overflow > 0:
+                # Siguen en alerts.jsonl: borrar alerts.db las reimporta al arrancar
+                del self._unstored[:overflow]
+                logger.error(f"{overflow} alertas quedan solo en el journal (almacén no disponible)")
+            logger.error(f"Error guardando {len(pending)} alertas en el almacén, se reintentará: {e}")
+            return
+        self.stats["stored"] += len(pending)
+        if self.on_commit is not None:
+            try:
+                self.on_commit(pending, ids)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Error actualizando tras guardar {len(pending)} alertas: {e}")
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        # Lo que el journal no aceptó antes va primero, en orden de llegada
+        batch, self._unjournaled = self._unjournaled + batch, []
+        if not batch:
+            return
+        try:
+            await asyncio.to_thread(self._write_journal, batch)
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.stats["journal_errors"] += 1
+            self._unjournaled = batch
+            logger.error(f"Error escribiendo {len(batch)} alertas en el journal, se reintentará: {e}")
+            return
+        self.stats["written"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(batch))
+        self._unstored.extend(batch)
+        await self._store_pending()
+        if self._should_rotate():
+            try:
+                rotated = await asyncio.to_thread(self._rotate)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Error rotando {self.log_file}: {e}")
+                return
+            if self.config['compress']:
+                # La compresión no frena el siguiente lote
+                future = asyncio.ensure_future(asyncio.to_thread(self._compress, rotated))
+                future.add_done_callback(self._on_compress_done)
+                self._compressions.append(future)
+                self._compressions = [f for f in self._compressions if not f.done()]
+
+    def _on_compress_done(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            self.stats["errors"] += 1
+            logger.error(f"Error comprimiendo segmento de alertas: {future.exception()}")
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            stopping = any(entry is _STOP for entry in batch)
+            if stopping:
+                batch = batch[:next(i for i, entry in enumerate(batch) if entry is _STOP)]
+            if batch or self._unjournaled:
+                await self._flush(batch)
+            else:
+                await self._store_pending()
+                if self._sync_due():
+                    try:
+                        await asyncio.to_thread(self._sync)
+                    except Exception as e:
+                        self.stats["errors"] += 1
+                        logger.error(f"Error sincronizando {self.log_file}: {e}")
+            if stopping:
+                return
+
+    async def stop(self):
+        """Escribe lo pendiente, sincroniza y cierra el segmento"""
+        if self._task is not None and not self._task.done():
+            # Lo encolado antes de la marca se escribe completo
+            await self.queue.put(_STOP)
+            await self._task
+        if self._unjournaled:
+            await self._flush([])
+        if self._unjournaled:
+            logger.error(f"Se pierden {len(self._unjournaled)} alertas: no se pudieron escribir en el journal")
+        await self._store_pending()
+        if self._unstored:
+            logger.error(f"{len(self._unstored)} alertas quedan solo en el journal (almacén no disponible)")
+        if self._compressions:
+            await asyncio.gather(*self._compressions, return_exceptions=True)
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self._file = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "running": self.running,
+            "accepting": self.accepting,
+            "unjournaled": len(self._unjournaled),
+            "unsynced": self._unsynced,
+            "unstored": len(self._unstored),
+            **self.stats,
+        }
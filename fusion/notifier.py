@@ -0,0 +1,233 @@
+"""
+Notificaciones a Telegram en segundo plano
+Sesión HTTP única, cola acotada, límite de tasa por chat y agrupación de
+alertas cercanas en un solo mensaje con una foto
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+logger = logging.getLogger("fusion")
+
+DEFAULT_NOTIFIER_CONFIG = {
+    'api_url': 'https://api.telegram.org',
+    'max_queue': 1000,          # alertas pendientes; al llenarse se descarta la más vieja
+    'coalesce_window': 5.0,     # segundos: tras un envío, las alertas siguientes se agrupan
+    'rate': 1.0,                # mensajes por segundo al chat (límite de Telegram por chat)
+    'burst': 1,
+    'per_minute': 20,           # límite de Telegram para grupos (0 = sin límite)
+    'timeout': 15,
+    'max_retries': 3,
+    'send_photo': True,
+}
+
+CAPTION_LIMIT = 1024  # caracteres máximos de la leyenda de una foto
+
+
+class TokenBucket:
+    """Límite de tasa: `rate` fichas por segundo, hasta `capacity` acumuladas"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        self._refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= 1
+
+    def drain(self, seconds: float):
+        """Tras un 429, no entrega fichas hasta que pase `retry_after`"""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+def build_summary(alerts: List[Dict[str, Any]]) -> str:
+    """Mensaje con el total de detecciones por clase de las alertas agrupadas"""
+    class_counts: Dict[str, int] = {}
+    cameras: List[str] = []
+    detections = 0
+    for alert in alerts:
+        for det in alert["detections"]:
+            class_name = det.get('class_name', 'unknown')
+            class_counts[class_name] = class_counts.get(class_name, 0) + 1
+            detections += 1
+        camera_id = alert.get("camera_id")
+        if camera_id and camera_id not in cameras:
+            cameras.append(camera_id)
+
+    message = "🚨 ALERTA DE DETECCIÓN\n\n"
+    if len(alerts) > 1:
+        message += f"🔔 Alertas agrupadas: {len(alerts)}\n"
+    if cameras:
+        message += f"📷 Cámaras: {', '.join(cameras)}\n"
+    message += f"📊 Detecciones: {detections}\n"
+    for class_name, count in class_counts.items():
+        message += f"  • {class_name}: {count}\n"
+    first = datetime.fromtimestamp(alerts[0]["at"]).strftime('%Y-%m-%d %H:%M:%S')
+    last = datetime.fromtimestamp(alerts[-1]["at"]).strftime('%H:%M:%S')
+    message += f"\n⏰ {first}" + (f" - {last}" if len(alerts) > 1 else "")
+    return message
+
+
+class TelegramNotifier:
+    """Envía alertas a un chat sin bloquear /alert
+
+    La primera alerta sale de inmediato; las que llegan durante los
+    `coalesce_window` segundos siguientes se envían juntas al cerrar la
+    ventana, como un resumen con la foto de la alerta más reciente. Los JPEG
+    se suben tal como llegaron, sin decodificar ni recomprimir.
+    """
+
+    def __init__(self, token: str, chat_id: str, config: Optional[Dict[str, Any]] = None):
+        self.token = token
+        self.chat_id = chat_id
+        self.config = dict(DEFAULT_NOTIFIER_CONFIG)
+        self.config.update(config or {})
+        self.api_url = self.config['api_url'].rstrip('/')
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._buckets = [TokenBucket(self.config['rate'], self.config['burst'])]
+        if self.config['per_minute']:
+            self._buckets.append(TokenBucket(self.config['per_minute'] / 60, self.config['per_minute']))
+        self._last_sent = 0.0
+        self._collecting: List[Dict[str, Any]] = []
+        self.stats = {"queued": 0, "dropped": 0, "messages": 0, "photos": 0,
+                      "coalesced": 0, "rate_limited": 0, "errors": 0}
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.token and self.chat_id)
+
+    def start(self):
+        # La sesión y la cola se crean dentro del event loop en ejecución
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.config['timeout']))
+        self.queue = asyncio.Queue(maxsize=self.config['max_queue'])
+        self._task = asyncio.create_task(self._run())
+
+    def notify(self, detections: List[Dict[str, Any]], image_data: Optional[bytes] = None,
+               camera_id: Optional[str] = None):
+        """Encola una alerta; nunca espera a Telegram"""
+        if not self.configured:
+            logger.warning("Telegram no configurado")
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.stats["dropped"] += 1
+        self.queue.put_nowait({"detections": detections, "image": image_data,
+                               "camera_id": camera_id, "at": time.time()})
+        self.stats["queued"] += 1
+
+    async def _call(self, method: str, fields: Dict[str, Any], photo: Optional[bytes] = None) -> bool:
+        """POST a la Bot API respetando el límite de tasa y los 429"""
+        url = f"{self.api_url}/bot{self.token}/{method}"
+        for attempt in range(self.config['max_retries'] + 1):
+            for bucket in self._buckets:
+                await bucket.acquire()
+            # Un FormData solo se puede enviar una vez: se arma en cada intento
+            kwargs = {"data": self._form(fields, photo)} if photo is not None else {"json": fields}
+            try:
+                async with self.session.post(url, **kwargs) as response:
+                    if response.status == 200:
+                        return True
+                    if response.status == 429:
+                        try:
+                            retry_after = (await response.json()).get("parameters", {}).get("retry_after", 1)
+                        except (aiohttp.ContentTypeError, ValueError):
+                            retry_after = 1
+                        self.stats["rate_limited"] += 1
+                        logger.warning(f"Telegram limitó el envío; reintento en {retry_after}s")
+                        for bucket in self._buckets:
+                            bucket.drain(retry_after)
+                        continue
+                    logger.error(f"Error enviando a Telegram: {response.status}")
+                    return False
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Error en Telegram: {e}")
+                await asyncio.sleep(min(2 ** attempt, 10))
+        self.stats["errors"] += 1
+        return False
+
+    def _form(self, fields: Dict[str, Any], photo: bytes) -> aiohttp.FormData:
+        form = aiohttp.FormData()
+        for name, value in fields.items():
+            form.add_field(name, str(value))
+        form.add_field('photo', photo, filename='detection.jpg', content_type='image/jpeg')
+        return form
+
+    async def _send(self, alerts: List[Dict[str, Any]]):
+        """Un resumen y una foto por grupo; si el resumen cabe, va como leyenda de la foto"""
+        message = build_summary(alerts)
+        images = [alert["image"] for alert in alerts if alert["image"]]
+        image = images[-1] if images and self.config['send_photo'] else None
+        if len(alerts) > 1:
+            self.stats["coalesced"] += len(alerts) - 1
+        if image is not None and len(message) <= CAPTION_LIMIT:
+            if await self._call('sendPhoto', {"chat_id": self.chat_id, "caption": message}, image):
+                self.stats["messages"] += 1
+                self.stats["photos"] += 1
+                logger.info("Alerta enviada a Telegram")
+            return
+        if await self._call('sendMessage', {"chat_id": self.chat_id, "text": message}):
+            self.stats["messages"] += 1
+            logger.info("Alerta enviada a Telegram")
+            if image is not None and await self._call('sendPhoto', {"chat_id": self.chat_id}, image):
+                self.stats["photos"] += 1
+
+    async def _run(self):
+        window = self.config['coalesce_window']
+        while True:
+            self._collecting = alerts = [await self.queue.get()]
+            # Dentro de la ventana del último envío se acumula hasta que se cierre
+            deadline = self._last_sent + window
+            while time.monotonic() < deadline:
+                try:
+                    alerts.append(await asyncio.wait_for(self.queue.get(), deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    break
+            while not self.queue.empty():
+                alerts.append(self.queue.get_nowait())
+            self._collecting = []
+            try:
+                await self._send(alerts)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Error en Telegram: {e}")
+            self._last_sent = time.monotonic()
+
+    async def stop(self, timeout: float = 5.0):
+        """Intenta enviar lo pendiente (sin esperar la ventana) y cierra la sesión"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        pending, self._collecting = self._collecting, []
+        while self.queue is not None and not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        if pending:
+            try:
+                await asyncio.wait_for(self._send(pending), timeout)
+            except Exception as e:
+                logger.error(f"No se enviaron {len(pending)} alertas pendientes a Telegram: {e}")
+        if self.session is not None:
+            await self.session.close()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "configured": self.configured,
+            "pending": self.queue.qsize() if self.queue is not None else 0,
+            **self.stats,
+        }
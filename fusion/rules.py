@@ -1,5 +1,8 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence
 from abc import ABC, abstractmethod
+import time
+
+import numpy as np
 
 class DetectionRule(ABC):
     """Clase base para reglas de detección"""
@@ -83,3 +86,237 @@ class TimeWindowRule(DetectionRule):
         
         return filtered
 
+
+# --- Cadenas de reglas declaradas en configuración ---
+
+def _class_name(det: Dict[str, Any]) -> str:
+    return det.get('class_name', 'unknown')
+
+
+class CompiledRuleChain:
+    """Cadena de reglas declarada en configuración
+    
+    Los parámetros (incluidos los valores por clase) se resuelven una vez al
+    construir la cadena. Los predicados por detección (confianza, clases,
+    área, relación de aspecto) se evalúan como una máscara sobre el lote
+    columnar (`evaluate_mask`) y después el mínimo de detecciones. La
+    ventana de tiempo no decide qué se registra: `throttle` la aplica solo a
+    las notificaciones.
+    """
+    
+    ELEMENT_RULES = ('confidence', 'classes', 'bbox_area', 'bbox_aspect')
+    GROUP_RULES = ('min_count', 'time_window')
+    
+    def __init__(self, specs: List[Dict[str, Any]]):
+        self.element_rules = []
+        self.min_count = 0
+        self.time_windows = []
+        for raw in specs:
+            spec = dict(raw)
+            rule_type = spec.get('type')
+            if rule_type not in self.ELEMENT_RULES + self.GROUP_RULES:
+                raise ValueError(f"Regla desconocida: {rule_type} "
+                                 f"(opciones: {', '.join(self.ELEMENT_RULES + self.GROUP_RULES)})")
+            spec['per_class'] = spec.get('per_class') or {}
+            if rule_type == 'classes':
+                spec['allow'] = set(spec.get('allow') or [])
+                spec['deny'] = set(spec.get('deny') or [])
+            elif rule_type in ('bbox_area', 'bbox_aspect'):
+                # Límites por clase ya resueltos: {clase: (mín, máx)}
+                default = (spec.get('min', 0.0), spec.get('max', float('inf')))
+                spec['limits'] = default
+                spec['per_class'] = {
+                    name: (limits.get('min', default[0]), limits.get('max', default[1]))
+                    for name, limits in spec['per_class'].items()
+                }
+            if rule_type == 'min_count':
+                self.min_count = max(self.min_count, spec.get('count', 1))
+            elif rule_type == 'time_window':
+                self.time_windows.append(spec)
+            else:
+                self.element_rules.append(spec)
+        # Última notificación por (cámara, clase) para las ventanas de tiempo
+        self.last_alert_time: Dict[tuple, float] = {}
+    
+    def evaluate(self, detections: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Detecciones que cumplen los predicados y el mínimo; estas se registran"""
+        batch = DetectionBatch.from_records(detections)
+        return batch.select(evaluate_mask(self, batch))
+    
+    def throttle(self, detections: List[Dict[str, Any]], camera_id: Optional[str] = None,
+                 now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Ventana de tiempo: una notificación por clase y cámara cada `seconds`
+        
+        `now` es el momento de la alerta (frame_timestamp), no el de llegada,
+        para que un respaldo reenviado de golpe se mida con sus propios tiempos.
+        """
+        if not self.time_windows or not detections:
+            return detections
+        now = time.time() if now is None else now
+        passing = set(_class_name(det) for det in detections)
+        for spec in self.time_windows:
+            allowed = set()
+            for class_name in passing:
+                key = (camera_id, class_name)
+                window = spec['per_class'].get(class_name, spec.get('seconds', 60))
+                if now - self.last_alert_time.get(key, float('-inf')) >= window:
+                    allowed.add(class_name)
+            passing = allowed
+        for class_name in passing:
+            self.last_alert_time[(camera_id, class_name)] = now
+        return [det for det in detections if _class_name(det) in passing]
+
+
+# --- Evaluación columnar ---
+
+CORE_COLUMNS = ('class_name', 'confidence', 'bbox')
+
+
+def _intern_classes(names) -> tuple:
+    """(nombres distintos, índice de cada detección) sin ordenar objetos"""
+    distinct = list(dict.fromkeys(names))
+    codes = {name: code for code, name in enumerate(distinct)}
+    index = np.fromiter(map(codes.__getitem__, names), dtype=np.int64, count=len(names))
+    return distinct, index
+
+
+class DetectionBatch:
+    """Detecciones como arrays: clase (índice en `class_names`), confianza y bbox xyxy
+    
+    Inferencia envía las detecciones en formato columnar; el resto de columnas
+    (class, track_id, track_event...) se conserva tal cual para `select`.
+    """
+    
+    def __init__(self, class_names: Sequence[str], class_index: np.ndarray, confidence: np.ndarray,
+                 bbox: np.ndarray, records: Optional[List[Dict[str, Any]]] = None,
+                 extra: Optional[Dict[str, list]] = None):
+        self.class_names = list(class_names)
+        self.class_index = class_index
+        self.confidence = confidence
+        self.bbox = bbox
+        self.records = records
+        self.extra = extra or {}
+    
+    def __len__(self) -> int:
+        return len(self.confidence)
+    
+    @classmethod
+    def from_payload(cls, detections) -> "DetectionBatch":
+        """Columnas (dict de listas) o, por compatibilidad, lista de dicts"""
+        if isinstance(detections, dict):
+            return cls.from_columns(detections)
+        if isinstance(detections, list):
+            return cls.from_records(detections)
+        raise ValueError("detections debe ser un objeto de columnas o una lista")
+    
+    @classmethod
+    def from_records(cls, detections: List[Dict[str, Any]]) -> "DetectionBatch":
+        """Desde el formato estándar (lista de dicts); las detecciones sin bbox quedan con área 0"""
+        class_names, class_index = _intern_classes([det.get('class_name', 'unknown') for det in detections])
+        confidence = np.fromiter((det.get('confidence', 0) for det in detections), dtype=np.float64,
+                                 count=len(detections))
+        empty = {'x1': 0, 'y1': 0, 'x2': 0, 'y2': 0}
+        bbox = np.array([
+            (box['x1'], box['y1'], box['x2'], box['y2'])
+            for box in (det.get('bbox') or empty for det in detections)
+        ], dtype=np.float64).reshape(-1, 4)
+        return cls(class_names, class_index, confidence, bbox, records=detections)
+    
+    @classmethod
+    def from_columns(cls, columns: Dict[str, Any]) -> "DetectionBatch":
+        """Desde el formato columnar de inferencia (class_name, confidence, bbox [x1, y1, x2, y2])"""
+        confidence = np.asarray(columns.get('confidence', []), dtype=np.float64).reshape(-1)
+        count = len(confidence)
+        class_names, class_index = _intern_classes(columns.get('class_name') or ['unknown'] * count)
+        bbox = np.asarray(columns.get('bbox') or np.zeros((count, 4)), dtype=np.float64).reshape(-1, 4)
+        extra = {name: list(values) for name, values in columns.items() if name not in CORE_COLUMNS}
+        lengths = {len(class_index), len(bbox), *(len(values) for values in extra.values())}
+        if lengths - {count}:
+            raise ValueError(f"Columnas de detecciones con largos distintos: {sorted(lengths)}")
+        return cls(class_names, class_index, confidence, bbox, extra=extra)
+    
+    def per_class(self, default: float, overrides: Dict[str, float]) -> np.ndarray:
+        """Parámetro por detección según su clase (una búsqueda por clase distinta)"""
+        if not overrides:
+            return np.float64(default)
+        values = np.array([overrides.get(name, default) for name in self.class_names], dtype=np.float64)
+        return values[self.class_index]
+    
+    def select(self, mask: np.ndarray) -> List[Dict[str, Any]]:
+        """Detecciones que pasan la máscara, en el formato estándar (para registro y Telegram)"""
+        indices = np.flatnonzero(mask).tolist()
+        if self.records is not None:
+            return [self.records[i] for i in indices]
+        # Una conversión a listas por columna, solo de las filas seleccionadas
+        class_names = [self.class_names[code] for code in self.class_index[indices].tolist()]
+        confidences = self.confidence[indices].tolist()
+        boxes = self.bbox[indices].tolist()
+        detections = [
+            {"class_name": name, "confidence": conf, "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}}
+            for name, conf, (x1, y1, x2, y2) in zip(class_names, confidences, boxes)
+        ]
+        for name, values in self.extra.items():
+            for detection, i in zip(detections, indices):
+                detection[name] = values[i]
+        return detections
+
+
+def evaluate_mask(chain: CompiledRuleChain, batch: DetectionBatch) -> np.ndarray:
+    """Máscara de las detecciones del lote que cumplen los predicados y el mínimo de la cadena"""
+    mask = np.ones(len(batch), dtype=bool)
+    for spec in chain.element_rules:
+        rule_type, per_class = spec['type'], spec['per_class']
+        if rule_type == 'confidence':
+            mask &= batch.confidence >= batch.per_class(spec.get('min', 0.0), per_class)
+        elif rule_type == 'classes':
+            allowed = np.array([
+                (not spec['allow'] or name in spec['allow']) and name not in spec['deny']
+                for name in batch.class_names
+            ], dtype=bool)
+            if len(allowed):
+                mask &= allowed[batch.class_index]
+        else:
+            width = batch.bbox[:, 2] - batch.bbox[:, 0]
+            height = batch.bbox[:, 3] - batch.bbox[:, 1]
+            values = width * height if rule_type == 'bbox_area' else width / np.maximum(height, 1e-6)
+            minimum = batch.per_class(spec['limits'][0], {k: v[0] for k, v in per_class.items()})
+            maximum = batch.per_class(spec['limits'][1], {k: v[1] for k, v in per_class.items()})
+            mask &= (values >= minimum) & (values <= maximum)
+    if np.count_nonzero(mask) < chain.min_count:
+        mask[:] = False
+    return mask
+
+
+def default_rule_specs(fusion_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Cadena equivalente a alert_threshold, enabled_classes y time_window"""
+    specs = [{'type': 'confidence', 'min': fusion_config.get('alert_threshold', 0.5)}]
+    if fusion_config.get('enabled_classes'):
+        specs.append({'type': 'classes', 'allow': fusion_config['enabled_classes']})
+    if fusion_config.get('time_window'):
+        specs.append({'type': 'time_window', 'seconds': fusion_config['time_window']})
+    return specs
+
+
+class RuleSet:
+    """Cadena por defecto más cadenas propias por cámara (`fusion.cameras.<id>.rules`)"""
+    
+    def __init__(self, fusion_config: Dict[str, Any]):
+        self.default = CompiledRuleChain(fusion_config.get('rules') or default_rule_specs(fusion_config))
+        self.cameras = {
+            str(camera_id): CompiledRuleChain(camera['rules'])
+            for camera_id, camera in (fusion_config.get('cameras') or {}).items()
+            if camera and camera.get('rules')
+        }
+    
+    def chain(self, camera_id: Optional[str]) -> CompiledRuleChain:
+        return self.cameras.get(str(camera_id), self.default) if camera_id is not None else self.default
+    
+    def evaluate(self, detections: List[Dict[str, Any]], camera_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        return self.chain(camera_id).evaluate(detections)
+    
+    def evaluate_mask(self, batch: DetectionBatch, camera_id: Optional[str] = None) -> np.ndarray:
+        return evaluate_mask(self.chain(camera_id), batch)
+    
+    def throttle(self, detections: List[Dict[str, Any]], camera_id: Optional[str] = None,
+                 now: Optional[float] = None) -> List[Dict[str, Any]]:
+        return self.chain(camera_id).throttle(detections, camera_id, now)
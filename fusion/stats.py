@@ -0,0 +1,223 @@
+"""
+Estadísticas de alertas mantenidas de forma incremental
+Contadores totales y series por minuto/hora/día, por clase y por cámara
+"""
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+DEFAULT_STATS_CONFIG = {
+    'checkpoint_path': None,      # por defecto <logs_dir>/stats.json
+    'checkpoint_interval': 60,    # segundos entre checkpoints (si hubo cambios)
+    'retention': {                # buckets conservados por resolución
+        'minute': 24 * 60,        # 24 horas
+        'hour': 30 * 24,          # 30 días
+        'day': 3 * 365,           # 3 años
+    },
+}
+
+RESOLUTIONS = ('minute', 'hour', 'day')
+RESOLUTION_SECONDS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def bucket_start(ts: float, resolution: str) -> int:
+    """Inicio del bucket en hora local (los días cortan a medianoche local)"""
+    moment = datetime.fromtimestamp(ts)
+    if resolution == 'minute':
+        moment = moment.replace(second=0, microsecond=0)
+    elif resolution == 'hour':
+        moment = moment.replace(minute=0, second=0, microsecond=0)
+    else:
+        moment = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return int(moment.timestamp())
+
+
+def empty_bucket() -> Dict[str, Any]:
+    return {"alerts": 0, "detections": {}, "cameras": {}}
+
+
+def add_counts(target: Dict[str, int], counts: Dict[str, int]):
+    for key, value in counts.items():
+        target[key] = target.get(key, 0) + value
+
+
+def copy_bucket(bucket: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "alerts": bucket["alerts"],
+        "detections": dict(bucket["detections"]),
+        "cameras": {
+            camera_id: {"alerts": camera["alerts"], "detections": dict(camera["detections"])}
+            for camera_id, camera in bucket["cameras"].items()
+        },
+    }
+
+
+def write_checkpoint(path: Union[str, Path], data: Dict[str, Any]):
+    """Checkpoint atómico (archivo temporal + rename). Bloqueante: llamar con asyncio.to_thread"""
+    path = Path(path)
+    # Temporal propio de cada escritura: un guardado en curso no pisa al siguiente
+    tmp = path.with_suffix(f"{path.suffix}.{threading.get_ident()}.tmp")
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class AlertStats:
+    """Contadores y rollups actualizados con cada alerta registrada
+
+    Cada bucket guarda alertas, detecciones por clase y lo mismo por cámara,
+    así que cualquier combinación de filtros se responde sin releer alertas.
+    `last_id` marca la última alerta del almacén contada, para ponerse al día
+    desde un checkpoint.
+    """
+
+    def __init__(self, retention: Optional[Dict[str, int]] = None):
+        self.retention = {**DEFAULT_STATS_CONFIG['retention'], **(retention or {})}
+        self.total_alerts = 0
+        self.class_counts: Dict[str, int] = {}
+        self.camera_counts: Dict[str, int] = {}
+        self.last_alert: Optional[str] = None
+        self.last_ts: Optional[float] = None
+        self.last_id = 0
+        self.buckets: Dict[str, Dict[int, Dict[str, Any]]] = {r: {} for r in RESOLUTIONS}
+        self.dirty = False
+
+    def record(self, entry: Dict[str, Any], ts: float, alert_id: Optional[int] = None):
+        """Cuenta una alerta (`ts` en segundos epoch)"""
+        per_class: Dict[str, int] = {}
+        for det in entry.get("detections", []):
+            class_name = det.get("class_name", "unknown")
+            per_class[class_name] = per_class.get(class_name, 0) + 1
+        camera_id = str((entry.get("metadata") or {}).get("camera_id") or "unknown")
+
+        self.total_alerts += 1
+        add_counts(self.class_counts, per_class)
+        self.camera_counts[camera_id] = self.camera_counts.get(camera_id, 0) + 1
+        if self.last_ts is None or ts >= self.last_ts:
+            self.last_ts = ts
+            self.last_alert = entry.get("timestamp")
+        if alert_id is not None:
+            self.last_id = max(self.last_id, alert_id)
+
+        for resolution in RESOLUTIONS:
+            buckets = self.buckets[resolution]
+            start = bucket_start(ts, resolution)
+            bucket = buckets.get(start)
+            if bucket is None:
+                bucket = buckets[start] = empty_bucket()
+                self._prune(resolution, start)
+            bucket["alerts"] += 1
+            add_counts(bucket["detections"], per_class)
+            camera = bucket["cameras"].get(camera_id)
+            if camera is None:
+                camera = bucket["cameras"][camera_id] = {"alerts": 0, "detections": {}}
+            camera["alerts"] += 1
+            add_counts(camera["detections"], per_class)
+        self.dirty = True
+
+    def _prune(self, resolution: str, newest: int):
+        """Descarta buckets más viejos que la retención (en orden de inserción)"""
+        buckets = self.buckets[resolution]
+        cutoff = newest - self.retention[resolution] * RESOLUTION_SECONDS[resolution]
+        while buckets:
+            oldest = next(iter(buckets))
+            if oldest > cutoff:
+                break
+            del buckets[oldest]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Totales para /stats"""
+        return {
+            "total_alerts": self.total_alerts,
+            "class_counts": dict(self.class_counts),
+            "camera_counts": dict(self.camera_counts),
+            "last_alert": self.last_alert,
+        }
+
+    def series(self, resolution: str, since: Optional[float] = None, until: Optional[float] = None,
+               camera_id: Optional[str] = None, class_name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Buckets dentro del rango, opcionalmente de una cámara y/o clase"""
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Resolución no soportada: {resolution} (opciones: {', '.join(RESOLUTIONS)})")
+        points = []
+        for start in sorted(self.buckets[resolution]):
+            if (since is not None and start + RESOLUTION_SECONDS[resolution] <= since) or \
+                    (until is not None and start > until):
+                continue
+            bucket = self.buckets[resolution][start]
+            if camera_id is not None:
+                bucket = bucket["cameras"].get(camera_id)
+                if bucket is None:
+                    continue
+            point = {
+                "start": start,
+                "time": datetime.fromtimestamp(start).isoformat(),
+                "alerts": bucket["alerts"],
+                "detections": dict(bucket["detections"]),
+            }
+            if class_name is not None:
+                count = bucket["detections"].get(class_name, 0)
+                if not count:
+                    continue
+                point["detections"] = {class_name: count}
+            points.append(point)
+        return points
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_alerts": self.total_alerts,
+            "class_counts": self.class_counts,
+            "camera_counts": self.camera_counts,
+            "last_alert": self.last_alert,
+            "last_ts": self.last_ts,
+            "last_id": self.last_id,
+            # JSON solo admite claves de texto
+            "buckets": {r: {str(k): v for k, v in b.items()} for r, b in self.buckets.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], retention: Optional[Dict[str, int]] = None) -> "AlertStats":
+        stats = cls(retention)
+        stats.total_alerts = data.get("total_alerts", 0)
+        stats.class_counts = data.get("class_counts", {})
+        stats.camera_counts = data.get("camera_counts", {})
+        stats.last_alert = data.get("last_alert")
+        stats.last_ts = data.get("last_ts")
+        stats.last_id = data.get("last_id", 0)
+        for resolution in RESOLUTIONS:
+            buckets = data.get("buckets", {}).get(resolution, {})
+            stats.buckets[resolution] = {int(k): buckets[k] for k in sorted(buckets, key=int)}
+        return stats
+
+    def checkpoint(self) -> Dict[str, Any]:
+        """Copia independiente del estado, para escribirla fuera del event loop (queda limpio)"""
+        data = self.to_dict()
+        data["class_counts"] = dict(self.class_counts)
+        data["camera_counts"] = dict(self.camera_counts)
+        data["buckets"] = {r: {k: copy_bucket(v) for k, v in b.items()} for r, b in data["buckets"].items()}
+        self.dirty = False
+        return data
+
+    def save(self, path: Union[str, Path]):
+        """Checkpoint atómico, sincrónico"""
+        write_checkpoint(path, self.checkpoint())
+
+    @classmethod
+    def load(cls, path: Union[str, Path], retention: Optional[Dict[str, int]] = None) -> Optional["AlertStats"]:
+        """Checkpoint guardado, o None si no existe o está dañado"""
+        try:
+            with open(path, 'r') as f:
+                return cls.from_dict(json.load(f), retention)
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return None
+
+    def catch_up(self, rows: Iterable[Tuple[int, float, Dict[str, Any]]]) -> int:
+        """Cuenta las alertas del almacén posteriores a `last_id`; retorna cuántas"""
+        counted = 0
+        for alert_id, ts, entry in rows:
+            self.record(entry, ts, alert_id)
+            counted += 1
+        return counted
@@ -0,0 +1,9 @@
+"""
+Los módulos del servicio se importan como en el contenedor (/app y /app/utils)
+"""
+import sys
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR.parent / "utils"))
+sys.path.insert(0, str(SERVICE_DIR))
@@ -0,0 +1,90 @@
+import importlib
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="module")
+def service(tmp_path_factory):
+    """alert_service lee configuración y directorios al importarse"""
+    config_dir = tmp_path_factory.mktemp("config")
+    (config_dir / "system_config.yaml").write_text(
+        "fusion:\n  alert_threshold: 0.5\n  time_window: 60\n  telegram:\n    coalesce_window: 0\n"
+    )
+    previous = {name: os.environ.get(name) for name in ("CONFIG_DIR", "LOG_DIR", "BOT_TOKEN", "CHAT_ID")}
+    os.environ.update(CONFIG_DIR=str(config_dir), LOG_DIR=str(tmp_path_factory.mktemp("logs")),
+                      BOT_TOKEN="", CHAT_ID="")
+    sys.modules.pop("alert_service", None)
+    module = importlib.import_module("alert_service")
+    yield module
+    sys.modules.pop("alert_service", None)
+    for name, value in previous.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+def test_health_reports_dead_writer(service):
+    with TestClient(service.app) as client:
+        assert client.get("/health").status_code == 200
+        # Una tarea terminada por cualquier motivo deja de consumir la cola
+        service.alert_writer._task.cancel()
+        response = client.get("/health")
+        assert response.status_code == 503
+        assert response.json()["writer"]["running"] is False
+        assert client.post("/alert", json={"detections": [{"class_name": "person", "confidence": 0.9}]}) \
+            .status_code == 503
+
+
+def test_batch_reports_retryable_error_when_writer_stops_accepting(service, monkeypatch):
+    with TestClient(service.app) as client:
+        calls = []
+        submit = service.alert_writer.submit
+
+        async def failing_after_one(entry):
+            calls.append(entry)
+            if len(calls) > 1:
+                raise service.WriterUnavailableError("journal sin escribir")
+            await submit(entry)
+
+        monkeypatch.setattr(service.alert_writer, "submit", failing_after_one)
+        items = [{"camera_id": "a", "detections": [{"class_name": "person", "confidence": 0.9}]}] * 2
+        results = client.post("/alert/batch", json={"items": items}).json()["results"]
+        assert results[0]["status"] == "alert_sent"
+        assert results[1]["status"] == "error" and results[1]["retry"] is True
+        assert client.post("/alert", json=items[0]).status_code == 503
+
+
+def person(camera_id, frame_timestamp):
+    """Alerta como la envía inferencia: detecciones en columnas"""
+    return {"camera_id": camera_id, "frame_timestamp": frame_timestamp,
+            "detections": {"class": [0], "class_name": ["person"], "confidence": [0.9],
+                           "bbox": [[0, 0, 10, 20]]}}
+
+
+def test_replayed_batch_is_stored_in_full_and_notified_by_frame_time(service, monkeypatch):
+    notified = []
+    monkeypatch.setattr(service.notifier, "notify", lambda detections, image=None, camera_id=None:
+                        notified.append((camera_id, detections)))
+    # Respaldo de inferencia tras una caída: 5 alertas cada 120 s y 5 en el mismo segundo
+    items = [person("c", 1000 + 120 * i) for i in range(5)] + [person("d", 5000) for _ in range(5)]
+    with TestClient(service.app) as client:
+        before = client.get("/stats").json()["total_alerts"]
+        response = client.post("/alert/batch", json={"items": items})
+        assert [r["status"] for r in response.json()["results"]] == ["alert_sent"] * 10
+    # El apagado vacía el escritor: todo quedó registrado y contado
+    with TestClient(service.app) as client:
+        assert client.get("/stats").json()["total_alerts"] == before + 10
+        alerts = client.get("/alerts", params={"camera_id": "d"}).json()["alerts"]
+        assert len(alerts) == 5
+        assert alerts[0]["detections"][0]["bbox"] == {"x1": 0, "y1": 0, "x2": 10, "y2": 20}
+    assert [camera_id for camera_id, _ in notified] == ["c"] * 5 + ["d"]
+
+
+def test_malformed_columns_are_rejected(service):
+    with TestClient(service.app) as client:
+        response = client.post("/alert", json={"detections": {"class_name": ["person"], "confidence": []}})
+        assert response.status_code == 400
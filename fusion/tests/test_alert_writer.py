@@ -0,0 +1,169 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from alert_store import AlertStore
+from alert_writer import AlertWriter, WriterUnavailableError, journal_segments
+
+
+def make_entry(i: int = 0):
+    return {"timestamp": datetime.now().isoformat(), "detections": [{"class_name": "person"}],
+            "count": 1, "metadata": {"camera_id": "a", "n": i}}
+
+
+def journal_lines(log_file):
+    return sum(1 for _ in open(log_file))
+
+
+async def wait_for(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("Condición no alcanzada")
+        await asyncio.sleep(0.01)
+
+
+def test_on_commit_error_keeps_writer_running(tmp_path):
+    committed = []
+
+    def on_commit(entries, ids):
+        committed.extend(ids)
+        if len(committed) == 1:
+            raise ValueError("falla en estadísticas")
+
+    async def run():
+        store = AlertStore(tmp_path / "alerts.db")
+        writer = AlertWriter(tmp_path / "alerts.jsonl", store, on_commit)
+        writer.start()
+        await writer.submit(make_entry(0))
+        await wait_for(lambda: writer.stats["errors"] == 1)
+        for i in range(1, 4):
+            await writer.submit(make_entry(i))
+        await wait_for(lambda: len(committed) == 4)
+        assert writer.running
+        await writer.stop()
+        return store.count()
+
+    assert asyncio.run(run()) == 4
+    assert journal_lines(tmp_path / "alerts.jsonl") == 4
+
+
+def test_failed_store_insert_is_retried(tmp_path):
+    committed = []
+
+    async def run():
+        store = AlertStore(tmp_path / "alerts.db")
+        add_many, failures = store.add_many, [2]
+
+        def flaky(entries):
+            if failures[0]:
+                failures[0] -= 1
+                raise RuntimeError("database is locked")
+            return add_many(entries)
+
+        store.add_many = flaky
+        writer = AlertWriter(tmp_path / "alerts.jsonl", store, lambda entries, ids: committed.extend(ids),
+                             {'store_retry_ms': 10})
+        writer.start()
+        for i in range(3):
+            await writer.submit(make_entry(i))
+        await wait_for(lambda: len(committed) == 3)
+        status = writer.status()
+        await writer.stop()
+        return status, store.count()
+
+    status, stored = asyncio.run(run())
+    assert stored == 3
+    assert status["unstored"] == 0
+    assert status["store_errors"] == 2
+    assert committed == sorted(committed)
+
+
+def test_submit_fails_when_writer_task_died(tmp_path):
+    async def run():
+        writer = AlertWriter(tmp_path / "alerts.jsonl")
+
+        async def broken():
+            raise RuntimeError("tarea rota")
+
+        writer._collect = broken
+        writer.start()
+        await asyncio.sleep(0.01)
+        assert not writer.running
+        assert writer.status()["running"] is False
+        with pytest.raises(RuntimeError):
+            await writer.submit(make_entry())
+        await writer.stop()
+
+    asyncio.run(run())
+
+
+def test_rotation_compresses_and_prunes_segments(tmp_path):
+    log_file = tmp_path / "alerts.jsonl"
+
+    async def run():
+        store = AlertStore(tmp_path / "alerts.db")
+        writer = AlertWriter(log_file, store, config={'rotate_mb': 0.0005, 'max_batch': 1, 'keep_segments': 2})
+        writer.start()
+        for i in range(20):
+            await writer.submit(make_entry(i))
+        await writer.stop()
+        return writer.stats, store.count()
+
+    stats, stored = asyncio.run(run())
+    assert stored == 20
+    assert stats["rotations"] > 2
+    assert stats["errors"] == 0
+    segments = journal_segments(log_file)
+    assert len(segments) == 3
+    assert all(path.name.endswith('.jsonl.gz') for path in segments[:-1])
+
+
+def test_failed_journal_write_is_retried_before_next_batch(tmp_path):
+    committed = []
+
+    async def run():
+        writer = AlertWriter(tmp_path / "alerts.jsonl", on_commit=lambda entries, ids: committed.extend(entries),
+                             config={'store_retry_ms': 10})
+        writer.start()
+        write, failures = writer._write_journal, [2]
+
+        def flaky(batch):
+            if failures[0]:
+                failures[0] -= 1
+                raise OSError(28, "No space left on device")
+            write(batch)
+
+        writer._write_journal = flaky
+        await writer.submit(make_entry(0))
+        await wait_for(lambda: writer.stats["journal_errors"] >= 1)
+        await writer.submit(make_entry(1))
+        await wait_for(lambda: len(committed) == 2)
+        await writer.stop()
+        return writer.stats
+
+    stats = asyncio.run(run())
+    assert stats["journal_errors"] == 2
+    assert [entry["metadata"]["n"] for entry in committed] == [0, 1]
+    assert journal_lines(tmp_path / "alerts.jsonl") == 2
+
+
+def test_writer_stops_accepting_when_journal_backlog_is_full(tmp_path):
+    async def run():
+        writer = AlertWriter(tmp_path / "alerts.jsonl", config={'max_queue': 2, 'store_retry_ms': 10})
+        writer.start()
+
+        def failing(batch):
+            raise OSError(5, "Input/output error")
+
+        writer._write_journal = failing
+        await writer.submit(make_entry(0))
+        await writer.submit(make_entry(1))
+        await wait_for(lambda: not writer.accepting)
+        assert writer.running
+        with pytest.raises(WriterUnavailableError):
+            await writer.submit(make_entry(2))
+        await writer.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,94 @@
+import pytest
+
+from rules import CompiledRuleChain, DetectionBatch, RuleSet, evaluate_mask
+
+
+def det(class_name="person", confidence=0.9, box=(0, 0, 100, 100)):
+    x1, y1, x2, y2 = box
+    return {"class_name": class_name, "confidence": confidence,
+            "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}}
+
+
+def test_element_rules_with_per_class_parameters():
+    chain = CompiledRuleChain([
+        {'type': 'confidence', 'min': 0.5, 'per_class': {'person': 0.3}},
+        {'type': 'classes', 'deny': ['cat']},
+        {'type': 'bbox_area', 'min': 1000, 'per_class': {'car': {'min': 5000}}},
+    ])
+    detections = [
+        det("person", 0.4),                     # pasa por su umbral propio
+        det("dog", 0.4),                        # bajo el umbral general
+        det("cat", 0.9),                        # clase denegada
+        det("car", 0.9, (0, 0, 50, 50)),        # 2500 px² < 5000 de car
+        det("dog", 0.9, (0, 0, 20, 20)),        # 400 px² < 1000
+        det("car", 0.9),
+    ]
+    assert chain.evaluate(detections) == [detections[0], detections[5]]
+
+
+def test_min_count():
+    chain = CompiledRuleChain([{'type': 'min_count', 'count': 2}])
+    assert chain.evaluate([det()]) == []
+    assert len(chain.evaluate([det(), det("car")])) == 2
+
+
+def test_unknown_rule_is_rejected():
+    with pytest.raises(ValueError):
+        CompiledRuleChain([{'type': 'no_existe'}])
+
+
+def test_time_window_does_not_filter_what_is_stored():
+    chain = CompiledRuleChain([{'type': 'confidence', 'min': 0.5}, {'type': 'time_window', 'seconds': 60}])
+    # Respaldo reenviado de golpe: todas se registran, la ventana solo limita notificaciones
+    burst = [[det()] for _ in range(5)]
+    assert all(chain.evaluate(detections) for detections in burst)
+    notified = [chain.throttle(detections, "a", now=1000 + i) for i, detections in enumerate(burst)]
+    assert [len(n) for n in notified] == [1, 0, 0, 0, 0]
+
+
+def test_time_window_uses_alert_time_per_camera_and_class():
+    chain = CompiledRuleChain([{'type': 'time_window', 'seconds': 60, 'per_class': {'car': 300}}])
+    assert chain.throttle([det()], "a", now=0)
+    assert chain.throttle([det()], "b", now=1)          # otra cámara
+    assert chain.throttle([det("car")], "a", now=2)     # otra clase
+    assert not chain.throttle([det()], "a", now=59)
+    assert chain.throttle([det()], "a", now=120)        # frame_timestamp 120 s después
+    assert not chain.throttle([det("car")], "a", now=200)
+
+
+def test_rule_set_uses_camera_chain():
+    rules = RuleSet({'alert_threshold': 0.5, 'cameras': {'patio': {'rules': [{'type': 'confidence', 'min': 0.9}]}}})
+    assert rules.evaluate([det(confidence=0.6)], "entrada")
+    assert not rules.evaluate([det(confidence=0.6)], "patio")
+
+
+def test_mask_matches_dict_evaluation():
+    chain = CompiledRuleChain([
+        {'type': 'confidence', 'min': 0.5, 'per_class': {'person': 0.3}},
+        {'type': 'classes', 'allow': ['person', 'car']},
+        {'type': 'bbox_aspect', 'max': 2.0},
+    ])
+    detections = [det("person", 0.4), det("car", 0.4), det("car", 0.9, (0, 0, 300, 100)), det("dog"), det("car")]
+    batch = DetectionBatch.from_records(detections)
+    assert batch.select(evaluate_mask(chain, batch)) == chain.evaluate(detections)
+
+
+def test_columnar_batch_keeps_extra_columns_for_selected_rows():
+    rules = RuleSet({'alert_threshold': 0.5})
+    batch = DetectionBatch.from_payload({
+        "class": [0, 2],
+        "class_name": ["person", "car"],
+        "confidence": [0.9, 0.3],
+        "bbox": [[0, 0, 10, 20], [0, 0, 5, 5]],
+        "track_id": [7, 8],
+        "track_event": ["new", "update"],
+    })
+    assert batch.select(rules.evaluate_mask(batch)) == [{
+        "class_name": "person", "confidence": 0.9, "bbox": {"x1": 0.0, "y1": 0.0, "x2": 10.0, "y2": 20.0},
+        "class": 0, "track_id": 7, "track_event": "new",
+    }]
+
+
+def test_columns_of_different_lengths_are_rejected():
+    with pytest.raises(ValueError):
+        DetectionBatch.from_columns({"class_name": ["person"], "confidence": [0.9, 0.8]})
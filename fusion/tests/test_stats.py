@@ -0,0 +1,71 @@
+from datetime import datetime
+
+from alert_store import AlertStore, entry_time
+from stats import AlertStats, write_checkpoint
+
+
+def make_entry(ts: float, camera_id: str = "a", classes=("person",)):
+    return {"timestamp": datetime.fromtimestamp(ts).isoformat(),
+            "detections": [{"class_name": name} for name in classes],
+            "metadata": {"camera_id": camera_id}}
+
+
+def test_record_counts_and_rollups():
+    stats = AlertStats()
+    base = 1_700_000_000 - 1_700_000_000 % 86400
+    stats.record(make_entry(base + 10, "a", ("person", "person")), base + 10)
+    stats.record(make_entry(base + 70, "b", ("car",)), base + 70)
+    stats.record(make_entry(base + 5, "a", ("car",)), base + 5)  # llega fuera de orden
+
+    snapshot = stats.snapshot()
+    assert snapshot["total_alerts"] == 3
+    assert snapshot["class_counts"] == {"person": 2, "car": 2}
+    assert snapshot["camera_counts"] == {"a": 2, "b": 1}
+    assert snapshot["last_alert"] == make_entry(base + 70)["timestamp"]
+
+    minutes = stats.series('minute')
+    assert [point["alerts"] for point in minutes] == [2, 1]
+    assert len(stats.series('day')) == 1
+    assert [point["alerts"] for point in stats.series('minute', camera_id="a")] == [2]
+
+
+def test_minute_retention_prunes_old_buckets():
+    stats = AlertStats({'minute': 2})
+    for minute in range(5):
+        stats.record(make_entry(minute * 60.0), minute * 60.0)
+    assert len(stats.series('minute')) == 2
+    assert stats.series('hour')[0]["alerts"] == 5
+
+
+def test_checkpoint_and_catch_up(tmp_path):
+    store = AlertStore(tmp_path / "alerts.db")
+    entries = [make_entry(1_700_000_000 + i * 30, "a" if i % 2 else "b") for i in range(10)]
+    ids = store.add_many(entries[:6])
+
+    stats = AlertStats()
+    for entry, alert_id in zip(entries[:6], ids):
+        stats.record(entry, entry_time(entry), alert_id)
+    stats.save(tmp_path / "stats.json")
+
+    store.add_many(entries[6:])
+    restored = AlertStats.load(tmp_path / "stats.json")
+    assert restored.catch_up(store.iter_after(restored.last_id)) == 4
+
+    rebuilt = AlertStats()
+    rebuilt.catch_up(store.iter_after(0))
+    assert restored.snapshot() == rebuilt.snapshot()
+    assert restored.series('minute') == rebuilt.series('minute')
+
+
+def test_checkpoint_copy_is_not_changed_by_later_alerts(tmp_path):
+    stats = AlertStats()
+    stats.record(make_entry(1_700_000_000), 1_700_000_000)
+    data = stats.checkpoint()
+    assert not stats.dirty
+    # Mientras el hilo escribe, el event loop sigue contando
+    stats.record(make_entry(1_700_000_010), 1_700_000_010)
+    write_checkpoint(tmp_path / "stats.json", data)
+    restored = AlertStats.load(tmp_path / "stats.json")
+    assert restored.total_alerts == 1
+    assert restored.series('minute')[0]["alerts"] == 1
+    assert restored.class_counts == {"person": 1}
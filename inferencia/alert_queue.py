@@ -0,0 +1,312 @@
+"""
+Cola de alertas salientes hacia fusion
+Envío en segundo plano, en lotes, con reintentos y respaldo en disco si fusion no responde
+"""
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from transport import encode_batch_request
+
+logger = logging.getLogger("inferencia")
+
+DEFAULT_ALERT_QUEUE_CONFIG = {
+    'max_queue': 256,           # alertas en memoria; al llenarse se descarta la más antigua
+    'max_batch': 16,            # alertas por POST
+    'batch_wait_ms': 50,        # espera para juntar alertas en un lote
+    'timeout': 5,               # segundos por POST
+    'max_retries': 3,
+    'backoff_base': 0.5,        # segundos; se duplica en cada reintento
+    'backoff_max': 10,
+    'spool_dir': '/app/spool',  # vacío para deshabilitar el respaldo en disco
+    'spool_max_mb': 200,
+    'replay_interval': 15,      # segundos entre intentos de reenviar lo respaldado
+    'dead_letter_dir': None,    # lotes que fusion rechaza (4xx); por defecto <spool_dir>/rejected
+}
+
+# Resultado de un POST a fusion
+SENT = 'sent'
+RETRY = 'retry'        # timeout, error de conexión o 5xx: fusion caído o sobrecargado
+REJECTED = 'rejected'  # 4xx: el lote no es válido y reintentarlo no cambia la respuesta
+
+# (jpeg, metadatos)
+AlertItem = Tuple[Optional[bytes], Dict[str, Any]]
+
+
+class AlertDispatcher:
+    """Envía alertas a fusion sin bloquear /infer
+
+    Mientras fusion responde, las alertas salen en lotes con reintentos. Si un
+    lote agota sus reintentos se da fusion por caído: los lotes siguientes van
+    directo a disco y cada `replay_interval` se intenta reenviar el más antiguo;
+    al primer éxito se vacía el respaldo en orden. Un lote que fusion rechaza
+    con 4xx no se reintenta: pasa a `dead_letter_dir` y no cambia el estado de
+    fusion. Crear dentro del event loop.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, batch_url: str, transport: str = 'binary',
+                 config: Optional[Dict[str, Any]] = None):
+        self.session = session
+        self.batch_url = batch_url
+        # Las detecciones no caben en una cabecera: en binario se usa multipart
+        self.transport = 'multipart' if transport == 'binary' else transport
+        self.config = dict(DEFAULT_ALERT_QUEUE_CONFIG)
+        self.config.update(config or {})
+
+        spool_dir = self.config['spool_dir']
+        self.spool_dir = Path(spool_dir) if spool_dir else None
+        if self.spool_dir is not None:
+            self.spool_dir.mkdir(parents=True, exist_ok=True)
+        dead_letter_dir = self.config['dead_letter_dir']
+        if dead_letter_dir:
+            self.dead_letter_dir = Path(dead_letter_dir)
+        else:
+            self.dead_letter_dir = self.spool_dir / 'rejected' if self.spool_dir is not None else None
+
+        self._queue = asyncio.Queue(maxsize=max(1, self.config['max_queue']))
+        self._task = None
+        self._sending: List[AlertItem] = []
+        self._spool_seq = 0
+        self.fusion_up = True
+        self._last_attempt = 0.0
+        self.stats = {
+            "enqueued": 0,
+            "sent": 0,
+            "batches": 0,
+            "retries": 0,
+            "dropped": 0,
+            "spilled": 0,
+            "replayed": 0,
+            "rejected": 0,
+        }
+
+    def start(self):
+        # Respaldo de una ejecución anterior: reenviarlo apenas arranque el bucle
+        if self._spool_files():
+            self.fusion_up = False
+        self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, detections: Dict[str, List], jpeg: Optional[bytes], metadata: Dict[str, Any]):
+        """Encola una alerta sin esperar; si la cola está llena descarta la más antigua"""
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.stats["dropped"] += 1
+        self._queue.put_nowait((jpeg, dict(metadata, detections=detections)))
+        self.stats["enqueued"] += 1
+
+    async def _collect(self, timeout: Optional[float]) -> List[AlertItem]:
+        try:
+            batch = [await asyncio.wait_for(self._queue.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+        deadline = time.monotonic() + self.config['batch_wait_ms'] / 1000
+        while len(batch) < self.config['max_batch']:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _post(self, batch: List[AlertItem]) -> str:
+        """SENT, RETRY o REJECTED según la respuesta de fusion"""
+        self._last_attempt = time.monotonic()
+        try:
+            async with self.session.post(
+                self.batch_url,
+                timeout=aiohttp.ClientTimeout(total=self.config['timeout']),
+                **encode_batch_request(batch, self.transport)
+            ) as response:
+                if response.status == 200:
+                    await self._spill_unregistered(batch, response)
+                    return SENT
+                if 400 <= response.status < 500:
+                    # Fusion responde, pero no acepta el lote: va a dead letter sin reintentos
+                    logger.error(f"Fusion rechazó el lote de alertas: {response.status} {(await response.text())[:200]}")
+                    return REJECTED
+                logger.warning(f"Fusion no pudo procesar el lote de alertas: {response.status}")
+                return RETRY
+        except Exception as e:
+            logger.warning(f"Error enviando lote de alertas: {e}")
+            return RETRY
+
+    async def _spill_unregistered(self, batch: List[AlertItem], response: aiohttp.ClientResponse):
+        """Respalda las alertas del lote que fusion aceptó pero no pudo registrar (`retry`)"""
+        try:
+            results = (await response.json(content_type=None)).get("results")
+        except (ValueError, AttributeError, aiohttp.ClientError):
+            return
+        if not isinstance(results, list):
+            return
+        failed = [item for item, result in zip(batch, results) if isinstance(result, dict) and result.get("retry")]
+        if failed:
+            logger.warning(f"Fusion no registró {len(failed)} alertas del lote; se respaldan para reenviarlas")
+            await self._spill_or_drop(failed)
+
+    async def _send_with_retries(self, batch: List[AlertItem]) -> str:
+        delay = self.config['backoff_base']
+        for attempt in range(self.config['max_retries'] + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.config['backoff_max'])
+            result = await self._post(batch)
+            if result == SENT:
+                self.stats["sent"] += len(batch)
+                self.stats["batches"] += 1
+            if result != RETRY:
+                return result
+        return RETRY
+
+    async def _run(self):
+        while True:
+            pending_spool = not self.fusion_up and self._spool_files()
+            batch = await self._collect(self.config['replay_interval'] if pending_spool else None)
+
+            if not self.fusion_up:
+                if batch:
+                    await self._spill_or_drop(batch)
+                if time.monotonic() - self._last_attempt >= self.config['replay_interval']:
+                    await self._replay()
+                continue
+
+            if not batch:
+                continue
+            self._sending = batch
+            result = await self._send_with_retries(batch)
+            self._sending = []
+            if result == SENT:
+                if self._spool_files():
+                    await self._replay()
+            elif result == REJECTED:
+                await self._reject(batch)
+            else:
+                logger.error("Fusion no responde; las alertas se respaldan en disco")
+                self.fusion_up = False
+                await self._spill_or_drop(batch)
+
+    # --- Respaldo en disco ---
+
+    def _spool_files(self) -> List[Path]:
+        if self.spool_dir is None:
+            return []
+        return sorted(self.spool_dir.glob('*.json'))
+
+    def _spool_bytes(self) -> int:
+        return sum(path.stat().st_size for path in self._spool_files())
+
+    def _write_spool(self, batch: List[AlertItem], directory: Optional[Path] = None) -> Path:
+        directory = directory or self.spool_dir
+        directory.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for jpeg, metadata in batch:
+            entry = dict(metadata)
+            entry['image'] = base64.b64encode(jpeg).decode('utf-8') if jpeg is not None else None
+            entries.append(entry)
+        self._spool_seq += 1
+        path = directory / f"{time.time():.6f}-{os.getpid()}-{self._spool_seq:06d}.json"
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, path)
+        return path
+
+    async def _spill_or_drop(self, batch: List[AlertItem]):
+        if self.spool_dir is None:
+            self.stats["dropped"] += len(batch)
+            return
+        try:
+            if await asyncio.to_thread(self._spool_bytes) >= self.config['spool_max_mb'] * 1024 * 1024:
+                logger.warning(f"Respaldo de alertas lleno, se descartan {len(batch)}")
+                self.stats["dropped"] += len(batch)
+                return
+            await asyncio.to_thread(self._write_spool, batch)
+            self.stats["spilled"] += len(batch)
+        except Exception as e:
+            logger.error(f"Error respaldando alertas en disco: {e}")
+            self.stats["dropped"] += len(batch)
+
+    async def _reject(self, batch: List[AlertItem], path: Optional[Path] = None):
+        """Guarda en dead letter un lote que fusion rechazó; `path` es su archivo de respaldo"""
+        self.stats["rejected"] += len(batch)
+        try:
+            if self.dead_letter_dir is None:
+                logger.error(f"Se descartan {len(batch)} alertas rechazadas por fusion")
+            elif path is not None:
+                self.dead_letter_dir.mkdir(parents=True, exist_ok=True)
+                os.replace(path, self.dead_letter_dir / path.name)
+            else:
+                await asyncio.to_thread(self._write_spool, batch, self.dead_letter_dir)
+        except Exception as e:
+            logger.error(f"Error guardando alertas rechazadas: {e}")
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _read_spool(path: Path) -> List[AlertItem]:
+        with open(path, 'r') as f:
+            entries = json.load(f)
+        items = []
+        for entry in entries:
+            image_b64 = entry.pop('image', None)
+            items.append((base64.b64decode(image_b64) if image_b64 else None, entry))
+        return items
+
+    async def _replay(self):
+        """Reenvía los lotes respaldados, del más antiguo al más nuevo"""
+        for path in self._spool_files():
+            try:
+                batch = await asyncio.to_thread(self._read_spool, path)
+            except Exception as e:
+                logger.error(f"Respaldo ilegible, se descarta {path.name}: {e}")
+                path.unlink(missing_ok=True)
+                continue
+            result = await self._post(batch)
+            if result == REJECTED:
+                await self._reject(batch, path)
+                continue
+            if result == RETRY:
+                self.fusion_up = False
+                return
+            path.unlink(missing_ok=True)
+            self.stats["sent"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["replayed"] += len(batch)
+        if not self.fusion_up:
+            logger.info("Fusion disponible de nuevo; respaldo de alertas reenviado")
+        self.fusion_up = True
+
+    async def stop(self):
+        """Detiene el envío y respalda en disco lo que quede en la cola"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        remaining, self._sending = self._sending, []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        if remaining:
+            result = await self._post(remaining) if self.fusion_up else RETRY
+            if result == SENT:
+                self.stats["sent"] += len(remaining)
+            elif result == REJECTED:
+                await self._reject(remaining)
+            else:
+                await self._spill_or_drop(remaining)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "fusion_up": self.fusion_up,
+            "spool_files": len(self._spool_files()),
+            **self.stats,
+        }
@@ -0,0 +1,135 @@
+"""
+Backends de inferencia en CPU
+PyTorch, ONNX Runtime u OpenVINO, todos cargados a través de ultralytics
+para que extract_boxes reciba exactamente el mismo tipo de resultados
+"""
+import logging
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("inferencia")
+
+BACKENDS = ('pytorch', 'onnx', 'openvino')
+PRECISIONS = ('fp32', 'int8')
+
+DEFAULT_BACKEND_CONFIG = {
+    'backend': 'pytorch',
+    'precision': 'fp32',
+    'auto_export': True,            # exportar al arrancar si falta el modelo optimizado
+    'imgsz': 640,
+    'calibration_data': 'coco128.yaml',  # dataset para calibrar INT8 en OpenVINO
+}
+
+
+def validate_backend(backend: str, precision: str):
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Precisión desconocida: {precision} (opciones: {', '.join(PRECISIONS)})")
+    if backend == 'pytorch' and precision != 'fp32':
+        raise ValueError("El backend pytorch solo soporta fp32")
+
+
+def exported_model_path(model_path: str, backend: str, precision: str = 'fp32') -> Path:
+    """Ruta del modelo exportado, junto al .pt original"""
+    source = Path(model_path)
+    if backend == 'pytorch':
+        return source
+    suffix = '' if precision == 'fp32' else '-int8'
+    if backend == 'onnx':
+        return source.with_name(f"{source.stem}{suffix}.onnx")
+    # Mismo nombre de directorio que usa ultralytics al exportar
+    int8 = '_int8' if precision == 'int8' else ''
+    return source.with_name(f"{source.stem}{int8}_openvino_model")
+
+
+def _export_onnx(model_path: str, target: Path, precision: str, imgsz: int):
+    from ultralytics import YOLO
+
+    fp32_path = exported_model_path(model_path, 'onnx', 'fp32')
+    if not fp32_path.exists():
+        # Eje de batch dinámico para que el micro-batching funcione con ONNX
+        exported = YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+        if Path(exported) != fp32_path:
+            shutil.move(str(exported), fp32_path)
+    if precision == 'fp32':
+        return
+
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(fp32_path), str(target), weight_type=QuantType.QUInt8)
+    # ultralytics lee nombres de clases, stride e imgsz de los metadatos del modelo
+    source = onnx.load(str(fp32_path), load_external_data=False)
+    quantized = onnx.load(str(target))
+    onnx.helper.set_model_props(quantized, {p.key: p.value for p in source.metadata_props})
+    onnx.save(quantized, str(target))
+
+
+def _export_openvino(model_path: str, target: Path, precision: str, imgsz: int,
+                     calibration_data: Optional[str]):
+    from ultralytics import YOLO
+
+    kwargs = {'format': 'openvino', 'imgsz': imgsz, 'dynamic': True}
+    if precision == 'int8':
+        # Cuantización post-entrenamiento con NNCF: requiere un dataset de calibración
+        kwargs.update(int8=True, data=calibration_data)
+    exported = Path(YOLO(model_path).export(**kwargs))
+    if exported != target:
+        if target.exists():
+            shutil.rmtree(target)
+        shutil.move(str(exported), target)
+
+
+def export_model(model_path: str, backend: str, precision: str = 'fp32', imgsz: int = 640,
+                 calibration_data: Optional[str] = None, force: bool = False) -> Path:
+    """Exporta (y cuantiza) el .pt al backend indicado; reutiliza lo ya exportado"""
+    validate_backend(backend, precision)
+    target = exported_model_path(model_path, backend, precision)
+    if backend == 'pytorch' or (target.exists() and not force):
+        return target
+    if force and target.exists():
+        if target.is_dir():
+            shutil.rmtree(target)
+        else:
+            target.unlink()
+
+    logger.info(f"Exportando {model_path} a {backend} ({precision}) -> {target}")
+    if backend == 'onnx':
+        _export_onnx(model_path, target, precision, imgsz)
+    else:
+        _export_openvino(model_path, target, precision, imgsz,
+                         calibration_data or DEFAULT_BACKEND_CONFIG['calibration_data'])
+    return target
+
+
+def prepare_model(options: Dict[str, Any]) -> str:
+    """Resuelve la ruta del modelo para el backend configurado
+
+    Se ejecuta una sola vez en el proceso principal, antes de lanzar los
+    workers, para que no exporten en paralelo.
+    """
+    backend = options.get('backend', DEFAULT_BACKEND_CONFIG['backend'])
+    precision = options.get('precision', DEFAULT_BACKEND_CONFIG['precision'])
+    validate_backend(backend, precision)
+    target = exported_model_path(options['model_path'], backend, precision)
+    if backend == 'pytorch' or target.exists():
+        return str(target)
+    if not options.get('auto_export', DEFAULT_BACKEND_CONFIG['auto_export']):
+        raise FileNotFoundError(
+            f"No existe {target}; generarlo con: python export_model.py --backend {backend} --precision {precision}"
+        )
+    return str(export_model(
+        options['model_path'],
+        backend,
+        precision,
+        imgsz=options.get('imgsz', DEFAULT_BACKEND_CONFIG['imgsz']),
+        calibration_data=options.get('calibration_data')
+    ))
+
+
+def load_model(options: Dict[str, Any]):
+    """Carga el modelo ya resuelto por prepare_model (dentro del worker)"""
+    from ultralytics import YOLO
+    return YOLO(options['resolved_model_path'], task='detect')
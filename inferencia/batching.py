@@ -0,0 +1,131 @@
+"""
+Micro-batching dinámico para /infer
+Agrupa peticiones concurrentes en un solo model.predict
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+# runner(items) -> un resultado por item, en el mismo orden
+BatchRunner = Callable[[List[Any]], Awaitable[List[Any]]]
+
+
+class QueueFullError(Exception):
+    """La cola de peticiones pendientes alcanzó su límite"""
+
+
+class MicroBatcher:
+    """Agrupa peticiones hasta `max_batch_size` o `max_wait_ms`, lo que ocurra antes
+
+    Cada petición recibe su resultado junto con el tamaño del lote en que
+    viajó, el tiempo que esperó en cola y la duración de la inferencia.
+    Con `max_queue` > 0 las peticiones que excedan la cola se rechazan con
+    QueueFullError en vez de acumular latencia. Crear dentro del event loop.
+    """
+
+    def __init__(self, runner: BatchRunner, max_batch_size: int = 8, max_wait_ms: float = 5,
+                 concurrency: int = 1, max_queue: int = 0):
+        self.runner = runner
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_queue = max(0, max_queue)
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._task = None
+        self._running = set()
+        self.stats = {
+            "requests": 0,
+            "rejected": 0,
+            "batches": 0,
+            "last_batch_size": 0,
+        }
+
+    def start(self):
+        self._task = asyncio.create_task(self._collect_loop())
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    async def submit(self, item: Any) -> Dict[str, Any]:
+        """Encola un item y espera su resultado"""
+        if self.max_queue and self._queue.qsize() >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise QueueFullError(f"Cola de inferencia llena ({self.max_queue})")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future, time.monotonic()))
+        self.stats["requests"] += 1
+        return await future
+
+    async def _collect_loop(self):
+        while True:
+            # Esperar a que haya capacidad antes de armar el lote: mientras el
+            # modelo está ocupado, las peticiones se acumulan y el lote crece
+            await self._slots.acquire()
+            try:
+                batch = [await self._queue.get()]
+                deadline = time.monotonic() + self.max_wait
+                while len(batch) < self.max_batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+                # Descartar peticiones cuyo cliente ya se fue
+                batch = [entry for entry in batch if not entry[1].done()]
+            except BaseException:
+                self._slots.release()
+                raise
+            if not batch:
+                self._slots.release()
+                continue
+            task = asyncio.create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch):
+        started = time.monotonic()
+        try:
+            results = await self.runner([item for item, _, _ in batch])
+            error = None
+        except Exception as e:
+            results, error = None, e
+        finally:
+            self._slots.release()
+        finished = time.monotonic()
+
+        self.stats["batches"] += 1
+        self.stats["last_batch_size"] = len(batch)
+        for index, (_, future, enqueued) in enumerate(batch):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+                continue
+            if isinstance(results[index], Exception):
+                # Fallo de un solo item (p. ej. JPEG corrupto): no afecta al resto del lote
+                future.set_exception(results[index])
+                continue
+            future.set_result({
+                "result": results[index],
+                "batch": {
+                    "size": len(batch),
+                    "queue_wait_ms": round((started - enqueued) * 1000, 2),
+                    "inference_ms": round((finished - started) * 1000, 2),
+                    "latency_ms": round((finished - enqueued) * 1000, 2),
+                },
+            })
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.cancel()
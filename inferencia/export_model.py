@@ -0,0 +1,60 @@
+"""
+Exporta el modelo YOLO a ONNX/OpenVINO en FP32 e INT8
+Los modelos quedan junto al .pt y el servicio los reutiliza al arrancar
+
+Uso:
+    python export_model.py                       # todos los backends y precisiones
+    python export_model.py --backend onnx --precision int8
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import yaml
+
+sys.path.append('/app/utils')
+from logger import setup_logger
+from backends import BACKENDS, DEFAULT_BACKEND_CONFIG, PRECISIONS, export_model
+
+logger = setup_logger("export_model")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta y cuantiza el modelo de inferencia")
+    parser.add_argument('--config', default='/app/config/yolov8_config.yaml')
+    parser.add_argument('--model', help="Ruta del .pt (por defecto la de la configuración)")
+    parser.add_argument('--backend', choices=[b for b in BACKENDS if b != 'pytorch'], action='append',
+                        help="Backend a exportar (repetible; por defecto todos)")
+    parser.add_argument('--precision', choices=PRECISIONS, action='append',
+                        help="Precisión a exportar (repetible; por defecto fp32 e int8)")
+    parser.add_argument('--imgsz', type=int)
+    parser.add_argument('--data', help="Dataset de calibración para INT8 en OpenVINO")
+    parser.add_argument('--force', action='store_true', help="Re-exportar aunque ya exista")
+    args = parser.parse_args()
+
+    config = {}
+    if Path(args.config).exists():
+        with open(args.config, 'r') as f:
+            config = yaml.safe_load(f) or {}
+
+    model_path = args.model or config.get('model_path', 'yolov8n.pt')
+    imgsz = args.imgsz or config.get('imgsz', DEFAULT_BACKEND_CONFIG['imgsz'])
+    calibration_data = args.data or config.get('calibration_data')
+
+    failed = False
+    for backend in args.backend or ['onnx', 'openvino']:
+        for precision in args.precision or list(PRECISIONS):
+            started = time.monotonic()
+            try:
+                path = export_model(model_path, backend, precision, imgsz=imgsz,
+                                    calibration_data=calibration_data, force=args.force)
+                logger.info(f"{backend}/{precision}: {path} ({time.monotonic() - started:.1f}s)")
+            except Exception as e:
+                failed = True
+                logger.error(f"{backend}/{precision}: error exportando: {e}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Post-procesamiento de resultados YOLO
+Las cajas se copian de una vez a NumPy y los formatos de salida se arman desde esos arrays
+"""
+from typing import List, Dict, Any
+
+import numpy as np
+
+RESPONSE_FORMATS = ('records', 'columnar')
+
+# Columnas del array de cajas: x1, y1, x2, y2, confianza, clase
+BOX_COLUMNS = 6
+
+
+def extract_boxes(result) -> np.ndarray:
+    """Cajas de un resultado como array (N, 6) float32, en una sola transferencia"""
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return np.empty((0, BOX_COLUMNS), dtype=np.float32)
+    data = boxes.data.cpu().numpy()
+    # Con tracking ultralytics agrega una columna de ID antes de confianza y clase
+    return np.ascontiguousarray(np.concatenate((data[:, :4], data[:, -2:]), axis=1), dtype=np.float32)
+
+
+def detections_to_records(boxes: np.ndarray, names: Dict[int, str]) -> List[Dict[str, Any]]:
+    """Formato estándar: una entrada por detección"""
+    classes = boxes[:, 5].astype(np.int64).tolist()
+    confidences = boxes[:, 4].tolist()
+    coords = boxes[:, :4].tolist()
+    return [
+        {
+            "class": cls,
+            "class_name": names[cls],
+            "confidence": conf,
+            "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2}
+        }
+        for cls, conf, (x1, y1, x2, y2) in zip(classes, confidences, coords)
+    ]
+
+
+def detections_to_columns(boxes: np.ndarray, names: Dict[int, str]) -> Dict[str, Any]:
+    """Formato compacto: una lista por campo, bbox como [x1, y1, x2, y2]"""
+    classes = boxes[:, 5].astype(np.int64).tolist()
+    return {
+        "class": classes,
+        "class_name": [names[cls] for cls in classes],
+        "confidence": boxes[:, 4].tolist(),
+        "bbox": boxes[:, :4].tolist(),
+    }
+
+
+def records_to_columns(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Formato compacto desde una lista de dicts con las mismas claves (eventos de track)"""
+    columns = {key: [record[key] for record in records] for key in records[0]} if records else {}
+    if "bbox" in columns:
+        columns["bbox"] = [[box["x1"], box["y1"], box["x2"], box["y2"]] for box in columns["bbox"]]
+    return columns
+
+
+def format_detections(boxes: np.ndarray, names: Dict[int, str], response_format: str = 'records'):
+    if response_format == 'columnar':
+        return detections_to_columns(boxes, names)
+    return detections_to_records(boxes, names)
+
@@ -0,0 +1,101 @@
+"""
+Caché de resultados para frames casi idénticos
+dHash de 64 bits sobre una miniatura en grises y LRU por cámara con TTL
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import cv2
+import numpy as np
+
+from frames import Frame
+
+DEFAULT_RESULT_CACHE_CONFIG = {
+    'enabled': False,
+    'max_distance': 4,            # bits distintos (de 64) para considerar el frame repetido
+    'ttl': 5,                     # segundos que un resultado sigue siendo válido
+    'max_entries_per_camera': 16,
+    'max_cameras': 64,
+    'thumbnail_width': 64,        # ancho mínimo de la decodificación reducida
+}
+
+
+def dhash(jpeg: bytes, thumbnail_width: int = 64) -> int:
+    """Hash de diferencias de 64 bits
+
+    El JPEG se decodifica en grises a 1/2-1/8 de escala (el decodificador
+    descarta coeficientes DCT), se reduce a 9x8 y cada bit indica si un
+    píxel es más claro que su vecino de la derecha.
+    """
+    gray = Frame(jpeg=jpeg).gray_thumbnail(thumbnail_width)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class ResultCache:
+    """Resultados recientes por cámara, buscados por distancia de Hamming
+
+    Cada cámara guarda hasta `max_entries_per_camera` hashes en orden LRU; las
+    cámaras menos usadas se descartan al superar `max_cameras`.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = dict(DEFAULT_RESULT_CACHE_CONFIG)
+        self.config.update(config or {})
+        self._cameras: "OrderedDict[str, OrderedDict[int, tuple]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def hash(self, jpeg: bytes) -> int:
+        return dhash(jpeg, self.config['thumbnail_width'])
+
+    def get(self, camera_id: str, frame_hash: int, now: Optional[float] = None) -> Optional[Any]:
+        """Resultado de un frame cercano y vigente, o None"""
+        now = time.monotonic() if now is None else now
+        entries = self._cameras.get(camera_id)
+        if entries is not None:
+            self._cameras.move_to_end(camera_id)
+            best_key, best_distance = None, self.config['max_distance'] + 1
+            for key, (stored_at, _) in list(entries.items()):
+                if now - stored_at > self.config['ttl']:
+                    del entries[key]
+                    self.stats["expired"] += 1
+                    continue
+                distance = hamming(key, frame_hash)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is not None:
+                entries.move_to_end(best_key)
+                self.stats["hits"] += 1
+                return entries[best_key][1]
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, camera_id: str, frame_hash: int, result: Any, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        entries = self._cameras.get(camera_id)
+        if entries is None:
+            entries = self._cameras[camera_id] = OrderedDict()
+            if len(self._cameras) > self.config['max_cameras']:
+                _, dropped = self._cameras.popitem(last=False)
+                self.stats["evictions"] += len(dropped)
+        self._cameras.move_to_end(camera_id)
+        entries[frame_hash] = (now, result)
+        entries.move_to_end(frame_hash)
+        while len(entries) > self.config['max_entries_per_camera']:
+            entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def status(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "entries": sum(len(entries) for entries in self._cameras.values()),
+            "cameras": len(self._cameras),
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            **self.stats,
+        }
@@ -0,0 +1,94 @@
+"""
+Regiones de interés por cámara
+El modelo corre solo sobre el recorte que envuelve las regiones y las detecciones
+cuyo centro cae fuera de ellas se descartan
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Coordenadas normalizadas (0-1): rect [x1, y1, x2, y2] o polígono [[x, y], ...]
+Region = List[Tuple[float, float]]
+
+
+def parse_region(raw: Any) -> Region:
+    """Convierte un rect o polígono de la configuración en lista de vértices"""
+    if isinstance(raw, dict):
+        if 'rect' in raw:
+            raw = raw['rect']
+        elif 'polygon' in raw:
+            raw = raw['polygon']
+        else:
+            raise ValueError(f"Región sin 'rect' ni 'polygon': {raw}")
+    if len(raw) == 4 and all(isinstance(v, (int, float)) for v in raw):
+        x1, y1, x2, y2 = (float(v) for v in raw)
+        if x2 <= x1 or y2 <= y1:
+            raise ValueError(f"Rectángulo vacío: {raw}")
+        return [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]
+    points = [(float(x), float(y)) for x, y in raw]
+    if len(points) < 3:
+        raise ValueError(f"Un polígono necesita al menos 3 puntos: {raw}")
+    return points
+
+
+def load_camera_rois(system_config: Dict[str, Any]) -> Dict[str, List[Region]]:
+    """ROI por camera_id desde `cameras[].roi` (o `esp32.roi` para la cámara única)"""
+    cameras = system_config.get('cameras') or [
+        {'id': 'cam0', 'roi': (system_config.get('esp32') or {}).get('roi')}
+    ]
+    rois = {}
+    for index, camera in enumerate(cameras):
+        regions = camera.get('roi')
+        if regions:
+            camera_id = str(camera.get('id', f"cam{index}"))
+            rois[camera_id] = [parse_region(region) for region in regions]
+    return rois
+
+
+def bounding_crop(regions: Sequence[Region]) -> Tuple[float, float, float, float]:
+    """Rectángulo normalizado que envuelve todas las regiones"""
+    points = np.array([point for region in regions for point in region], dtype=np.float64)
+    x1, y1 = np.clip(points.min(axis=0), 0.0, 1.0)
+    x2, y2 = np.clip(points.max(axis=0), 0.0, 1.0)
+    return float(x1), float(y1), float(x2), float(y2)
+
+
+def crop_pixels(crop: Tuple[float, float, float, float], width: int, height: int) -> Tuple[int, int, int, int]:
+    x1, y1, x2, y2 = crop
+    left, top = int(np.floor(x1 * width)), int(np.floor(y1 * height))
+    right, bottom = int(np.ceil(x2 * width)), int(np.ceil(y2 * height))
+    return left, top, max(right, left + 1), max(bottom, top + 1)
+
+
+def points_in_polygon(points: np.ndarray, polygon: Region) -> np.ndarray:
+    """Ray casting vectorizado: (N, 2) puntos -> (N,) bool"""
+    vertices = np.asarray(polygon, dtype=np.float64)
+    x, y = points[:, 0:1], points[:, 1:2]
+    xi, yi = vertices[:, 0], vertices[:, 1]
+    xj, yj = np.roll(xi, 1), np.roll(yi, 1)
+    crosses = (yi > y) != (yj > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = (xj - xi) * (y - yi) / (yj - yi) + xi
+    return np.count_nonzero(crosses & (x < x_cross), axis=1) % 2 == 1
+
+
+def inside_regions(boxes: np.ndarray, regions: Sequence[Region], width: int, height: int) -> np.ndarray:
+    """Máscara de cajas (N, 6) en píxeles cuyo centro cae dentro de alguna región"""
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=bool)
+    centers = np.stack((
+        (boxes[:, 0] + boxes[:, 2]) / (2 * width),
+        (boxes[:, 1] + boxes[:, 3]) / (2 * height),
+    ), axis=1)
+    mask = np.zeros(len(boxes), dtype=bool)
+    for region in regions:
+        mask |= points_in_polygon(centers, region)
+    return mask
+
+
+def apply_roi(regions: Optional[Sequence[Region]], boxes: np.ndarray,
+              size: Optional[Tuple[int, int]]) -> np.ndarray:
+    """Descarta las detecciones fuera de las regiones (sin ROI retorna todas)"""
+    if not regions or size is None:
+        return boxes
+    return boxes[inside_regions(boxes, regions, size[0], size[1])]
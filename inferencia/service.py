@@ -1,26 +1,33 @@
-import base64
-import cv2
-import numpy as np
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.responses import JSONResponse
-from ultralytics import YOLO
 import yaml
 from pathlib import Path
 import sys
 import aiohttp
 import asyncio
+import os
+import time
 from typing import List, Dict, Any
 
 # Agregar utils al path
 sys.path.append('/app/utils')
 from logger import setup_logger
-from helpers import base64_to_image, image_to_base64
+from transport import TRANSPORTS, read_image_request
+from batching import MicroBatcher, QueueFullError
+from workers import InferencePool, WorkerError
+from backends import DEFAULT_BACKEND_CONFIG, prepare_model
+from alert_queue import AlertDispatcher
+from tracker import MultiCameraTracker
+from result_cache import ResultCache
+from roi import load_camera_rois
+from postprocess import RESPONSE_FORMATS, detections_to_columns, format_detections, records_to_columns
 
 app = FastAPI(title="Inferencia Service", version="1.0.0")
 logger = setup_logger("inferencia")
 
 # Cargar configuración
-config_path = Path("/app/config/yolov8_config.yaml")
+config_dir = Path(os.getenv("CONFIG_DIR", "/app/config"))
+config_path = config_dir / "yolov8_config.yaml"
 if config_path.exists():
     with open(config_path, 'r') as f:
         yolo_config = yaml.safe_load(f)
@@ -28,150 +35,342 @@ if config_path.exists():
         conf_threshold = yolo_config.get('conf_threshold', 0.25)
         iou_threshold = yolo_config.get('iou_threshold', 0.45)
 else:
+    yolo_config = {}
     model_path = 'yolov8n.pt'
     conf_threshold = 0.25
     iou_threshold = 0.45
 
+# Resolución del modelo, dispositivo (solo pytorch) y filtro de clases (índices o nombres)
+imgsz = yolo_config.get('imgsz', DEFAULT_BACKEND_CONFIG['imgsz'])
+device = yolo_config.get('device', 'cpu')
+classes = yolo_config.get('classes')
+
+# Backend de ejecución: pytorch, onnx u openvino (fp32 o int8)
+backend = yolo_config.get('backend', DEFAULT_BACKEND_CONFIG['backend'])
+precision = yolo_config.get('precision', DEFAULT_BACKEND_CONFIG['precision'])
+
+# Micro-batching: peticiones concurrentes se agrupan en un solo model.predict
+batching_config = (yolo_config or {}).get('batching', {})
+max_batch_size = batching_config.get('max_batch_size', 8)
+max_wait_ms = batching_config.get('max_wait_ms', 5)
+
+# Pasadas de calentamiento por worker antes de declararse listo
+warmup_runs = (yolo_config or {}).get('warmup', {}).get('runs', 2)
+
+# Pool de procesos: cada worker carga su propia copia del modelo
+workers_config = (yolo_config or {}).get('workers', {})
+worker_processes = max(1, workers_config.get('processes', 1))
+threads_per_worker = max(1, workers_config.get('threads_per_worker', 1))
+pin_cpus = workers_config.get('pin_cpus', True)
+max_queue = workers_config.get('max_queue', 32)
+retry_after = workers_config.get('retry_after', 1)
+batch_timeout = workers_config.get('batch_timeout', 30)
+restart_backoff = workers_config.get('restart_backoff', 1)
+restart_backoff_max = workers_config.get('restart_backoff_max', 60)
+
 # Cargar configuración del sistema
-system_config_path = Path("/app/config/system_config.yaml")
-fusion_url = "http://fusion:8002/alert"
+system_config_path = config_dir / "system_config.yaml"
+system_config = {}
 if system_config_path.exists():
     with open(system_config_path, 'r') as f:
-        system_config = yaml.safe_load(f)
-        fusion_url = system_config.get('services', {}).get('fusion_url', fusion_url)
+        system_config = yaml.safe_load(f) or {}
+fusion_url = system_config.get('services', {}).get('fusion_url', "http://fusion:8002/alert")
+# En binario las alertas viajan como multipart (metadatos JSON + JPEG)
+transport = system_config.get('services', {}).get('transport', 'binary')
+if transport not in TRANSPORTS:
+    raise ValueError(f"Transporte desconocido: {transport}")
 
 # Override con variable de entorno
-import os
 fusion_url = os.getenv('FUSION_URL', fusion_url)
+# Las alertas salen en lotes hacia el endpoint /batch de fusion
+fusion_batch_url = os.getenv('FUSION_BATCH_URL', fusion_url.rstrip('/') + '/batch')
+alert_queue_config = system_config.get('inferencia', {}).get('alert_queue', {})
+# Con tracking solo se envían a fusion los eventos de track (new/updated/lost)
+tracker_config = system_config.get('inferencia', {}).get('tracker', {})
+tracker = MultiCameraTracker(tracker_config) if tracker_config.get('enabled', False) else None
+# Regiones de interés por cámara (`cameras[].roi`): el modelo solo ve ese recorte
+camera_rois = load_camera_rois(system_config)
 
-# Cargar modelo YOLO
-logger.info(f"Cargando modelo: {model_path}")
-try:
-    model = YOLO(model_path)
-    logger.info("Modelo cargado correctamente")
-except Exception as e:
-    logger.error(f"Error cargando modelo: {e}")
-    model = None
+# Frames casi idénticos de una misma cámara reutilizan el resultado anterior
+result_cache_config = system_config.get('inferencia', {}).get('result_cache', {})
+result_cache = ResultCache(result_cache_config) if result_cache_config.get('enabled', False) else None
 
 session = None
+batcher = None
+pool = None
+dispatcher = None
+expire_task = None
+startup_task = None
+# Estado del arranque del modelo: starting -> ready | failed
+startup_state = {"state": "starting", "steps": {}, "error": None}
+
+async def timed_step(name: str, coro):
+    """Ejecuta un paso del arranque registrando su duración"""
+    started = time.monotonic()
+    result = await coro
+    elapsed = round(time.monotonic() - started, 3)
+    startup_state["steps"][name] = elapsed
+    logger.info(f"Arranque: {name} en {elapsed}s")
+    return result
+
+async def load_model_pipeline():
+    """Exporta si hace falta, lanza los workers y los calienta, en segundo plano"""
+    global pool
+    started = time.monotonic()
+    candidate = None
+    try:
+        options = {
+            "model_path": model_path,
+            "backend": backend,
+            "precision": precision,
+            "auto_export": yolo_config.get('auto_export', DEFAULT_BACKEND_CONFIG['auto_export']),
+            "imgsz": imgsz,
+            "device": device,
+            "classes": classes,
+            "calibration_data": yolo_config.get('calibration_data'),
+            "conf_threshold": conf_threshold,
+            "iou_threshold": iou_threshold,
+            "warmup_runs": warmup_runs,
+            # Calentar los tamaños de lote que producirá el micro-batching
+            "warmup_batch_sizes": sorted({1, max_batch_size}),
+        }
+        # Exportar (si hace falta) una sola vez, antes de lanzar los workers
+        options["resolved_model_path"] = await timed_step(
+            "prepare_model", asyncio.to_thread(prepare_model, options)
+        )
+        logger.info(f"Cargando modelo {options['resolved_model_path']} ({backend}/{precision}) en "
+                    f"{worker_processes} workers ({threads_per_worker} hilos cada uno)")
+        candidate = InferencePool(
+            worker_processes,
+            options,
+            threads_per_worker=threads_per_worker,
+            pin_cpus=pin_cpus,
+            batch_timeout=batch_timeout,
+            restart_backoff=restart_backoff,
+            restart_backoff_max=restart_backoff_max
+        )
+        # Cada worker carga el modelo y hace sus pasadas de calentamiento antes de responder
+        await timed_step("load_and_warmup", candidate.start())
+        for worker in candidate.workers:
+            startup_state["steps"][f"worker_{worker.index}"] = {
+                "load_s": worker.info.get("load_s"),
+                "warmup_s": worker.info.get("warmup_s"),
+            }
+        pool = candidate
+        startup_state["state"] = "ready"
+        startup_state["steps"]["total"] = round(time.monotonic() - started, 3)
+        logger.info(f"Modelo listo en {startup_state['steps']['total']}s")
+    except Exception as e:
+        logger.error(f"Error cargando modelo: {e}")
+        startup_state["state"] = "failed"
+        startup_state["error"] = str(e)
+        if candidate:
+            await asyncio.to_thread(candidate.stop)
 
 @app.on_event("startup")
 async def startup_event():
-    """Inicializa sesión HTTP"""
-    global session
+    """Inicializa sesión HTTP y el planificador de lotes; el modelo carga en segundo plano"""
+    global session, batcher, dispatcher, expire_task, startup_task
     session = aiohttp.ClientSession()
+    dispatcher = AlertDispatcher(session, fusion_batch_url, transport, alert_queue_config)
+    dispatcher.start()
+    if tracker is not None:
+        expire_task = asyncio.create_task(expire_tracks_loop())
+    
+    # Un lote en curso por worker; el resto se acumula y forma el siguiente lote
+    batcher = MicroBatcher(
+        run_batch,
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+        concurrency=worker_processes,
+        max_queue=max_queue
+    )
+    batcher.start()
+    
+    # /health responde de inmediato; /ready solo cuando el modelo está caliente
+    startup_task = asyncio.create_task(load_model_pipeline())
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    """Cierra sesión HTTP"""
+    """Cierra sesión HTTP y detiene los workers"""
     global session
+    if startup_task and not startup_task.done():
+        startup_task.cancel()
+        await asyncio.gather(startup_task, return_exceptions=True)
+    if expire_task:
+        expire_task.cancel()
+    if batcher:
+        await batcher.stop()
+    if pool:
+        await asyncio.to_thread(pool.stop)
+    if dispatcher:
+        await dispatcher.stop()
     if session:
         await session.close()
 
-def process_detections(results) -> List[Dict[str, Any]]:
-    """Procesa resultados de YOLO a formato estándar"""
-    detections = []
-    
-    if results and len(results) > 0:
-        boxes = results[0].boxes
-        for box in boxes:
-            detection = {
-                "class": int(box.cls[0]),
-                "class_name": results[0].names[int(box.cls[0])],
-                "confidence": float(box.conf[0]),
-                "bbox": {
-                    "x1": float(box.xyxy[0][0]),
-                    "y1": float(box.xyxy[0][1]),
-                    "x2": float(box.xyxy[0][2]),
-                    "y2": float(box.xyxy[0][3])
-                }
-            }
-            detections.append(detection)
-    
-    return detections
+async def run_batch(items: List[Any]) -> List[Any]:
+    """Ejecuta un lote en el primer worker libre"""
+    return await pool.run_batch(items)
+
+def send_alert(detections: Dict[str, List], jpeg: bytes, metadata: Dict[str, Any] = None):
+    """Encola la alerta para fusion (detecciones en formato columnar); el envío ocurre en segundo plano"""
+    metadata = metadata or {}
+    dispatcher.enqueue(detections, jpeg, {
+        "camera_id": metadata.get("camera_id"),
+        "clip_id": metadata.get("clip_id"),
+        "frame_timestamp": metadata.get("timestamp"),
+        "timestamp": asyncio.get_event_loop().time()
+    })
 
-async def send_alert(detections: List[Dict], image_b64: str):
-    """Envía alerta al servicio de fusión si hay detecciones"""
-    if not detections:
+async def expire_tracks_loop():
+    """Informa tracks perdidos de cámaras que dejaron de enviar frames"""
+    while True:
+        await asyncio.sleep(1)
+        if pool is None:
+            continue
+        for camera_id, events in tracker.expire(pool.names).items():
+            send_alert(records_to_columns(events), None, {"camera_id": camera_id})
+
+def forward_detections(boxes, jpeg: bytes, metadata: Dict[str, Any]):
+    """Envía a fusion las detecciones del frame o, con tracking, sus eventos de track"""
+    if tracker is None:
+        if len(boxes):
+            send_alert(detections_to_columns(boxes, pool.names), jpeg, metadata)
         return
-    
-    try:
-        async with session.post(
-            fusion_url,
-            json={
-                "detections": detections,
-                "image": image_b64,
-                "timestamp": asyncio.get_event_loop().time()
-            },
-            timeout=aiohttp.ClientTimeout(total=5)
-        ) as response:
-            if response.status == 200:
-                logger.info(f"Alerta enviada: {len(detections)} detecciones")
-            else:
-                logger.warning(f"Error enviando alerta: {response.status}")
-    except Exception as e:
-        logger.error(f"Error enviando alerta: {e}")
+    events = tracker.update(metadata.get("camera_id") or "default", boxes, pool.names)
+    if events:
+        # Los eventos "lost" no necesitan imagen
+        with_image = any(event["track_event"] != "lost" for event in events)
+        send_alert(records_to_columns(events), jpeg if with_image else None, metadata)
 
 @app.post("/infer")
-async def infer(request: dict):
-    """Endpoint principal de inferencia"""
-    if model is None:
-        raise HTTPException(status_code=503, detail="Modelo no disponible")
+async def infer(request: Request, response_format: str = Query('records', alias='format')):
+    """Endpoint principal de inferencia (image/jpeg, multipart o JSON base64)
+
+    `?format=columnar` devuelve las detecciones como listas por campo.
+    """
+    if pool is None:
+        raise HTTPException(status_code=503, detail=f"Modelo no disponible ({startup_state['state']})")
+    if response_format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato desconocido: {response_format}")
     
     try:
-        # Decodificar imagen base64
-        image_b64 = request.get("image")
-        if not image_b64:
+        try:
+            jpeg, metadata = await read_image_request(request)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Petición inválida: {e}")
+        if not jpeg:
             raise HTTPException(status_code=400, detail="No se proporcionó imagen")
         
-        frame = base64_to_image(image_b64)
+        camera_id = metadata.get("camera_id") or "default"
+        frame_hash = None
+        boxes = None
+        if result_cache is not None:
+            try:
+                # Decodificar la miniatura bloquea: se hace fuera del event loop
+                frame_hash = await asyncio.to_thread(result_cache.hash, jpeg)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            boxes = result_cache.get(camera_id, frame_hash)
         
-        # Realizar inferencia
-        results = model.predict(
-            frame,
-            conf=conf_threshold,
-            iou=iou_threshold,
-            verbose=False
-        )
-        
-        # Procesar detecciones
-        detections = process_detections(results)
+        if boxes is not None:
+            outcome = {"result": boxes, "batch": None}
+        else:
+            outcome = await run_inference(jpeg, camera_rois.get(camera_id))
+            boxes = outcome["result"]
+            if frame_hash is not None:
+                result_cache.put(camera_id, frame_hash, boxes)
         
-        # Enviar alerta si hay detecciones
-        if detections:
-            await send_alert(detections, image_b64)
+        # Enviar alerta si hay detecciones (o eventos de track)
+        forward_detections(boxes, jpeg, metadata)
         
         return JSONResponse(content={
-            "detections": detections,
-            "count": len(detections),
+            "camera_id": metadata.get("camera_id"),
+            "format": response_format,
+            "detections": format_detections(boxes, pool.names, response_format),
+            "count": len(boxes),
+            "batch": outcome["batch"],
+            "cached": outcome["batch"] is None,
             "status": "success"
         })
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error en inferencia: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def run_inference(jpeg: bytes, regions=None) -> Dict[str, Any]:
+    """Inferencia agrupada con otras peticiones concurrentes"""
+    try:
+        outcome = await batcher.submit((jpeg, regions))
+    except QueueFullError as e:
+        # Rechazar rápido en vez de acumular latencia: ingesta reintenta y baja su fps
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(retry_after)}
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except WorkerError as e:
+        # El worker se reinicia en segundo plano: ingesta reintenta igual que con la cola llena
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(retry_after)}
+        )
+    logger.debug(f"Lote de {outcome['batch']['size']}, espera {outcome['batch']['queue_wait_ms']} ms")
+    return outcome
+
 @app.get("/health")
 async def health():
-    """Health check endpoint"""
-    model_status = "loaded" if model is not None else "not_loaded"
+    """Health check endpoint (el proceso vive; ver /ready para el modelo)"""
+    model_status = "loaded" if pool is not None else startup_state["state"]
     return {
         "status": "healthy",
         "service": "inferencia",
-        "model": model_status
+        "model": model_status,
+        "queued": batcher.queued if batcher else 0,
+        "alerts": dispatcher.status() if dispatcher else None,
+        "tracker": tracker.status() if tracker else None,
+        "result_cache": result_cache.status() if result_cache else None,
+        "workers": pool.status() if pool else None
+    }
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 solo cuando el modelo está cargado y calentado"""
+    content = {
+        "ready": pool is not None,
+        "state": startup_state["state"],
+        "steps": startup_state["steps"],
+        "error": startup_state["error"],
     }
+    return JSONResponse(status_code=200 if pool is not None else 503, content=content)
 
 @app.get("/model/info")
 async def model_info():
     """Información del modelo"""
-    if model is None:
+    if pool is None:
         raise HTTPException(status_code=503, detail="Modelo no disponible")
     
     return {
         "model_path": model_path,
+        "backend": backend,
+        "precision": precision,
         "conf_threshold": conf_threshold,
         "iou_threshold": iou_threshold,
-        "classes": model.names if hasattr(model, 'names') else {}
+        "imgsz": imgsz,
+        "device": device,
+        "filter_classes": classes,
+        "roi_cameras": sorted(camera_rois),
+        "max_batch_size": max_batch_size,
+        "max_wait_ms": max_wait_ms,
+        "processes": worker_processes,
+        "threads_per_worker": threads_per_worker,
+        "max_queue": max_queue,
+        "classes": pool.names
     }
 
 if __name__ == "__main__":
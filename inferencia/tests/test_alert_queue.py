@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import aiohttp
+from aiohttp import web
+
+from alert_queue import AlertDispatcher
+
+
+class FakeFusion:
+    """POST /batch que responde con los códigos indicados (200 al agotarse)"""
+
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.received = []
+
+    async def handle(self, request):
+        self.received.append(await request.json())
+        return web.Response(status=self.statuses.pop(0) if self.statuses else 200)
+
+
+async def run_dispatcher(tmp_path, statuses, scenario, **config):
+    fusion = FakeFusion(statuses)
+    app = web.Application()
+    app.router.add_post('/batch', fusion.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        async with aiohttp.ClientSession() as session:
+            dispatcher = AlertDispatcher(session, f'http://127.0.0.1:{port}/batch', 'json', {
+                'spool_dir': str(tmp_path / 'spool'), 'replay_interval': 0.05, 'batch_wait_ms': 1,
+                'max_retries': 1, 'backoff_base': 0.01, **config,
+            })
+            await scenario(dispatcher)
+            await dispatcher.stop()
+            return dispatcher, fusion
+    finally:
+        await runner.cleanup()
+
+
+def write_spool(spool_dir, name, camera_id):
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    (spool_dir / f"{name}.json").write_text(json.dumps([{"camera_id": camera_id, "detections": [], "image": None}]))
+
+
+async def settle(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "Condición no alcanzada"
+        await asyncio.sleep(0.01)
+
+
+def test_rejected_batch_during_replay_goes_to_dead_letter(tmp_path):
+    spool = tmp_path / 'spool'
+    write_spool(spool, '0001', 'malo')
+    write_spool(spool, '0002', 'bueno')
+
+    async def scenario(dispatcher):
+        dispatcher.start()
+        await settle(lambda: not dispatcher._spool_files())
+        assert dispatcher.fusion_up
+        # Una alerta nueva sale directo: fusion no quedó marcado como caído
+        dispatcher.enqueue([], None, {"camera_id": "nueva"})
+        await settle(lambda: dispatcher.stats["sent"] == 2)
+
+    dispatcher, fusion = asyncio.run(run_dispatcher(tmp_path, [400], scenario))
+    assert dispatcher.stats["rejected"] == 1
+    assert dispatcher.stats["replayed"] == 1
+    assert dispatcher.stats["spilled"] == 0
+    assert [path.name for path in (spool / 'rejected').iterdir()] == ['0001.json']
+    # El lote rechazado se envió una sola vez
+    cameras = [item["camera_id"] for body in fusion.received for item in body["items"]]
+    assert cameras == ['malo', 'bueno', 'nueva']
+
+
+def test_rejected_live_batch_is_not_retried_or_spooled(tmp_path):
+    async def scenario(dispatcher):
+        dispatcher.start()
+        dispatcher.enqueue([], None, {"camera_id": "a"})
+        await settle(lambda: dispatcher.stats["rejected"] == 1)
+
+    dispatcher, fusion = asyncio.run(run_dispatcher(tmp_path, [422], scenario))
+    assert len(fusion.received) == 1
+    assert dispatcher.stats["retries"] == 0
+    assert dispatcher.fusion_up
+    assert not dispatcher._spool_files()
+    assert len(list((tmp_path / 'spool' / 'rejected').iterdir())) == 1
+
+
+def test_server_errors_are_spooled_and_replayed(tmp_path):
+    async def scenario(dispatcher):
+        dispatcher.start()
+        dispatcher.enqueue([], None, {"camera_id": "a"})
+        await settle(lambda: dispatcher.stats["replayed"] == 1)
+
+    dispatcher, fusion = asyncio.run(run_dispatcher(tmp_path, [500, 503, 500], scenario))
+    assert dispatcher.stats["spilled"] == 1
+    assert dispatcher.stats["rejected"] == 0
+    assert dispatcher.fusion_up
+    assert not dispatcher._spool_files()
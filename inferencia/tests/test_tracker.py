@@ -0,0 +1,43 @@
+import numpy as np
+
+from tracker import CameraTracker, MultiCameraTracker
+
+NAMES = {0: "person", 2: "car"}
+
+
+def box(x, confidence=0.9, cls=0):
+    return [x, 0, x + 50, 100, confidence, cls]
+
+
+def test_track_confirmed_after_min_hits_and_followed():
+    tracker = CameraTracker({'min_hits': 2})
+    assert tracker.update(np.array([box(0)]), now=0) == []
+    events = tracker.update(np.array([box(5)]), now=1)
+    assert [(t.track_id, t.last_event[0]) for t in events] == [(1, 'new')]
+    # Mismo objeto moviéndose: sin eventos nuevos dentro de update_interval
+    assert tracker.update(np.array([box(10)]), now=2) == []
+    assert len(tracker.tracks) == 1
+
+
+def test_low_confidence_only_continues_tracks():
+    tracker = CameraTracker({'min_hits': 1})
+    tracker.update(np.array([box(0)]), now=0)
+    tracker.update(np.array([box(2, confidence=0.2), box(500, confidence=0.2)]), now=1)
+    assert len(tracker.tracks) == 1
+    assert tracker.tracks[0].last_seen == 1
+
+
+def test_classes_are_not_mixed():
+    tracker = CameraTracker({'min_hits': 1})
+    tracker.update(np.array([box(0, cls=0)]), now=0)
+    events = tracker.update(np.array([box(0, cls=2)]), now=1)
+    assert [t.track_id for t in events] == [2]
+
+
+def test_lost_event_after_max_age():
+    trackers = MultiCameraTracker({'min_hits': 1, 'max_age': 5})
+    assert [e["track_event"] for e in trackers.update("a", np.array([box(0)]), NAMES, now=0)] == ['new']
+    assert trackers.expire(NAMES, now=3) == {}
+    lost = trackers.expire(NAMES, now=10)
+    assert [(e["track_id"], e["track_event"], e["class_name"]) for e in lost["a"]] == [(1, 'lost', 'person')]
+    assert trackers.status()["cameras"] == {"a": 0}
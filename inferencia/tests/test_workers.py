@@ -0,0 +1,114 @@
+import asyncio
+import multiprocessing as mp
+
+import pytest
+
+from workers import InferencePool, InferenceWorker, WorkerError, WorkerTimeoutError
+
+
+class FakeWorker:
+    """Worker sin proceso: `run_failures` son las excepciones de los próximos lotes
+
+    Un WorkerError simple simula un proceso muerto; el timeout deja el proceso
+    vivo (colgado) y cualquier otra excepción es un error del lote.
+    """
+
+    def __init__(self, index, run_failures=()):
+        self.index = index
+        self.run_failures = list(run_failures)
+        self.start_failures = 0
+        self.alive = True
+        self.starts = 0
+
+    async def run(self, items):
+        if self.run_failures:
+            error = self.run_failures.pop(0)
+            if type(error) is WorkerError:
+                self.alive = False
+            raise error
+        return items
+
+    async def start(self):
+        self.starts += 1
+        if self.start_failures:
+            self.start_failures -= 1
+            raise WorkerError("no arrancó")
+        self.alive = True
+
+    def stop(self, timeout=5):
+        self.alive = False
+
+    def status(self):
+        return {"index": self.index}
+
+
+def make_pool(*workers):
+    pool = InferencePool(len(workers), {}, pin_cpus=False, restart_backoff=0.01, restart_backoff_max=0.02)
+    pool.workers = list(workers)
+    return pool
+
+
+async def settle(condition, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "Condición no alcanzada"
+        await asyncio.sleep(0.01)
+
+
+def test_dead_worker_returns_to_pool_only_after_a_successful_restart():
+    worker = FakeWorker(0, run_failures=[WorkerError("murió")])
+
+    async def scenario():
+        pool = make_pool(worker)
+        await pool.start()
+        worker.start_failures = 2
+        with pytest.raises(WorkerError):
+            await pool.run_batch(["a"])
+        # Mientras se reinicia no hay worker: el lote falla rápido en vez de esperar
+        assert pool.status()["down"] == [0]
+        with pytest.raises(WorkerError):
+            await pool.run_batch(["b"])
+        await settle(lambda: not pool.status()["down"])
+        assert await pool.run_batch(["c"]) == ["c"]
+        return pool
+
+    pool = asyncio.run(scenario())
+    assert worker.starts == 4
+    assert pool.restart_errors == 2
+
+
+def test_hung_worker_is_restarted():
+    worker = FakeWorker(0, run_failures=[WorkerTimeoutError("sin respuesta")])
+
+    async def scenario():
+        pool = make_pool(worker)
+        await pool.start()
+        with pytest.raises(WorkerTimeoutError):
+            await pool.run_batch(["a"])
+        await settle(lambda: not pool.status()["down"])
+        return pool
+
+    assert asyncio.run(scenario()).restarts == 1
+
+
+def test_failed_batch_keeps_a_live_worker():
+    worker = FakeWorker(0, run_failures=[ValueError("JPEG inválido")])
+
+    async def scenario():
+        pool = make_pool(worker)
+        await pool.start()
+        with pytest.raises(ValueError):
+            await pool.run_batch(["a"])
+        return await pool.run_batch(["b"]), pool
+
+    result, pool = asyncio.run(scenario())
+    assert result == ["b"]
+    assert pool.restarts == 0
+
+
+def test_call_times_out_when_worker_does_not_answer():
+    worker = InferenceWorker(0, {}, None, batch_timeout=0.05)
+    worker.conn, child = mp.Pipe()
+    with pytest.raises(WorkerTimeoutError):
+        worker._call(["a"])
+    assert child.recv() == ["a"]
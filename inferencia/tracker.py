@@ -0,0 +1,238 @@
+"""
+Seguimiento multi-objeto por cámara
+Asociación por IoU en dos etapas (estilo ByteTrack) con predicción de velocidad constante
+"""
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_TRACKER_CONFIG = {
+    'enabled': False,
+    'iou_threshold': 0.3,      # IoU mínimo entre predicción y detección
+    'high_confidence': 0.5,    # detecciones que pueden crear tracks
+    'low_confidence': 0.1,     # por debajo se ignoran; entre ambas solo continúan tracks
+    'min_hits': 2,             # asociaciones antes de confirmar el track (evento "new")
+    'max_age': 5,              # segundos sin asociar antes de dar el track por perdido
+    'update_interval': 30,     # segundos mínimos entre eventos "updated" de un track
+    'velocity_smoothing': 0.5,
+}
+
+TRACK_EVENTS = ('new', 'updated', 'lost')
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU entre cajas xyxy (N, 4) y (M, 4) -> (N, M)"""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-6)
+
+
+def greedy_match(iou: np.ndarray, threshold: float):
+    """Pares (fila, columna) de mayor IoU primero, sin repetir filas ni columnas"""
+    matches = []
+    if iou.size == 0:
+        return matches
+    rows, cols = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[rows, cols])
+    used_rows, used_cols = set(), set()
+    for k in order:
+        row, col = int(rows[k]), int(cols[k])
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        matches.append((row, col))
+    return matches
+
+
+class Track:
+    """Un objeto seguido: caja (centro, tamaño) y velocidad del centro en px/s"""
+
+    __slots__ = ('track_id', 'cls', 'confidence', 'center', 'size', 'velocity',
+                 'first_seen', 'last_seen', 'hits', 'confirmed', 'last_event')
+
+    def __init__(self, track_id: int, box: np.ndarray, now: float):
+        self.track_id = track_id
+        self.cls = int(box[5])
+        self.confidence = float(box[4])
+        self.center = np.array([(box[0] + box[2]) / 2, (box[1] + box[3]) / 2], dtype=np.float64)
+        self.size = np.array([box[2] - box[0], box[3] - box[1]], dtype=np.float64)
+        self.velocity = np.zeros(2, dtype=np.float64)
+        self.first_seen = now
+        self.last_seen = now
+        self.hits = 1
+        self.confirmed = False
+        self.last_event = None
+
+    def predict(self, now: float) -> np.ndarray:
+        """Caja xyxy esperada en `now` con velocidad constante"""
+        center = self.center + self.velocity * (now - self.last_seen)
+        half = self.size / 2
+        return np.concatenate((center - half, center + half))
+
+    def update(self, box: np.ndarray, now: float, smoothing: float):
+        center = np.array([(box[0] + box[2]) / 2, (box[1] + box[3]) / 2], dtype=np.float64)
+        dt = now - self.last_seen
+        if dt > 0:
+            observed = (center - self.center) / dt
+            self.velocity += smoothing * (observed - self.velocity)
+        self.center = center
+        self.size = np.array([box[2] - box[0], box[3] - box[1]], dtype=np.float64)
+        self.confidence = float(box[4])
+        self.last_seen = now
+        self.hits += 1
+
+    def xyxy(self) -> List[float]:
+        half = self.size / 2
+        return np.concatenate((self.center - half, self.center + half)).tolist()
+
+
+class CameraTracker:
+    """Tracks activos de una cámara"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = dict(DEFAULT_TRACKER_CONFIG)
+        self.config.update(config or {})
+        self.tracks: List[Track] = []
+        self._next_id = 1
+
+    def _associate(self, tracks: List[Track], boxes: np.ndarray, now: float):
+        """Asocia tracks y cajas de la misma clase; retorna (pares, tracks libres, cajas libres)"""
+        if not tracks or len(boxes) == 0:
+            return [], list(range(len(tracks))), list(range(len(boxes)))
+        predicted = np.array([t.predict(now) for t in tracks])
+        iou = iou_matrix(predicted, boxes[:, :4])
+        same_class = np.array([t.cls for t in tracks])[:, None] == boxes[None, :, 5].astype(np.int64)
+        matches = greedy_match(np.where(same_class, iou, 0), self.config['iou_threshold'])
+        matched_tracks = {row for row, _ in matches}
+        matched_boxes = {col for _, col in matches}
+        return (
+            matches,
+            [i for i in range(len(tracks)) if i not in matched_tracks],
+            [j for j in range(len(boxes)) if j not in matched_boxes],
+        )
+
+    def update(self, boxes: np.ndarray, now: Optional[float] = None) -> List[Track]:
+        """Procesa las cajas (N, 6) de un frame; retorna los tracks con evento pendiente"""
+        now = time.monotonic() if now is None else now
+        config = self.config
+        boxes = boxes[boxes[:, 4] >= config['low_confidence']]
+        high = boxes[boxes[:, 4] >= config['high_confidence']]
+        low = boxes[boxes[:, 4] < config['high_confidence']]
+
+        # Etapa 1: detecciones confiables contra todos los tracks
+        matches, free_tracks, free_high = self._associate(self.tracks, high, now)
+        updated = []
+        for row, col in matches:
+            self.tracks[row].update(high[col], now, config['velocity_smoothing'])
+            updated.append(self.tracks[row])
+
+        # Etapa 2: detecciones débiles solo continúan tracks ya existentes (oclusiones)
+        remaining = [self.tracks[i] for i in free_tracks]
+        matches, _, _ = self._associate(remaining, low, now)
+        for row, col in matches:
+            remaining[row].update(low[col], now, config['velocity_smoothing'])
+            updated.append(remaining[row])
+
+        for col in free_high:
+            self.tracks.append(Track(self._next_id, high[col], now))
+            self._next_id += 1
+
+        events = []
+        for track in updated:
+            if not track.confirmed:
+                if track.hits >= config['min_hits']:
+                    track.confirmed = True
+                    track.last_event = ('new', now)
+                    events.append(track)
+            elif now - track.last_event[1] >= config['update_interval']:
+                track.last_event = ('updated', now)
+                events.append(track)
+        if config['min_hits'] <= 1:
+            for track in self.tracks[len(self.tracks) - len(free_high):]:
+                track.confirmed = True
+                track.last_event = ('new', now)
+                events.append(track)
+        return events
+
+    def expire(self, now: Optional[float] = None) -> List[Track]:
+        """Elimina los tracks sin asociar por más de max_age; retorna los confirmados"""
+        now = time.monotonic() if now is None else now
+        lost, alive = [], []
+        for track in self.tracks:
+            if now - track.last_seen > self.config['max_age']:
+                if track.confirmed:
+                    track.last_event = ('lost', now)
+                    lost.append(track)
+            else:
+                alive.append(track)
+        self.tracks = alive
+        return lost
+
+
+def track_event(track: Track, names: Dict[int, str]) -> Dict[str, Any]:
+    """Evento de track en el formato de detección que espera fusion"""
+    x1, y1, x2, y2 = track.xyxy()
+    return {
+        "class": track.cls,
+        "class_name": names[track.cls],
+        "confidence": track.confidence,
+        "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2},
+        "track_id": track.track_id,
+        "track_event": track.last_event[0],
+        "track_age": round(track.last_seen - track.first_seen, 3),
+        "track_hits": track.hits,
+    }
+
+
+class MultiCameraTracker:
+    """Un CameraTracker por cámara, creado al recibir su primer frame"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        self.config = dict(DEFAULT_TRACKER_CONFIG)
+        self.config.update(config or {})
+        self.cameras: Dict[str, CameraTracker] = {}
+        self.stats = {"frames": 0, "detections": 0, "events": {event: 0 for event in TRACK_EVENTS}}
+
+    def update(self, camera_id: str, boxes: np.ndarray, names: Dict[int, str],
+               now: Optional[float] = None) -> List[Dict[str, Any]]:
+        tracker = self.cameras.get(camera_id)
+        if tracker is None:
+            tracker = self.cameras[camera_id] = CameraTracker(self.config)
+        now = time.monotonic() if now is None else now
+        # Los perdidos de esta cámara se informan junto con el frame que los revela
+        tracks = tracker.expire(now) + tracker.update(boxes, now)
+        self.stats["frames"] += 1
+        self.stats["detections"] += len(boxes)
+        return self._events(tracks, names)
+
+    def expire(self, names: Dict[int, str], now: Optional[float] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """Eventos "lost" de cámaras que dejaron de enviar frames"""
+        now = time.monotonic() if now is None else now
+        lost = {}
+        for camera_id, tracker in self.cameras.items():
+            events = self._events(tracker.expire(now), names)
+            if events:
+                lost[camera_id] = events
+        return lost
+
+    def _events(self, tracks: List[Track], names: Dict[int, str]) -> List[Dict[str, Any]]:
+        events = [track_event(track, names) for track in tracks]
+        for event in events:
+            self.stats["events"][event["track_event"]] += 1
+        return events
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "cameras": {camera_id: len(t.tracks) for camera_id, t in self.cameras.items()},
+            **self.stats,
+        }
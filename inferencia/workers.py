@@ -0,0 +1,381 @@
+"""
+Pool de procesos de inferencia
+Cada worker carga su propia copia del modelo y queda fijado a un grupo de núcleos
+"""
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from backends import load_model
+from roi import apply_roi, bounding_crop, crop_pixels
+
+logger = logging.getLogger("inferencia")
+
+
+class WorkerError(Exception):
+    """El worker falló procesando un lote o terminó inesperadamente"""
+
+
+class WorkerTimeoutError(WorkerError):
+    """El worker no respondió un lote a tiempo; hay que matarlo y relanzarlo"""
+
+
+def _configure_worker(threads: int, cpus: Optional[List[int]]):
+    """Fija afinidad de CPU y número de hilos antes de importar torch"""
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    for variable in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[variable] = str(threads)
+
+    import cv2
+    import torch
+    torch.set_num_threads(threads)
+    # El paralelismo viene de los procesos: OpenCV no debe abrir más hilos
+    cv2.setNumThreads(1)
+
+
+def _resolve_classes(classes, names: Dict[int, str]) -> Optional[List[int]]:
+    """Acepta índices o nombres de clase; None para todas"""
+    if not classes:
+        return None
+    by_name = {name: index for index, name in names.items()}
+    resolved = []
+    for cls in classes:
+        if isinstance(cls, str):
+            if cls not in by_name:
+                raise ValueError(f"Clase desconocida en la configuración: {cls}")
+            resolved.append(by_name[cls])
+        else:
+            resolved.append(int(cls))
+    return resolved
+
+
+def _predict_kwargs(model, options: Dict[str, Any]) -> Dict[str, Any]:
+    """Parámetros de model.predict según yolov8_config.yaml"""
+    kwargs = {
+        'conf': options['conf_threshold'],
+        'iou': options['iou_threshold'],
+        'imgsz': options.get('imgsz', 640),
+        'classes': _resolve_classes(options.get('classes'), model.names),
+        'verbose': False,
+    }
+    # Los modelos exportados (ONNX/OpenVINO) se ejecutan en CPU
+    if options.get('backend', 'pytorch') == 'pytorch' and options.get('device'):
+        kwargs['device'] = options['device']
+    return kwargs
+
+
+def _warmup(model, predict_kwargs: Dict[str, Any], options: Dict[str, Any]) -> float:
+    """Pasadas con imágenes vacías a imgsz para pagar los costos de la primera inferencia"""
+    started = time.monotonic()
+    imgsz = predict_kwargs['imgsz']
+    blank = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    for batch_size in options.get('warmup_batch_sizes', [1]):
+        for _ in range(options.get('warmup_runs', 0)):
+            model.predict([blank] * batch_size, **predict_kwargs)
+    return round(time.monotonic() - started, 3)
+
+
+def decode_for_model(jpeg: bytes, imgsz: int, regions=None):
+    """Decodifica el JPEG a la escala reducida (1, 1/2, 1/4, 1/8) más cercana a imgsz
+
+    Con ROI se recorta el rectángulo que envuelve las regiones y la escala se
+    elige según el tamaño del recorte, no del frame completo. El modelo
+    reescala el lado mayor a imgsz de todos modos, así que se usa el mayor
+    factor que no deja la imagen por debajo de imgsz. Retorna
+    (imagen, (dx, dy), (escala_x, escala_y), tamaño_original): una caja en la
+    imagen vuelve a la original como (x + dx) * escala_x.
+    """
+    from frames import Frame
+
+    frame = Frame(jpeg=jpeg)
+    size = frame.size
+    if size is None:
+        image = frame.image
+        size = (image.shape[1], image.shape[0])
+    width, height = size
+
+    crop = None
+    if regions:
+        crop = crop_pixels(bounding_crop(regions), width, height)
+        longest = max(crop[2] - crop[0], crop[3] - crop[1])
+    else:
+        longest = max(width, height)
+    factor = next((f for f in (8, 4, 2) if longest // f >= imgsz), 1)
+    image = frame.decode_reduced(factor)
+    scale_x, scale_y = width / image.shape[1], height / image.shape[0]
+
+    if crop is None:
+        return image, (0, 0), (scale_x, scale_y), size
+    left, top = int(crop[0] / scale_x), int(crop[1] / scale_y)
+    right, bottom = int(np.ceil(crop[2] / scale_x)), int(np.ceil(crop[3] / scale_y))
+    return image[top:bottom, left:right], (left, top), (scale_x, scale_y), size
+
+
+def _run_batch(model, items: List[Any], predict_kwargs: Dict[str, Any]) -> List[Any]:
+    """Decodifica y ejecuta un lote completo en un solo model.predict
+
+    Cada item es (jpeg, regiones ROI o None). Cada resultado es el array
+    (N, 6) de cajas en coordenadas de la imagen original, sin las que caen
+    fuera de la ROI; el formato JSON se arma en el proceso principal.
+    """
+    from postprocess import extract_boxes
+
+    images = []
+    transforms = []
+    results: List[Any] = [None] * len(items)
+    valid = []
+    for index, (jpeg, regions) in enumerate(items):
+        try:
+            image, offset, scale, size = decode_for_model(jpeg, predict_kwargs['imgsz'], regions)
+            images.append(image)
+            transforms.append((offset, scale, size, regions))
+            valid.append(index)
+        except ValueError as e:
+            results[index] = e
+
+    if images:
+        predictions = model.predict(images, **predict_kwargs)
+        for index, prediction, (offset, scale, size, regions) in zip(valid, predictions, transforms):
+            boxes = extract_boxes(prediction)
+            if offset != (0, 0):
+                boxes[:, [0, 2]] += offset[0]
+                boxes[:, [1, 3]] += offset[1]
+            if scale != (1.0, 1.0):
+                boxes[:, [0, 2]] *= scale[0]
+                boxes[:, [1, 3]] *= scale[1]
+            results[index] = apply_roi(regions, boxes, size)
+    return results
+
+
+def worker_main(conn, index: int, options: Dict[str, Any], cpus: Optional[List[int]]):
+    """Punto de entrada del proceso worker"""
+    started = time.monotonic()
+    try:
+        _configure_worker(options['threads'], cpus)
+        model = load_model(options)
+        load_s = round(time.monotonic() - started, 3)
+        predict_kwargs = _predict_kwargs(model, options)
+        warmup_s = _warmup(model, predict_kwargs, options)
+    except Exception as e:
+        conn.send(("error", f"No se pudo cargar el modelo: {e!r}"))
+        return
+    conn.send(("ready", {
+        "pid": os.getpid(),
+        "cpus": cpus,
+        "names": dict(model.names),
+        "load_s": load_s,
+        "warmup_s": warmup_s,
+    }))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+        try:
+            conn.send(("ok", _run_batch(model, message, predict_kwargs)))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+
+
+class InferenceWorker:
+    """Lado padre de un worker: un pipe y un hilo que espera sus respuestas"""
+
+    def __init__(self, index: int, options: Dict[str, Any], cpus: Optional[List[int]],
+                 batch_timeout: Optional[float] = None):
+        self.index = index
+        self.options = options
+        self.cpus = cpus
+        self.batch_timeout = batch_timeout
+        self.process = None
+        self.conn = None
+        self.info: Dict[str, Any] = {}
+        self.batches = 0
+        # Un hilo por worker para las llamadas bloqueantes al pipe
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"worker-{index}")
+
+    async def start(self):
+        """Lanza el proceso y espera a que cargue el modelo"""
+        context = mp.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_main,
+            args=(child_conn, self.index, self.options, self.cpus),
+            name=f"inferencia-worker-{self.index}",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+        loop = asyncio.get_running_loop()
+        try:
+            kind, payload = await loop.run_in_executor(self._io, self.conn.recv)
+        except (EOFError, OSError):
+            raise WorkerError(f"Worker {self.index} terminó durante el arranque")
+        if kind != "ready":
+            raise WorkerError(f"Worker {self.index}: {payload}")
+        self.info = payload
+        logger.info(f"Worker {self.index} listo (pid {payload['pid']}, CPUs {self.cpus}, "
+                    f"carga {payload['load_s']}s, calentamiento {payload['warmup_s']}s)")
+
+    def _call(self, items: List[Any]) -> List[Any]:
+        self.conn.send(items)
+        if self.batch_timeout and not self.conn.poll(self.batch_timeout):
+            raise WorkerTimeoutError(f"Worker {self.index} no respondió en {self.batch_timeout}s")
+        kind, payload = self.conn.recv()
+        if kind != "ok":
+            raise WorkerError(f"Worker {self.index}: {payload}")
+        return payload
+
+    async def run(self, items: List[Any]) -> List[Any]:
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._io, self._call, items)
+        except (EOFError, OSError) as e:
+            raise WorkerError(f"Worker {self.index} terminó inesperadamente: {e!r}")
+        self.batches += 1
+        return result
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self, timeout: float = 5):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except Exception:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+        self.conn.close()
+        self.process = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "pid": self.info.get("pid"),
+            "cpus": self.cpus,
+            "alive": self.alive,
+            "batches": self.batches,
+        }
+
+
+def assign_cpus(processes: int, threads_per_worker: int, pin_cpus: bool) -> List[Optional[List[int]]]:
+    """Reparte los núcleos disponibles en grupos disjuntos, uno por worker"""
+    if not pin_cpus or not hasattr(os, 'sched_getaffinity'):
+        return [None] * processes
+    available = sorted(os.sched_getaffinity(0))
+    if len(available) < processes * threads_per_worker:
+        logger.warning(
+            f"Solo hay {len(available)} CPUs para {processes}x{threads_per_worker} hilos, no se fija afinidad"
+        )
+        return [None] * processes
+    return [
+        available[i * threads_per_worker:(i + 1) * threads_per_worker]
+        for i in range(processes)
+    ]
+
+
+class InferencePool:
+    """Conjunto de workers; cada lote va al primer worker libre"""
+
+    def __init__(self, processes: int, options: Dict[str, Any], threads_per_worker: int = 1,
+                 pin_cpus: bool = True, batch_timeout: Optional[float] = 30,
+                 restart_backoff: float = 1, restart_backoff_max: float = 60):
+        self.options = dict(options, threads=threads_per_worker)
+        cpu_sets = assign_cpus(processes, threads_per_worker, pin_cpus)
+        self.workers = [InferenceWorker(i, self.options, cpu_sets[i], batch_timeout) for i in range(processes)]
+        self.restart_backoff = restart_backoff
+        self.restart_backoff_max = restart_backoff_max
+        self._idle = None
+        # Workers caídos: vuelven a _idle solo cuando su reinicio termina bien
+        self._recovering: Dict[int, asyncio.Task] = {}
+        self.restarts = 0
+        self.restart_errors = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.workers)
+
+    @property
+    def names(self) -> Dict[int, str]:
+        for worker in self.workers:
+            if worker.info.get("names"):
+                return worker.info["names"]
+        return {}
+
+    async def start(self):
+        """Arranca todos los workers en paralelo (crear dentro del event loop)"""
+        self._idle = asyncio.Queue()
+        await asyncio.gather(*(worker.start() for worker in self.workers))
+        for worker in self.workers:
+            self._idle.put_nowait(worker)
+
+    async def _restart(self, worker: InferenceWorker):
+        """Relanza el worker hasta que arranque, con espera creciente entre intentos"""
+        delay = self.restart_backoff
+        while True:
+            logger.warning(f"Reiniciando worker {worker.index}")
+            await asyncio.to_thread(worker.stop, 1)
+            self.restarts += 1
+            try:
+                await worker.start()
+            except Exception as e:
+                self.restart_errors += 1
+                logger.error(f"Worker {worker.index} no arrancó ({e}), reintento en {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.restart_backoff_max)
+                continue
+            self._recovering.pop(worker.index, None)
+            self._idle.put_nowait(worker)
+            return
+
+    async def run_batch(self, items: List[Any]) -> List[Any]:
+        """items: (jpeg, regiones ROI o None) por frame"""
+        if self._idle.empty() and len(self._recovering) == self.size:
+            raise WorkerError("Ningún worker disponible: todos se están reiniciando")
+        worker = await self._idle.get()
+        try:
+            result = await worker.run(items)
+        except WorkerError as e:
+            if isinstance(e, WorkerTimeoutError) or not worker.alive:
+                # El lote falla ya; el worker vuelve a la cola cuando su reinicio termine
+                self._recovering[worker.index] = asyncio.create_task(self._restart(worker))
+            else:
+                self._idle.put_nowait(worker)
+            raise
+        except BaseException:
+            self._idle.put_nowait(worker)
+            raise
+        self._idle.put_nowait(worker)
+        return result
+
+    def stop(self):
+        for task in self._recovering.values():
+            task.cancel()
+        for worker in self.workers:
+            worker.stop()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "processes": self.size,
+            "threads_per_worker": self.options['threads'],
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "restarts": self.restarts,
+            "restart_errors": self.restart_errors,
+            "down": sorted(self._recovering),
+            "workers": [worker.status() for worker in self.workers],
+        }
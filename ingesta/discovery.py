@@ -0,0 +1,100 @@
+"""
+Descubrimiento del método de captura
+Sondeo concurrente (gana el primero que responde) y caché en disco por cámara
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+async def race_probes(probes: List[Tuple[Hashable, Awaitable[bool]]],
+                      preferred: Optional[Hashable] = None,
+                      grace: float = 1.0) -> Optional[Hashable]:
+    """Ejecuta los sondeos en paralelo y retorna la clave del primero que tenga éxito
+
+    Si gana un sondeo distinto de `preferred` mientras este sigue pendiente,
+    se le concede `grace` segundos extra antes de darlo por perdido. Los
+    sondeos restantes se cancelan al terminar.
+    """
+    tasks = {asyncio.ensure_future(coro): key for key, coro in probes}
+    winner = None
+    try:
+        pending = set(tasks)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None and task.result():
+                    if winner is None or tasks[task] == preferred:
+                        winner = tasks[task]
+
+        if winner is not None and winner != preferred and preferred is not None:
+            preferred_tasks = [t for t in pending if tasks[t] == preferred]
+            if preferred_tasks:
+                done, _ = await asyncio.wait(preferred_tasks, timeout=grace)
+                for task in done:
+                    if task.exception() is None and task.result():
+                        winner = preferred
+        return winner
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class CaptureMethodCache:
+    """Método y URL de captura ganadores por cámara, persistidos en JSON"""
+
+    def __init__(self, path: Optional[Path]):
+        self.path = Path(path) if path else None
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    def _load(self):
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._entries = data
+        except Exception as e:
+            logger.warning(f"Caché de métodos de captura ilegible, se ignora: {e}")
+
+    def _save(self):
+        if self.path is None:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(self._entries, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar la caché de métodos de captura: {e}")
+
+    def get(self, camera_id: str, url: str) -> Optional[Dict[str, Any]]:
+        """Entrada cacheada si corresponde a la misma URL de la cámara"""
+        entry = self._entries.get(camera_id)
+        if entry and entry.get('url') == url:
+            return entry
+        return None
+
+    def set(self, camera_id: str, url: str, method: str, snapshot_url: Optional[str] = None):
+        self._entries[camera_id] = {
+            'url': url,
+            'method': method,
+            'snapshot_url': snapshot_url,
+            'detected_at': time.time(),
+        }
+        self._save()
+
+    def invalidate(self, camera_id: str):
+        if self._entries.pop(camera_id, None) is not None:
+            self._save()
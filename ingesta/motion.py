@@ -0,0 +1,129 @@
+"""
+Compuerta de movimiento para ingesta
+Descarta frames sin cambios antes de enviarlos a inferencia
+"""
+import time
+import cv2
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence
+
+DEFAULT_MOTION_CONFIG = {
+    'enabled': False,
+    'width': 160,               # ancho de la copia reducida en escala de grises
+    'pixel_threshold': 25,      # diferencia de intensidad (0-255) para contar un píxel como cambiado
+    'min_changed_ratio': 0.005, # fracción de píxeles cambiados para considerar que hay movimiento
+    'background_alpha': 0.05,   # velocidad de adaptación del modelo de fondo
+    'keyframe_interval': 60,    # segundos; fuerza el envío periódico aunque no haya movimiento
+    'mask': [],                 # polígonos (coordenadas normalizadas 0-1) a ignorar
+}
+
+
+def merge_motion_config(base: Optional[Dict[str, Any]],
+                        override: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combina la configuración global con la de una cámara"""
+    merged = dict(DEFAULT_MOTION_CONFIG)
+    merged.update(base or {})
+    merged.update(override or {})
+    return merged
+
+
+class MotionGate:
+    """Detecta movimiento con un fondo de media móvil sobre una copia reducida
+
+    Todo el trabajo se hace sobre una imagen de ~160 px de ancho en escala de
+    grises, así que cuesta una fracción mínima de una pasada de YOLO.
+    """
+
+    def __init__(self, width: int = 160, pixel_threshold: int = 25,
+                 min_changed_ratio: float = 0.005, background_alpha: float = 0.05,
+                 keyframe_interval: float = 60,
+                 mask: Optional[List[Sequence[Sequence[float]]]] = None):
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_ratio = min_changed_ratio
+        self.background_alpha = background_alpha
+        self.keyframe_interval = keyframe_interval
+        self.mask_polygons = mask or []
+
+        self._background = None
+        self._mask = None
+        self._mask_pixels = 0
+        self._last_sent = 0.0
+        self.stats = {
+            "frames_passed": 0,
+            "frames_skipped": 0,
+            "keyframes": 0,
+            "last_score": 0.0,
+        }
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'MotionGate':
+        return cls(
+            width=int(config['width']),
+            pixel_threshold=int(config['pixel_threshold']),
+            min_changed_ratio=float(config['min_changed_ratio']),
+            background_alpha=float(config['background_alpha']),
+            keyframe_interval=float(config['keyframe_interval']),
+            mask=config.get('mask') or [],
+        )
+
+    def _prepare(self, frame: np.ndarray) -> np.ndarray:
+        """Reduce, pasa a grises y suaviza el frame"""
+        height, width = frame.shape[:2]
+        if width > self.width:
+            new_height = max(1, int(height * self.width / width))
+            frame = cv2.resize(frame, (self.width, new_height), interpolation=cv2.INTER_AREA)
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(frame, (5, 5), 0)
+
+    def _build_mask(self, shape):
+        """Máscara de píxeles a evaluar (las zonas ignoradas quedan en 0)"""
+        height, width = shape
+        mask = np.full((height, width), 255, np.uint8)
+        for polygon in self.mask_polygons:
+            points = np.array(
+                [[int(x * (width - 1)), int(y * (height - 1))] for x, y in polygon],
+                np.int32
+            )
+            cv2.fillPoly(mask, [points], 0)
+        self._mask = mask
+        self._mask_pixels = max(1, int(np.count_nonzero(mask)))
+
+    def reset(self):
+        """Olvida el fondo (p. ej. tras reconectar la cámara)"""
+        self._background = None
+        self._mask = None
+
+    def should_process(self, frame: np.ndarray, now: Optional[float] = None) -> bool:
+        """True si el frame tiene movimiento o toca enviar un keyframe"""
+        now = time.time() if now is None else now
+        gray = self._prepare(frame)
+
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype(np.float32)
+            self._build_mask(gray.shape)
+            return self._accept(now, keyframe=True)
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        _, changed = cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)
+        changed = cv2.bitwise_and(changed, self._mask)
+        score = cv2.countNonZero(changed) / self._mask_pixels
+        self.stats["last_score"] = round(score, 5)
+
+        cv2.accumulateWeighted(gray, self._background, self.background_alpha)
+
+        if score >= self.min_changed_ratio:
+            return self._accept(now)
+        if self.keyframe_interval and now - self._last_sent >= self.keyframe_interval:
+            return self._accept(now, keyframe=True)
+
+        self.stats["frames_skipped"] += 1
+        return False
+
+    def _accept(self, now: float, keyframe: bool = False) -> bool:
+        self._last_sent = now
+        self.stats["frames_passed"] += 1
+        if keyframe:
+            self.stats["keyframes"] += 1
+        return True
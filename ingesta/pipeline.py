@@ -0,0 +1,158 @@
+"""
+Piezas del pipeline captura → inferencia
+Cola acotada con descarte del más antiguo y control adaptativo de fps
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+DEFAULT_PIPELINE_CONFIG = {
+    'queue_size': 2,            # frames en espera por cámara (se descarta el más antiguo)
+    'inflight_per_camera': 2,   # peticiones /infer simultáneas por cámara
+    'adaptive_fps': True,       # ajustar fps según la latencia observada de /infer
+    'min_fps': 0.2,
+    'latency_target': 1.0,      # segundos; por encima se reduce el fps
+    'adjust_interval': 2.0,     # segundos entre ajustes
+}
+
+
+def merge_pipeline_config(base: Optional[Dict[str, Any]],
+                          override: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combina la configuración global con la de una cámara"""
+    merged = dict(DEFAULT_PIPELINE_CONFIG)
+    merged.update(base or {})
+    merged.update(override or {})
+    return merged
+
+
+class FrameQueue:
+    """Cola acotada para frames: al llenarse descarta el más antiguo
+
+    El productor (captura) nunca espera; el consumidor siempre obtiene los
+    frames más recientes. Crear dentro del event loop.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = max(1, maxsize)
+        self._items = deque()
+        self._available = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, item: Any) -> bool:
+        """Encola sin bloquear; True si hubo que descartar un frame"""
+        dropped = False
+        if len(self._items) >= self.maxsize:
+            self._items.popleft()
+            self.dropped += 1
+            dropped = True
+        self._items.append(item)
+        self._available.set()
+        return dropped
+
+    async def get(self) -> Any:
+        while not self._items:
+            self._available.clear()
+            await self._available.wait()
+        return self._items.popleft()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class AdaptiveRateController:
+    """Ajusta el fps efectivo de una cámara con AIMD según la latencia de /infer
+
+    Si en la última ventana hubo errores, descartes o la latencia media supera
+    el objetivo, el fps se multiplica por 0.7; si la latencia está holgada
+    (< 50% del objetivo) sube un 10% del máximo configurado.
+    """
+
+    def __init__(self, max_fps: float, min_fps: float = 0.2, latency_target: float = 1.0,
+                 adjust_interval: float = 2.0, enabled: bool = True, ewma_alpha: float = 0.2):
+        self.max_fps = max_fps
+        self.min_fps = min(min_fps, max_fps)
+        self.latency_target = latency_target
+        self.adjust_interval = adjust_interval
+        self.enabled = enabled
+        self.ewma_alpha = ewma_alpha
+
+        self.fps = max_fps
+        self.latency_ewma = None
+        self._window_errors = 0
+        self._window_drops = 0
+        self._last_adjust = time.monotonic()
+        self._completed = deque()  # instantes de peticiones completadas (ventana de 10 s)
+
+    @property
+    def interval(self) -> float:
+        return 1.0 / self.fps
+
+    def record(self, latency: float, ok: bool, now: Optional[float] = None):
+        """Registra el resultado de una petición a inferencia"""
+        now = time.monotonic() if now is None else now
+        if ok:
+            if self.latency_ewma is None:
+                self.latency_ewma = latency
+            else:
+                self.latency_ewma += self.ewma_alpha * (latency - self.latency_ewma)
+            self._completed.append(now)
+        else:
+            self._window_errors += 1
+        self._maybe_adjust(now)
+
+    def record_drop(self):
+        self._window_drops += 1
+
+    def _maybe_adjust(self, now: float):
+        if not self.enabled or now - self._last_adjust < self.adjust_interval:
+            return
+        congested = (
+            self._window_errors > 0
+            or self._window_drops > 0
+            or (self.latency_ewma is not None and self.latency_ewma > self.latency_target)
+        )
+        if congested:
+            self.fps = max(self.min_fps, self.fps * 0.7)
+        elif self.latency_ewma is not None and self.latency_ewma < self.latency_target * 0.5:
+            self.fps = min(self.max_fps, self.fps + self.max_fps * 0.1)
+        self._window_errors = 0
+        self._window_drops = 0
+        self._last_adjust = now
+
+    def achieved_fps(self, now: Optional[float] = None) -> float:
+        """Frames procesados por segundo en los últimos 10 s"""
+        now = time.monotonic() if now is None else now
+        while self._completed and now - self._completed[0] > 10:
+            self._completed.popleft()
+        return len(self._completed) / 10
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "effective_fps": round(self.fps, 3),
+            "achieved_fps": round(self.achieved_fps(), 3),
+            "latency_ewma": round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+        }
+
+
+class LatencyWindow:
+    """Últimas `maxlen` latencias (segundos) con percentiles para /status"""
+
+    def __init__(self, maxlen: int = 1000):
+        self._values = deque(maxlen=maxlen)
+        self.count = 0
+
+    def record(self, value: float):
+        self._values.append(value)
+        self.count += 1
+
+    def percentiles(self) -> Dict[str, Any]:
+        if not self._values:
+            return {"count": self.count, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+        ordered = sorted(self._values)
+        last = len(ordered) - 1
+
+        def pick(q: float) -> float:
+            return round(ordered[min(last, int(round(q * last)))] * 1000, 2)
+
+        return {"count": self.count, "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
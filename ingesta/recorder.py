@@ -0,0 +1,377 @@
+"""
+Grabación de clips de eventos en ingesta
+Buffer circular de JPEGs por cámara y escritura de clips MJPEG/AVI sin recomprimir
+"""
+import asyncio
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from frames import Frame, jpeg_size
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RECORDER_CONFIG = {
+    'enabled': False,
+    'clips_dir': '/app/clips',
+    'pre_seconds': 5,          # segundos antes de la detección
+    'post_seconds': 10,        # segundos después de la última detección
+    'max_clip_seconds': 60,    # un clip se cierra al llegar a esta duración
+    'buffer_budget_mb': 256,   # presupuesto total de memoria (buffer + clips), repartido entre cámaras
+    'expire_interval': 1.0,    # segundos entre revisiones de clips vencidos sin frames nuevos
+    # Retención en disco (0 = sin límite): al guardar un clip se borran los más antiguos
+    'retention_max_clips': 1000,
+    'retention_max_mb': 2048,
+    'retention_days': 7,
+}
+
+# Máximo de entradas que retorna ClipIndex.list
+MAX_CLIP_LIST = 1000
+
+# Flags AVI
+_AVIF_HASINDEX = 0x10
+_AVIIF_KEYFRAME = 0x10
+
+
+def _chunk(fourcc: bytes, data: bytes) -> bytes:
+    padding = b"\x00" if len(data) % 2 else b""
+    return fourcc + struct.pack('<I', len(data)) + data + padding
+
+
+def _list(list_type: bytes, data: bytes) -> bytes:
+    return b"LIST" + struct.pack('<I', len(data) + 4) + list_type + data
+
+
+def write_mjpeg_avi(path: Path, jpegs: List[bytes], fps: float) -> Tuple[int, int]:
+    """Escribe un AVI Motion-JPEG con los JPEG tal cual (sin decodificar)
+
+    Retorna (ancho, alto). Bloqueante: llamar con asyncio.to_thread.
+    """
+    if not jpegs:
+        raise ValueError("No hay frames para el clip")
+    width, height = jpeg_size(jpegs[0]) or (0, 0)
+    fps = max(fps, 0.1)
+    max_frame = max(len(j) for j in jpegs)
+    rate_scale = 1000
+
+    movi_chunks = []
+    index_entries = []
+    offset = 4  # los offsets de idx1 se cuentan desde el fourcc 'movi'
+    for jpeg in jpegs:
+        chunk = _chunk(b"00dc", jpeg)
+        movi_chunks.append(chunk)
+        index_entries.append(b"00dc" + struct.pack('<III', _AVIIF_KEYFRAME, offset, len(jpeg)))
+        offset += len(chunk)
+
+    avih = struct.pack(
+        '<IIIIIIIIII4I',
+        int(1_000_000 / fps),          # dwMicroSecPerFrame
+        int(max_frame * fps),          # dwMaxBytesPerSec
+        0,                             # dwPaddingGranularity
+        _AVIF_HASINDEX,                # dwFlags
+        len(jpegs),                    # dwTotalFrames
+        0,                             # dwInitialFrames
+        1,                             # dwStreams
+        max_frame,                     # dwSuggestedBufferSize
+        width, height,
+        0, 0, 0, 0                     # dwReserved
+    )
+    strh = struct.pack(
+        '<4s4sIHHIIIIIIIIhhhh',
+        b"vids", b"MJPG",
+        0,                             # dwFlags
+        0, 0,                          # wPriority, wLanguage
+        0,                             # dwInitialFrames
+        rate_scale,                    # dwScale
+        int(round(fps * rate_scale)),  # dwRate (fps = rate / scale)
+        0,                             # dwStart
+        len(jpegs),                    # dwLength
+        max_frame,                     # dwSuggestedBufferSize
+        0xFFFFFFFF,                    # dwQuality (-1 = por defecto)
+        0,                             # dwSampleSize
+        0, 0, width, height            # rcFrame
+    )
+    strf = struct.pack(
+        '<IiiHH4sIiiII',
+        40, width, height, 1, 24, b"MJPG", width * height * 3, 0, 0, 0, 0
+    )
+
+    hdrl = _list(b"hdrl", _chunk(b"avih", avih) + _list(b"strl", _chunk(b"strh", strh) + _chunk(b"strf", strf)))
+    movi = _list(b"movi", b"".join(movi_chunks))
+    idx1 = _chunk(b"idx1", b"".join(index_entries))
+    body = b"AVI " + hdrl + movi + idx1
+
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(b"RIFF" + struct.pack('<I', len(body)) + body)
+    tmp_path.replace(path)
+    return width, height
+
+
+class ClipIndex:
+    """Índice de clips (JSONL) que fusion puede consultar por clip_id
+
+    Aplica la retención al agregar un clip: se borran los más antiguos (archivo
+    y entrada) mientras se supere la cantidad, los bytes o la antigüedad
+    máxima. `append` es bloqueante (llamar con asyncio.to_thread); el lock
+    protege el índice de las consultas del event loop.
+    """
+
+    def __init__(self, clips_dir: Path, max_clips: int = 0, max_bytes: int = 0, max_age: float = 0):
+        self.clips_dir = Path(clips_dir)
+        self.path = self.clips_dir / "index.jsonl"
+        self.max_clips = max_clips
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._aliases: Dict[str, str] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"clips_removed": 0}
+        self._load()
+        with self._lock:
+            self._apply_retention()
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    self._remember(json.loads(line))
+                except Exception:
+                    continue
+
+    def _remember(self, entry: Dict[str, Any]):
+        previous = self._entries.pop(entry['clip_id'], None)
+        if previous is not None:
+            self._bytes -= previous.get('bytes', 0)
+        self._entries[entry['clip_id']] = entry
+        self._bytes += entry.get('bytes', 0)
+        for trigger in entry.get('triggers', []):
+            self._aliases[trigger] = entry['clip_id']
+
+    def _over_limit(self, oldest: Dict[str, Any], now: float) -> bool:
+        return bool(
+            (self.max_clips and len(self._entries) > self.max_clips)
+            or (self.max_bytes and self._bytes > self.max_bytes)
+            or (self.max_age and now - oldest.get('created_at', now) > self.max_age)
+        )
+
+    def _apply_retention(self):
+        """Borra los clips más antiguos fuera de los límites y reescribe el índice"""
+        now = time.time()
+        removed = []
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if not self._over_limit(oldest, now):
+                break
+            del self._entries[oldest['clip_id']]
+            self._bytes -= oldest.get('bytes', 0)
+            removed.append(oldest)
+        if not removed:
+            return
+        for entry in removed:
+            for trigger in entry.get('triggers', []):
+                if self._aliases.get(trigger) == entry['clip_id']:
+                    del self._aliases[trigger]
+            try:
+                (self.clips_dir / entry['file']).unlink(missing_ok=True)
+            except OSError as e:
+                logger.error(f"No se pudo borrar el clip {entry['file']}: {e}")
+        # El índice se reescribe sin las entradas borradas (reemplazo atómico)
+        temporary = self.path.with_suffix('.jsonl.tmp')
+        with open(temporary, 'w') as f:
+            for entry in self._entries.values():
+                f.write(json.dumps(entry) + '\n')
+        os.replace(temporary, self.path)
+        self.stats["clips_removed"] += len(removed)
+        logger.info(f"Retención de clips: {len(removed)} clips borrados")
+
+    def append(self, entry: Dict[str, Any]):
+        with self._lock:
+            self.clips_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+            self._remember(entry)
+            self._apply_retention()
+
+    def find(self, clip_id: str) -> Optional[Dict[str, Any]]:
+        """Busca por clip_id o por cualquiera de los IDs de alerta que lo dispararon"""
+        with self._lock:
+            return self._entries.get(self._aliases.get(clip_id, clip_id))
+
+    def list(self, camera_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Los `limit` clips más recientes (como máximo MAX_CLIP_LIST), en orden cronológico"""
+        limit = max(0, min(limit, MAX_CLIP_LIST))
+        entries = []
+        with self._lock:
+            for entry in reversed(self._entries.values()):
+                if len(entries) >= limit:
+                    break
+                if camera_id is None or entry['camera_id'] == camera_id:
+                    entries.append(entry)
+        return entries[::-1]
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"clips": len(self._entries), "bytes": self._bytes, **self.stats}
+
+
+class ClipRecorder:
+    """Buffer circular de una cámara y clip en curso
+
+    Se guardan solo bytes JPEG (nunca arrays decodificados). `max_bytes` es un
+    tope duro compartido por el buffer, el clip en curso y los clips que
+    esperan escritura; al disparar un clip los frames pre-alerta pasan del
+    buffer al clip. Un clip vencido se cierra con el siguiente frame o con
+    `expire()`, lo que ocurra primero.
+    """
+
+    def __init__(self, camera_id: str, index: ClipIndex, pre_seconds: float = 5,
+                 post_seconds: float = 10, max_clip_seconds: float = 60,
+                 max_bytes: int = 8 * 1024 * 1024):
+        self.camera_id = camera_id
+        self.index = index
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_clip_seconds = max_clip_seconds
+        self.max_bytes = max_bytes
+
+        self._buffer = deque()  # (timestamp, jpeg)
+        self._buffer_bytes = 0
+        self._clip = None       # clip en curso
+        self._writes = set()
+        self._writing_bytes = 0  # clips cerrados que aún no terminan de escribirse
+        self.stats = {"clips_written": 0, "clip_frames_dropped": 0}
+
+    @property
+    def used_bytes(self) -> int:
+        """Bytes retenidos por la cámara: buffer, clip en curso y clips por escribir"""
+        clip_bytes = self._clip['bytes'] if self._clip is not None else 0
+        return self._buffer_bytes + clip_bytes + self._writing_bytes
+
+    def _push_buffer(self, timestamp: float, jpeg: bytes):
+        self._buffer.append((timestamp, jpeg))
+        self._buffer_bytes += len(jpeg)
+        # Si los clips ocupan el presupuesto, el buffer cede (incluso el frame recién llegado)
+        while self._buffer and (
+            self.used_bytes > self.max_bytes
+            or timestamp - self._buffer[0][0] > self.pre_seconds
+        ):
+            _, old = self._buffer.popleft()
+            self._buffer_bytes -= len(old)
+
+    def _expired(self, clip: Dict[str, Any], now: float) -> bool:
+        return now > clip['end'] or now - clip['start'] > self.max_clip_seconds
+
+    def add_frame(self, frame: Frame):
+        """Agrega un frame capturado al clip en curso o, si no hay, al buffer"""
+        jpeg = frame.jpeg
+        clip = self._clip
+        if clip is not None and self._expired(clip, frame.timestamp):
+            self._finalize()
+            clip = None
+        if clip is None:
+            self._push_buffer(frame.timestamp, jpeg)
+            return
+        if self.used_bytes + len(jpeg) > self.max_bytes:
+            self.stats["clip_frames_dropped"] += 1
+            return
+        clip['frames'].append((frame.timestamp, jpeg))
+        clip['bytes'] += len(jpeg)
+
+    def expire(self, now: Optional[float] = None):
+        """Cierra el clip en curso si ya venció aunque no lleguen más frames"""
+        if self._clip is not None and self._expired(self._clip, time.time() if now is None else now):
+            self._finalize()
+
+    def clip_id_for(self, timestamp: float) -> str:
+        """ID con el que se referenciará el clip de una posible alerta en este frame"""
+        if self._clip is not None and timestamp <= self._clip['end']:
+            return self._clip['clip_id']
+        return f"{self.camera_id}-{int(timestamp * 1000)}"
+
+    def trigger(self, timestamp: float, clip_id: str):
+        """Inicia (o extiende) un clip alrededor de una detección"""
+        if self._clip is not None:
+            self._clip['end'] = max(self._clip['end'], timestamp + self.post_seconds)
+            if clip_id not in self._clip['triggers']:
+                self._clip['triggers'].append(clip_id)
+            return
+
+        frames = [(ts, jpeg) for ts, jpeg in self._buffer if ts >= timestamp - self.pre_seconds]
+        # Los frames pasan del buffer al clip: no se cuentan dos veces
+        self._buffer.clear()
+        self._buffer_bytes = 0
+        self._clip = {
+            'clip_id': clip_id,
+            'start': frames[0][0] if frames else timestamp,
+            'end': timestamp + self.post_seconds,
+            'frames': frames,
+            'bytes': sum(len(j) for _, j in frames),
+            'triggers': [clip_id],
+        }
+        logger.info(f"[{self.camera_id}] Grabando clip {clip_id}")
+
+    def _finalize(self):
+        clip, self._clip = self._clip, None
+        if not clip or not clip['frames']:
+            return
+        self._writing_bytes += clip['bytes']
+        task = asyncio.create_task(self._write(clip))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, clip: Dict[str, Any]):
+        frames = clip['frames']
+        duration = frames[-1][0] - frames[0][0]
+        fps = (len(frames) - 1) / duration if duration > 0 else 1.0
+        path = self.index.clips_dir / self.camera_id / f"{clip['clip_id']}.avi"
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            width, height = await asyncio.to_thread(
+                write_mjpeg_avi, path, [jpeg for _, jpeg in frames], fps
+            )
+            await asyncio.to_thread(self.index.append, {
+                'clip_id': clip['clip_id'],
+                'camera_id': self.camera_id,
+                'file': str(path.relative_to(self.index.clips_dir)),
+                'start': frames[0][0],
+                'end': frames[-1][0],
+                'frames': len(frames),
+                'fps': round(fps, 3),
+                'width': width,
+                'height': height,
+                'bytes': clip['bytes'],
+                'triggers': clip['triggers'],
+                'created_at': time.time(),
+            })
+            self.stats["clips_written"] += 1
+            logger.info(f"[{self.camera_id}] Clip guardado: {path} ({len(frames)} frames)")
+        except Exception as e:
+            logger.error(f"[{self.camera_id}] Error guardando clip {clip['clip_id']}: {e}")
+        finally:
+            self._writing_bytes -= clip['bytes']
+
+    async def flush(self):
+        """Cierra el clip en curso y espera las escrituras pendientes"""
+        self._finalize()
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "buffer_frames": len(self._buffer),
+            "buffer_bytes": self._buffer_bytes,
+            "used_bytes": self.used_bytes,
+            "max_bytes": self.max_bytes,
+            "recording": self._clip['clip_id'] if self._clip is not None else None,
+            **self.stats,
+        }
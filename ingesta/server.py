@@ -1,25 +1,35 @@
 import asyncio
-import base64
+import os
+import time
 import cv2
 import numpy as np
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse
 from contextlib import asynccontextmanager
 from urllib.parse import urlparse
 import aiohttp
 import yaml
 from pathlib import Path
 import sys
+from typing import List, Dict, Any, Optional
 
 # Agregar utils al path
 sys.path.append('/app/utils')
 from logger import setup_logger
-from helpers import image_to_base64, base64_to_image
+from frames import Frame
+from transport import TRANSPORTS, encode_image_request, read_image_request
+from motion import MotionGate, merge_motion_config
+from pipeline import AdaptiveRateController, FrameQueue, LatencyWindow, merge_pipeline_config
+from recorder import DEFAULT_RECORDER_CONFIG, MAX_CLIP_LIST, ClipIndex, ClipRecorder
+from discovery import CaptureMethodCache, race_probes
+from stream_reader import (
+    LatestFrameReader, open_mjpeg_stream, parse_multipart_boundary, probe_opencv_stream
+)
 
 logger = setup_logger("ingesta")
 
 # Cargar configuración
-config_path = Path("/app/config/system_config.yaml")
+config_path = Path(os.getenv("CONFIG_DIR", "/app/config")) / "system_config.yaml"
 if config_path.exists():
     with open(config_path, 'r') as f:
         config = yaml.safe_load(f)
@@ -33,217 +43,611 @@ else:
     fps = 1
 
 # Override con variable de entorno si existe
-import os
 inference_url = os.getenv('INFERENCE_URL', inference_url)
+# Formato de envío de frames: binary (image/jpeg), multipart o json (base64, compatibilidad)
+transport = config.get('services', {}).get('transport', 'binary')
+if transport not in TRANSPORTS:
+    raise ValueError(f"Transporte desconocido: {transport}")
+
+reconnect_interval = config.get('esp32', {}).get('reconnect_interval', 5)
+# Peticiones simultáneas a inferencia, compartidas por todas las cámaras
+max_inflight = config.get('ingesta', {}).get('max_inflight', 4)
+# Compuerta de movimiento global (cada cámara puede sobrescribirla con `motion_gate`)
+motion_config = config.get('ingesta', {}).get('motion_gate', {})
+# Cola captura → inferencia y control adaptativo de fps (sobrescribible por cámara)
+pipeline_config = config.get('ingesta', {}).get('pipeline', {})
+# Buffer pre-alerta y grabación de clips de eventos
+recorder_config = {**DEFAULT_RECORDER_CONFIG, **config.get('ingesta', {}).get('recorder', {})}
+
+# Caché en disco del método de captura ganador por cámara (vacío = deshabilitada)
+discovery_config = config.get('ingesta', {}).get('discovery', {})
+probe_timeout = discovery_config.get('probe_timeout', 5)
+reprobe_after_failures = discovery_config.get('reprobe_after_failures', 3)
+capture_cache = CaptureMethodCache(discovery_config.get('cache_path', '/app/cache/capture_methods.json'))
+
+CAPTURE_METHODS = ('auto', 'mjpeg_http', 'snapshot', 'opencv')
+
+def load_camera_configs(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Normaliza la lista de cámaras; sin `cameras` se usa la cámara única de `esp32`"""
+    cameras = config.get('cameras') or [{'id': 'cam0', 'url': esp32_url}]
+    normalized = []
+    seen = set()
+    for index, cam in enumerate(cameras):
+        cam_id = str(cam.get('id', f"cam{index}"))
+        if cam_id in seen:
+            raise ValueError(f"ID de cámara duplicado: {cam_id}")
+        seen.add(cam_id)
+
+        method = cam.get('method', 'auto')
+        if method not in CAPTURE_METHODS:
+            raise ValueError(f"Método de captura desconocido para {cam_id}: {method}")
+
+        normalized.append({
+            'id': cam_id,
+            'url': cam.get('url') or cam.get('stream_url', esp32_url),
+            'fps': float(cam.get('fps', fps)),
+            'method': method,
+            'snapshot_url': cam.get('snapshot_url'),
+            'motion_gate': merge_motion_config(motion_config, cam.get('motion_gate')),
+            'pipeline': merge_pipeline_config(pipeline_config, cam.get('pipeline')),
+        })
+    return normalized
+
+camera_configs = load_camera_configs(config)
 
 class StreamProcessor:
-    def __init__(self):
-        self.cap = None
+    """Captura de una cámara y envío de sus frames a inferencia"""
+
+    def __init__(self, camera: Dict[str, Any], scheduler: 'CameraScheduler'):
+        self.camera_id = camera['id']
+        self.url = camera['url']
+        self.fps = camera['fps']
+        self.scheduler = scheduler
+        self.frame_reader = None  # hilo lector OpenCV con slot de último frame
         self.running = False
-        self.session = None
-        self.stream_method = None  # 'opencv', 'snapshot', o None
-        self.snapshot_url = None
+        self.stream_method = None  # 'mjpeg_http', 'opencv', 'snapshot', o None
+        self.snapshot_url = camera.get('snapshot_url')
+        self.mjpeg_frames = None  # generador de JPEGs sobre la conexión persistente
+        if camera['method'] != 'auto':
+            self.stream_method = camera['method']
+        self.method_from_cache = False
+        self.consecutive_failures = 0
+
+        self.motion_gate = None
+        if camera['motion_gate']['enabled']:
+            self.motion_gate = MotionGate.from_config(camera['motion_gate'])
+
+        self.recorder = None
+        if recorder_config['enabled']:
+            self.recorder = ClipRecorder(
+                self.camera_id,
+                scheduler.clip_index,
+                pre_seconds=float(recorder_config['pre_seconds']),
+                post_seconds=float(recorder_config['post_seconds']),
+                max_clip_seconds=float(recorder_config['max_clip_seconds']),
+                max_bytes=scheduler.recorder_bytes_per_camera
+            )
+
+        self.pipeline_config = camera['pipeline']
+        self.rate = AdaptiveRateController(
+            max_fps=self.fps,
+            min_fps=float(self.pipeline_config['min_fps']),
+            latency_target=float(self.pipeline_config['latency_target']),
+            adjust_interval=float(self.pipeline_config['adjust_interval']),
+            enabled=bool(self.pipeline_config['adaptive_fps'])
+        )
+        # Se crean en run(), dentro del event loop
+        self.queue = None
+        self.inflight = None
+        self.dispatch_task = None
+        self.pending = set()
+
+        self.state = "starting"
+        self.stats = {
+            "frames_captured": 0,
+            "frames_sent": 0,
+            "errors": 0,
+            "last_frame_at": None,
+        }
+        # Percentiles de latencia por etapa (ventana de los últimos 1000 frames)
+        self.latency = {
+            stage: LatencyWindow()
+            for stage in ("infer_request", "infer_queue", "infer_model", "capture_to_result")
+        }
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self.scheduler.session
 
     async def initialize(self):
-        self.session = aiohttp.ClientSession()
-        logger.info(f"Inicializando captura desde: {esp32_url}")
-        await self.detect_stream_method()
+        logger.info(f"[{self.camera_id}] Inicializando captura desde: {self.url}")
+        if self.stream_method is None:
+            self.state = "detecting"
+            await self.detect_stream_method()
+        elif self.stream_method == 'snapshot' and not self.snapshot_url:
+            self.snapshot_url = self.default_snapshot_url()
 
-    async def detect_stream_method(self):
-        """Detecta el método de captura disponible"""
-        # Método 1: Intentar endpoints de snapshot primero (más confiable)
+    def default_snapshot_url(self) -> str:
+        """URL de /capture deducida de la URL del stream"""
+        # Para ESP32-CAM común: /capture está en puerto 80, stream en puerto 81
+        parsed = urlparse(self.url)
+        if parsed.port == 81:
+            return f"{parsed.scheme}://{parsed.hostname}:80/capture"
+        return f"{parsed.scheme}://{parsed.hostname}/capture"
+
+    def snapshot_candidates(self) -> List[str]:
+        """URLs de snapshot a probar, sin duplicados y en orden de preferencia"""
         # Para ESP32-CAM común: /capture está en puerto 80, stream en puerto 81
-        parsed = urlparse(esp32_url)
+        parsed = urlparse(self.url)
         base_url_no_port = f"{parsed.scheme}://{parsed.hostname}"
         # Si la URL tiene puerto 81, intentar también puerto 80 para /capture
         if parsed.port == 81:
             base_url_port_80 = f"{parsed.scheme}://{parsed.hostname}:80"
         else:
             base_url_port_80 = base_url_no_port
-            
+
         snapshot_paths = [
             f"{base_url_port_80}/capture",  # ESP32-CAM común (puerto 80)
             f"{base_url_no_port}/capture",  # Sin especificar puerto
-            f"{esp32_url.rstrip('/stream').rstrip('/')}/capture",
-            f"{esp32_url.rstrip('/')}/snapshot",
-            f"{esp32_url.rstrip('/')}/jpg",
-            f"{esp32_url.rstrip('/')}/jpeg",
-            f"{esp32_url.rstrip('/')}/frame.jpg",
-            f"{esp32_url.rstrip('/')}/cam.jpg"
+            f"{self.url.rstrip('/stream').rstrip('/')}/capture",
+            f"{self.url.rstrip('/')}/snapshot",
+            f"{self.url.rstrip('/')}/jpg",
+            f"{self.url.rstrip('/')}/jpeg",
+            f"{self.url.rstrip('/')}/frame.jpg",
+            f"{self.url.rstrip('/')}/cam.jpg"
         ]
-        
-        logger.info("Intentando detectar método de captura...")
-        for snapshot_url in snapshot_paths:
-            try:
-                async with self.session.get(snapshot_url, timeout=aiohttp.ClientTimeout(total=5)) as resp:
-                    if resp.status == 200:
-                        content_type = resp.headers.get('Content-Type', '')
-                        if 'image' in content_type:
-                            self.stream_method = 'snapshot'
-                            self.snapshot_url = snapshot_url
-                            logger.info(f"Método detectado: Snapshot en {snapshot_url}")
-                            return
-            except Exception as e:
-                logger.debug(f"Snapshot {snapshot_url} no disponible: {e}")
-                continue
-        
-        # Método 2: Intentar OpenCV VideoCapture como fallback (puede fallar con URLs HTTP)
-        logger.warning("Método snapshot no disponible, intentando OpenCV VideoCapture...")
+        return list(dict.fromkeys(snapshot_paths))
+
+    async def _probe_mjpeg(self) -> bool:
         try:
-            # Para streams HTTP, OpenCV puede requerir backend específico
-            test_cap = cv2.VideoCapture(esp32_url, cv2.CAP_FFMPEG)
-            if test_cap.isOpened():
-                ret, frame = test_cap.read()
-                if ret and frame is not None:
-                    self.stream_method = 'opencv'
-                    test_cap.release()
-                    logger.info("Método detectado: OpenCV VideoCapture")
-                    return
-            test_cap.release()
+            async with self.session.get(self.url, timeout=aiohttp.ClientTimeout(total=probe_timeout)) as resp:
+                return resp.status == 200 and parse_multipart_boundary(resp.headers.get('Content-Type', '')) is not None
         except Exception as e:
-            logger.debug(f"OpenCV VideoCapture no disponible: {e}")
-        
-        # Si ambos métodos fallan, usar snapshot por defecto y dejar que el loop maneje los errores
-        logger.warning("No se pudo detectar método de captura automáticamente, usando snapshot por defecto")
-        self.stream_method = 'snapshot'
-        # Usar el primer endpoint como intento inicial
-        parsed = urlparse(esp32_url)
-        if parsed.port == 81:
-            self.snapshot_url = f"{parsed.scheme}://{parsed.hostname}:80/capture"
+            logger.debug(f"[{self.camera_id}] Stream MJPEG {self.url} no disponible: {e}")
+            return False
+
+    async def _probe_snapshot(self, snapshot_url: str) -> bool:
+        try:
+            async with self.session.get(snapshot_url, timeout=aiohttp.ClientTimeout(total=probe_timeout)) as resp:
+                return resp.status == 200 and 'image' in resp.headers.get('Content-Type', '')
+        except Exception as e:
+            logger.debug(f"[{self.camera_id}] Snapshot {snapshot_url} no disponible: {e}")
+            return False
+
+    async def detect_stream_method(self):
+        """Detecta el método de captura disponible (caché en disco o sondeo concurrente)"""
+        cached = capture_cache.get(self.camera_id, self.url)
+        if cached:
+            self.stream_method = cached['method']
+            self.snapshot_url = cached.get('snapshot_url') or self.snapshot_url
+            self.method_from_cache = True
+            logger.info(f"[{self.camera_id}] Método en caché: {self.stream_method}")
+            return
+        self.method_from_cache = False
+
+        # Métodos 0 y 1: stream MJPEG persistente y endpoints de snapshot, todos a la
+        # vez. Gana el primero que responda; el MJPEG tiene preferencia si llega
+        # poco después de un snapshot (evita el handshake por frame).
+        logger.info(f"[{self.camera_id}] Intentando detectar método de captura...")
+        started = time.monotonic()
+        probes = [('mjpeg_http', self._probe_mjpeg())]
+        probes += [(url, self._probe_snapshot(url)) for url in self.snapshot_candidates()]
+        winner = await race_probes(probes, preferred='mjpeg_http')
+
+        if winner == 'mjpeg_http':
+            self.stream_method = 'mjpeg_http'
+            logger.info(f"[{self.camera_id}] Método detectado: Stream MJPEG persistente en {self.url}")
+        elif winner is not None:
+            self.stream_method = 'snapshot'
+            self.snapshot_url = winner
+            logger.info(f"[{self.camera_id}] Método detectado: Snapshot en {winner}")
         else:
-            self.snapshot_url = f"{parsed.scheme}://{parsed.hostname}/capture"
+            # Método 2: Intentar OpenCV VideoCapture como fallback (puede fallar con URLs HTTP)
+            logger.warning(f"[{self.camera_id}] Método snapshot no disponible, intentando OpenCV VideoCapture...")
+            try:
+                # Para streams HTTP, OpenCV puede requerir backend específico.
+                # VideoCapture bloquea: se prueba en un hilo para no congelar el loop.
+                # Un host caído puede colgar a FFMPEG: no se espera más de 2x probe_timeout
+                if await asyncio.wait_for(
+                    asyncio.to_thread(probe_opencv_stream, self.url, cv2.CAP_FFMPEG),
+                    probe_timeout * 2
+                ):
+                    self.stream_method = 'opencv'
+                    logger.info(f"[{self.camera_id}] Método detectado: OpenCV VideoCapture")
+            except Exception as e:
+                logger.debug(f"[{self.camera_id}] OpenCV VideoCapture no disponible: {e!r}")
+
+        if self.stream_method is None:
+            # Si ambos métodos fallan, usar snapshot por defecto y dejar que el loop maneje los errores
+            logger.warning(f"[{self.camera_id}] No se pudo detectar método de captura automáticamente, usando snapshot por defecto")
+            self.stream_method = 'snapshot'
+            # Usar el primer endpoint como intento inicial
+            self.snapshot_url = self.default_snapshot_url()
+            return
+
+        logger.info(f"[{self.camera_id}] Detección completada en {time.monotonic() - started:.2f}s")
+        capture_cache.set(self.camera_id, self.url, self.stream_method, self.snapshot_url)
+
+    async def redetect_stream_method(self):
+        """Descarta el método cacheado que dejó de funcionar y vuelve a sondear"""
+        logger.warning(f"[{self.camera_id}] El método en caché ({self.stream_method}) falla, re-sondeando")
+        capture_cache.invalidate(self.camera_id)
+        await self.close_mjpeg()
+        await self.stop_frame_reader()
+        self.stream_method = None
+        self.consecutive_failures = 0
+        self.state = "detecting"
+        await self.detect_stream_method()
+        await self.start_stream()
+
+    def mark_failure(self):
+        """Registra un fallo de captura"""
+        self.state = "reconnecting"
+        self.consecutive_failures += 1
 
     async def start_stream(self):
         """Inicia la captura del stream"""
-        if self.stream_method == 'opencv':
+        if self.stream_method == 'mjpeg_http':
+            self.mjpeg_frames = open_mjpeg_stream(self.session, self.url)
+            logger.info(f"[{self.camera_id}] Stream MJPEG listo (URL: {self.url})")
+        elif self.stream_method == 'opencv':
             try:
-                self.cap = cv2.VideoCapture(esp32_url, cv2.CAP_FFMPEG)
-                if not self.cap.isOpened():
+                self.frame_reader = LatestFrameReader(
+                    self.url, cv2.CAP_FFMPEG, reconnect_interval, name=self.camera_id
+                )
+                self.frame_reader.start()
+                if not await self.frame_reader.wait_opened(timeout=10):
                     # Si OpenCV falla, cambiar a snapshot
-                    logger.warning("OpenCV falló, cambiando a método snapshot")
+                    logger.warning(f"[{self.camera_id}] OpenCV falló, cambiando a método snapshot")
+                    await self.stop_frame_reader()
                     self.stream_method = 'snapshot'
-                    parsed = urlparse(esp32_url)
-                    if parsed.port == 81:
-                        self.snapshot_url = f"{parsed.scheme}://{parsed.hostname}:80/capture"
-                    else:
-                        self.snapshot_url = f"{parsed.scheme}://{parsed.hostname}/capture"
+                    self.snapshot_url = self.default_snapshot_url()
                 else:
-                    self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-                    logger.info("Stream OpenCV iniciado correctamente")
+                    logger.info(f"[{self.camera_id}] Stream OpenCV iniciado correctamente")
             except Exception as e:
-                logger.warning(f"Error al iniciar stream OpenCV: {e}, cambiando a snapshot")
+                logger.warning(f"[{self.camera_id}] Error al iniciar stream OpenCV: {e}, cambiando a snapshot")
                 # Cambiar a snapshot si OpenCV falla
                 self.stream_method = 'snapshot'
-                parsed = urlparse(esp32_url)
-                if parsed.port == 81:
-                    self.snapshot_url = f"{parsed.scheme}://{parsed.hostname}:80/capture"
-                else:
-                    self.snapshot_url = f"{parsed.scheme}://{parsed.hostname}/capture"
-        
+                self.snapshot_url = self.default_snapshot_url()
+
         if self.stream_method == 'snapshot':
-            logger.info(f"Método snapshot listo (URL: {self.snapshot_url})")
-        elif self.stream_method != 'opencv':
+            logger.info(f"[{self.camera_id}] Método snapshot listo (URL: {self.snapshot_url})")
+        elif self.stream_method not in ('opencv', 'mjpeg_http'):
             raise Exception(f"Método de stream desconocido: {self.stream_method}")
-        
+
         self.running = True
+        self.state = "streaming"
 
-    async def process_frame(self, frame):
+    async def process_frame(self, frame: Frame):
         """Procesa un frame y lo envía a inferencia"""
         try:
-            # Convertir frame a base64
-            frame_b64 = image_to_base64(frame)
-            
-            # Enviar a servicio de inferencia
-            async with self.session.post(
-                inference_url,
-                json={"image": frame_b64},
-                timeout=aiohttp.ClientTimeout(total=5)
-            ) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    logger.debug(f"Frame procesado: {result.get('detections', 0)} detecciones")
-                    return result
-                else:
-                    logger.warning(f"Error en inferencia: {response.status}")
-                    return None
+            # Reenviar los bytes JPEG originales (no se recomprime ni se pasa a base64)
+            metadata = {"camera_id": self.camera_id, "timestamp": frame.timestamp}
+            if self.recorder is not None:
+                # ID con el que fusion podrá referenciar el clip si hay alerta
+                metadata["clip_id"] = self.recorder.clip_id_for(frame.timestamp)
+            request_kwargs = encode_image_request(frame.jpeg, metadata, transport)
+
+            # Enviar a servicio de inferencia (turno compartido entre cámaras)
+            async with self.scheduler.inference_slots:
+                started = time.monotonic()
+                async with self.session.post(
+                    inference_url,
+                    timeout=aiohttp.ClientTimeout(total=5),
+                    **request_kwargs
+                ) as response:
+                    if response.status == 200:
+                        result = await response.json()
+                        elapsed = time.monotonic() - started
+                        self.rate.record(elapsed, ok=True)
+                        self.record_latencies(frame, elapsed, result)
+                        self.stats["frames_sent"] += 1
+                        if self.recorder is not None and result.get("count", 0) > 0:
+                            self.recorder.trigger(frame.timestamp, metadata["clip_id"])
+                        logger.debug(f"[{self.camera_id}] Frame procesado: {result.get('detections', 0)} detecciones")
+                        return result
+                    else:
+                        self.rate.record(time.monotonic() - started, ok=False)
+                        self.stats["errors"] += 1
+                        logger.warning(f"[{self.camera_id}] Error en inferencia: {response.status}")
+                        return None
         except Exception as e:
-            logger.error(f"Error procesando frame: {e}")
+            self.rate.record(0.0, ok=False)
+            self.stats["errors"] += 1
+            logger.error(f"[{self.camera_id}] Error procesando frame: {e}")
             return None
 
+    def record_latencies(self, frame: Frame, elapsed: float, result: Dict[str, Any]):
+        """Latencias por etapa: petición a inferencia, cola/modelo (según inferencia) y captura→resultado"""
+        self.latency["infer_request"].record(elapsed)
+        self.latency["capture_to_result"].record(max(0.0, time.time() - frame.timestamp))
+        batch = result.get("batch")
+        if batch:
+            self.latency["infer_queue"].record(batch.get("queue_wait_ms", 0) / 1000)
+            self.latency["infer_model"].record(batch.get("inference_ms", 0) / 1000)
+
+    def record_frame(self, frame: Frame):
+        """Todo frame recibido entra al buffer pre-alerta, antes del límite de fps y la compuerta"""
+        if self.recorder is not None:
+            self.recorder.add_frame(frame)
+
+    def handle_frame(self, frame: Frame):
+        """Registra un frame capturado y lo encola para inferencia si pasa la compuerta"""
+        self.stats["frames_captured"] += 1
+        self.stats["last_frame_at"] = frame.timestamp
+        self.consecutive_failures = 0
+        self.state = "streaming"
+        if self.motion_gate is not None:
+            # La compuerta solo necesita una copia pequeña en grises: decodificación reducida
+            thumbnail = frame.gray_thumbnail(self.motion_gate.width)
+            if not self.motion_gate.should_process(thumbnail, now=frame.timestamp):
+                return
+        if self.queue.put(frame):
+            self.rate.record_drop()
+
+    async def dispatch_loop(self):
+        """Envía frames de la cola a inferencia con una ventana acotada de peticiones en vuelo"""
+        while self.running:
+            # Esperar turno antes de sacar el frame: así siempre se envía el más reciente
+            await self.inflight.acquire()
+            try:
+                frame = await self.queue.get()
+            except BaseException:
+                self.inflight.release()
+                raise
+            task = asyncio.create_task(self._dispatch(frame))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def _dispatch(self, frame: Frame):
+        try:
+            await self.process_frame(frame)
+        finally:
+            self.inflight.release()
+
     async def run(self):
-        """Loop principal de procesamiento"""
+        """Loop principal de captura (la inferencia corre en dispatch_loop)"""
+        self.queue = FrameQueue(int(self.pipeline_config['queue_size']))
+        self.inflight = asyncio.Semaphore(int(self.pipeline_config['inflight_per_camera']))
+
         await self.initialize()
         await self.start_stream()
-        
-        reconnect_interval = config.get('esp32', {}).get('reconnect_interval', 5)
-        frame_interval = 1.0 / fps
-        
+        self.dispatch_task = asyncio.create_task(self.dispatch_loop())
+
+        loop = asyncio.get_running_loop()
+        next_frame_at = 0.0
+
         while self.running:
             try:
-                # Intentar reconectar si es necesario (solo para OpenCV)
-                if self.stream_method == 'opencv' and (self.cap is None or not self.cap.isOpened()):
-                    logger.info(f"Intentando reconectar al stream: {esp32_url}")
+                # Un método cacheado que falla repetidamente se vuelve a sondear
+                if self.method_from_cache and self.consecutive_failures >= reprobe_after_failures:
+                    await self.redetect_stream_method()
+                    continue
+
+                # Intentar reconectar si es necesario (OpenCV y MJPEG persistente)
+                if self.stream_method == 'opencv' and (self.frame_reader is None or not self.frame_reader.alive):
+                    logger.info(f"[{self.camera_id}] Intentando reconectar al stream: {self.url}")
                     await self.start_stream()
-                
+                elif self.stream_method == 'mjpeg_http' and self.mjpeg_frames is None:
+                    logger.info(f"[{self.camera_id}] Intentando reconectar al stream: {self.url}")
+                    await self.start_stream()
+
                 # Leer frame según el método detectado
                 frame = None
-                if self.stream_method == 'opencv':
-                    ret, frame = self.cap.read()
-                    if not ret or frame is None:
-                        logger.warning("No se pudo leer frame OpenCV, reintentando conexión...")
-                        if self.cap:
-                            self.cap.release()
-                            self.cap = None
+                if self.stream_method == 'mjpeg_http':
+                    # El ESP32 empuja frames a su propio ritmo: se consumen todos para
+                    # no acumular buffer en el socket y todos van al grabador (sin
+                    # decodificar), pero solo uno cada frame_interval va a inferencia.
+                    try:
+                        jpeg = await self.mjpeg_frames.__anext__()
+                    except StopAsyncIteration:
+                        jpeg = None
+                    except Exception as e:
+                        logger.error(f"[{self.camera_id}] Error leyendo stream MJPEG: {e}")
+                        jpeg = None
+                    if jpeg is None:
+                        logger.warning(f"[{self.camera_id}] Stream MJPEG cerrado, reintentando conexión...")
+                        self.mark_failure()
+                        await self.close_mjpeg()
                         await asyncio.sleep(reconnect_interval)
                         continue
+                    frame = Frame(jpeg=jpeg)
+                    self.record_frame(frame)
+                    if loop.time() < next_frame_at:
+                        continue
+                    next_frame_at = loop.time() + self.rate.interval
+                    self.handle_frame(frame)
+                    continue
+                elif self.stream_method == 'opencv':
+                    # El hilo lector reconecta por su cuenta; aquí solo se toma el último frame
+                    image = await self.frame_reader.next_frame(timeout=reconnect_interval)
+                    if image is None:
+                        logger.warning(f"[{self.camera_id}] Sin frames OpenCV, esperando reconexión...")
+                        self.mark_failure()
+                        continue
+                    frame = Frame(image=image)
+                    self.state = "streaming"
                 elif self.stream_method == 'snapshot':
                     try:
                         async with self.session.get(self.snapshot_url, timeout=aiohttp.ClientTimeout(total=5)) as resp:
                             if resp.status == 200:
-                                img_data = await resp.read()
-                                from PIL import Image
-                                from io import BytesIO
-                                img = Image.open(BytesIO(img_data))
-                                frame = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+                                frame = Frame(jpeg=await resp.read())
+                                self.state = "streaming"
                             else:
-                                logger.warning(f"Error obteniendo snapshot: {resp.status}")
+                                logger.warning(f"[{self.camera_id}] Error obteniendo snapshot: {resp.status}")
+                                self.mark_failure()
                                 await asyncio.sleep(reconnect_interval)
                                 continue
                     except Exception as e:
-                        logger.error(f"Error leyendo snapshot: {e}")
+                        logger.error(f"[{self.camera_id}] Error leyendo snapshot: {e}")
+                        self.mark_failure()
                         await asyncio.sleep(reconnect_interval)
                         continue
-                
+
                 if frame is not None:
-                    await self.process_frame(frame)
-                await asyncio.sleep(frame_interval)
-                
+                    self.record_frame(frame)
+                    self.handle_frame(frame)
+                # Mantener la cadencia descontando el tiempo de captura
+                next_frame_at = max(next_frame_at + self.rate.interval, loop.time())
+                await asyncio.sleep(next_frame_at - loop.time())
+
             except Exception as e:
-                logger.error(f"Error en loop principal: {e}")
-                if self.cap:
-                    self.cap.release()
-                    self.cap = None
+                logger.error(f"[{self.camera_id}] Error en loop principal: {e}")
+                self.stats["errors"] += 1
+                self.mark_failure()
+                await self.stop_frame_reader()
+                await self.close_mjpeg()
                 await asyncio.sleep(reconnect_interval)
 
+    async def close_mjpeg(self):
+        """Cierra la conexión MJPEG persistente"""
+        if self.mjpeg_frames is not None:
+            try:
+                await self.mjpeg_frames.aclose()
+            except Exception as e:
+                logger.debug(f"[{self.camera_id}] Error cerrando stream MJPEG: {e}")
+            self.mjpeg_frames = None
+
+    async def stop_frame_reader(self):
+        """Detiene el hilo lector de OpenCV"""
+        if self.frame_reader is not None:
+            await self.frame_reader.stop()
+            self.frame_reader = None
+
     async def stop(self):
         """Detiene el procesamiento"""
         self.running = False
-        if self.cap:
-            self.cap.release()
+        self.state = "stopped"
+        tasks = list(self.pending) + ([self.dispatch_task] if self.dispatch_task else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.dispatch_task = None
+        if self.recorder is not None:
+            await self.recorder.flush()
+        await self.close_mjpeg()
+        await self.stop_frame_reader()
+        logger.info(f"[{self.camera_id}] Stream detenido")
+
+    def status(self) -> Dict[str, Any]:
+        """Estado de la cámara para /status"""
+        return {
+            "camera_id": self.camera_id,
+            "state": self.state,
+            "stream_url": self.url,
+            "stream_method": self.stream_method,
+            "method_from_cache": self.method_from_cache,
+            "fps": self.fps,
+            **self.rate.stats(),
+            "inflight": len(self.pending),
+            "queued": len(self.queue) if self.queue is not None else 0,
+            "frames_dropped": self.queue.dropped if self.queue is not None else 0,
+            **self.stats,
+            **({"frames_dropped_by_reader": self.frame_reader.frames_dropped}
+               if self.frame_reader is not None else {}),
+            "latency": {stage: window.percentiles() for stage, window in self.latency.items()},
+            "motion_gate": self.motion_gate.stats if self.motion_gate is not None else None,
+            "recorder": self.recorder.status() if self.recorder is not None else None
+        }
+
+class CameraScheduler:
+    """Ejecuta todas las cámaras como tareas concurrentes en un solo proceso
+
+    Comparte un pool de conexiones HTTP y reparte los turnos de inferencia con
+    un semáforo (FIFO), de modo que ninguna cámara acapara el servicio.
+    """
+
+    def __init__(self, cameras: List[Dict[str, Any]], max_inflight: int = 4):
+        self.session = None
+        self.inference_slots = None  # se crea en start(), dentro del event loop
+        self.max_inflight = max_inflight
+        self.clip_index = ClipIndex(
+            Path(recorder_config['clips_dir']),
+            max_clips=int(recorder_config['retention_max_clips']),
+            max_bytes=int(float(recorder_config['retention_max_mb']) * 1024 * 1024),
+            max_age=float(recorder_config['retention_days']) * 86400
+        )
+        # Presupuesto duro de memoria de grabación (buffer pre-alerta + clips), repartido entre cámaras
+        self.recorder_bytes_per_camera = int(
+            float(recorder_config['buffer_budget_mb']) * 1024 * 1024 / max(1, len(cameras))
+        )
+        self.processors = {cam['id']: StreamProcessor(cam, self) for cam in cameras}
+        self.tasks = []
+        self.expire_task = None
+
+    async def _expire_clips(self):
+        """Cierra clips vencidos de cámaras que dejaron de enviar frames (o de disparar)"""
+        interval = float(recorder_config['expire_interval'])
+        while True:
+            await asyncio.sleep(interval)
+            now = time.time()
+            for processor in self.processors.values():
+                if processor.recorder is not None:
+                    processor.recorder.expire(now)
+
+    @property
+    def running(self) -> bool:
+        return any(p.running for p in self.processors.values())
+
+    def get(self, camera_id: Optional[str] = None) -> Optional[StreamProcessor]:
+        """Procesador de una cámara (la primera si no se indica)"""
+        if camera_id is None:
+            return next(iter(self.processors.values()), None)
+        return self.processors.get(camera_id)
+
+    async def _run_camera(self, processor: StreamProcessor, delay: float):
+        # Escalonar arranques para no sondear todas las cámaras a la vez
+        await asyncio.sleep(delay)
+        await processor.run()
+
+    async def start(self):
+        """Crea la sesión compartida y lanza una tarea por cámara"""
+        # Cada stream MJPEG mantiene una conexión abierta; sumar las de inferencia
+        connector = aiohttp.TCPConnector(limit=len(self.processors) * 2 + self.max_inflight)
+        self.session = aiohttp.ClientSession(connector=connector)
+        self.inference_slots = asyncio.Semaphore(self.max_inflight)
+        logger.info(f"Iniciando {len(self.processors)} cámara(s)")
+        for index, processor in enumerate(self.processors.values()):
+            task = asyncio.create_task(self._run_camera(processor, min(index * 0.1, 5.0)))
+            self.tasks.append(task)
+        if recorder_config['enabled']:
+            self.expire_task = asyncio.create_task(self._expire_clips())
+
+    async def stop(self):
+        """Detiene todas las cámaras y cierra la sesión compartida"""
+        if self.expire_task is not None:
+            self.expire_task.cancel()
+            await asyncio.gather(self.expire_task, return_exceptions=True)
+            self.expire_task = None
+        for processor in self.processors.values():
+            await processor.stop()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
         if self.session:
             await self.session.close()
-        logger.info("Stream detenido")
 
-processor = StreamProcessor()
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "inference_url": inference_url,
+            "transport": transport,
+            "max_inflight": self.max_inflight,
+            "clips": self.clip_index.status(),
+            "cameras": [p.status() for p in self.processors.values()]
+        }
+
+scheduler = CameraScheduler(camera_configs, max_inflight=max_inflight)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Maneja el ciclo de vida de la aplicación"""
     # Startup
-    asyncio.create_task(processor.run())
+    await scheduler.start()
     yield
     # Shutdown
-    await processor.stop()
+    await scheduler.stop()
 
 app = FastAPI(
     title="Ingesta Service",
@@ -258,31 +662,58 @@ async def health():
 
 @app.get("/status")
 async def status():
-    """Estado del servicio"""
-    return {
-        "running": processor.running,
-        "stream_url": esp32_url,
-        "inference_url": inference_url,
-        "fps": fps
-    }
+    """Estado del servicio y de cada cámara"""
+    return scheduler.status()
 
 @app.post("/frame")
-async def process_single_frame(frame_data: dict):
-    """Endpoint para procesar un frame individual"""
+async def process_single_frame(request: Request):
+    """Endpoint para procesar un frame individual (image/jpeg, multipart o JSON base64)"""
     try:
-        image_b64 = frame_data.get("image")
-        if not image_b64:
+        try:
+            jpeg, metadata = await read_image_request(request)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Petición inválida: {e}")
+        if not jpeg:
             raise HTTPException(status_code=400, detail="No se proporcionó imagen")
-        
-        frame = base64_to_image(image_b64)
+
+        processor = scheduler.get(metadata.get("camera_id"))
+        if processor is None:
+            raise HTTPException(status_code=404, detail="Cámara desconocida")
+
+        if jpeg.startswith(b"\xff\xd8"):
+            frame = Frame(jpeg=jpeg)
+        else:
+            # Compatibilidad: otros formatos que OpenCV lee (PNG, BMP...) se recodifican a JPEG
+            image = await asyncio.to_thread(cv2.imdecode, np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise HTTPException(status_code=400, detail="No se pudo decodificar la imagen")
+            frame = Frame(image=image)
         result = await processor.process_frame(frame)
-        
+
         return JSONResponse(content=result or {"status": "error"})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error en /frame: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/clips")
+async def list_clips(camera_id: Optional[str] = None, limit: int = Query(100, ge=1, le=MAX_CLIP_LIST)):
+    """Índice de clips grabados"""
+    clips = scheduler.clip_index.list(camera_id, limit)
+    return {"clips": clips, "count": len(clips)}
+
+@app.get("/clips/{clip_id}")
+async def get_clip(clip_id: str):
+    """Descarga un clip por su ID o por el clip_id de la alerta que lo disparó"""
+    entry = scheduler.clip_index.find(clip_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Clip no encontrado")
+    path = scheduler.clip_index.clips_dir / entry['file']
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Archivo de clip no encontrado")
+    return FileResponse(path, media_type="video/x-msvideo", filename=path.name)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
-
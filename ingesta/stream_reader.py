@@ -1,145 +1,246 @@
 """
-Lector de stream flexible para ESP32
-Soporta MJPEG stream y captura de frames individuales
+Lectura de streams de ESP32
+Parser MJPEG multipart sobre una conexión persistente y lector OpenCV en un hilo
 """
 import cv2
 import numpy as np
 import aiohttp
 import asyncio
-from io import BytesIO
-from PIL import Image
 import logging
+import threading
+import time
+from typing import AsyncIterator, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
-class StreamReader:
-    """Lector de stream que soporta múltiples métodos"""
-    
-    def __init__(self, url: str, stream_type: str = "auto"):
+# Límite de seguridad para una parte del multipart (un JPEG UXGA ronda 200-400 KB)
+MAX_MJPEG_FRAME_SIZE = 4 * 1024 * 1024
+MAX_MJPEG_HEADER_SIZE = 8 * 1024
+
+
+def parse_multipart_boundary(content_type: str) -> Optional[str]:
+    """Extrae el boundary de un Content-Type multipart/x-mixed-replace"""
+    if 'multipart' not in content_type.lower():
+        return None
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.strip().lower() == 'boundary' and value:
+            return value.strip().strip('"')
+    return None
+
+
+class MJPEGParser:
+    """Parser incremental de cuerpos multipart/x-mixed-replace
+
+    Recibe bytes en trozos arbitrarios (tal como llegan del socket) y devuelve
+    los JPEG completos. Si la parte trae Content-Length (el firmware lo envía
+    en `_STREAM_PART`) se lee exactamente esa cantidad; si no, se busca el
+    siguiente delimitador.
+    """
+
+    def __init__(self, boundary: str, max_frame_size: int = MAX_MJPEG_FRAME_SIZE):
+        self.delimiter = b"--" + boundary.encode('latin-1')
+        self.body_delimiter = b"\r\n" + self.delimiter
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._expected = None  # bytes restantes del cuerpo actual (None = leyendo cabeceras)
+        self._in_body = False
+        self.closed = False
+
+    def _parse_headers(self) -> bool:
+        """Consume delimitadores y cabeceras; True si quedó listo para leer un cuerpo"""
+        buf = self._buffer
+        while True:
+            # Saltar CRLF sueltos entre partes
+            while buf[:2] == b"\r\n":
+                del buf[:2]
+            if buf.startswith(self.delimiter):
+                end = buf.find(b"\r\n")
+                if end < 0:
+                    return False
+                if buf[len(self.delimiter):end].strip() == b"--":
+                    self.closed = True
+                    return False
+                del buf[:end + 2]
+                continue
+            break
+
+        end = buf.find(b"\r\n\r\n")
+        if end < 0:
+            if len(buf) > MAX_MJPEG_HEADER_SIZE:
+                raise ValueError("Cabeceras multipart demasiado grandes")
+            return False
+
+        length = None
+        for line in bytes(buf[:end]).split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                length = int(value.strip())
+        del buf[:end + 4]
+
+        if length is not None and length > self.max_frame_size:
+            raise ValueError(f"Frame MJPEG demasiado grande: {length} bytes")
+        self._expected = length
+        self._in_body = True
+        return True
+
+    def feed(self, data: bytes) -> List[bytes]:
+        """Agrega bytes al buffer y retorna los frames JPEG completos"""
+        self._buffer += data
+        frames = []
+        buf = self._buffer
+        while not self.closed:
+            if not self._in_body and not self._parse_headers():
+                break
+
+            if self._expected is not None:
+                if len(buf) < self._expected:
+                    break
+                frames.append(bytes(buf[:self._expected]))
+                del buf[:self._expected]
+            else:
+                end = buf.find(self.body_delimiter)
+                if end < 0:
+                    if len(buf) > self.max_frame_size:
+                        raise ValueError("Frame MJPEG sin delimitador dentro del límite")
+                    break
+                frames.append(bytes(buf[:end]))
+                del buf[:end]
+            self._in_body = False
+            self._expected = None
+        return frames
+
+
+async def open_mjpeg_stream(session: aiohttp.ClientSession, url: str,
+                            read_timeout: float = 10) -> AsyncIterator[bytes]:
+    """Abre una conexión persistente al stream MJPEG y genera JPEGs (bytes)
+
+    Se mantiene una sola conexión HTTP durante toda la vida del generador; el
+    cierre del generador (aclose) libera la conexión.
+    """
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=read_timeout)
+    async with session.get(url, timeout=timeout) as resp:
+        if resp.status != 200:
+            raise ConnectionError(f"Stream MJPEG respondió {resp.status}")
+        content_type = resp.headers.get('Content-Type', '')
+        boundary = parse_multipart_boundary(content_type)
+        if boundary is None:
+            raise ConnectionError(f"Content-Type no es multipart: {content_type}")
+
+        parser = MJPEGParser(boundary)
+        async for chunk in resp.content.iter_any():
+            for jpeg in parser.feed(chunk):
+                yield jpeg
+            if parser.closed:
+                break
+
+def probe_opencv_stream(url: str, api_preference: int = cv2.CAP_ANY) -> bool:
+    """Abre el stream con OpenCV y lee un frame (bloqueante: usar con asyncio.to_thread)"""
+    cap = cv2.VideoCapture(url, api_preference)
+    try:
+        if not cap.isOpened():
+            return False
+        ret, frame = cap.read()
+        return bool(ret and frame is not None)
+    finally:
+        cap.release()
+
+
+class LatestFrameReader:
+    """Lee un stream OpenCV en un hilo propio y publica solo el frame más reciente
+
+    `cv2.VideoCapture.read()` bloquea y el buffer de FFMPEG se retrasa si no se
+    consume a la velocidad de la cámara. El hilo decodifica continuamente y deja
+    el último frame en un único slot (los anteriores se descartan); el loop de
+    asyncio solo toma ese frame, sin bloquear.
+    """
+
+    def __init__(self, url: str, api_preference: int = cv2.CAP_ANY,
+                 reconnect_interval: float = 5, name: str = "opencv"):
         self.url = url
-        self.stream_type = stream_type
-        self.cap = None
-        self.session = None
-        
-    async def initialize(self):
-        """Inicializa la sesión HTTP"""
-        self.session = aiohttp.ClientSession()
-        
-    async def detect_stream_type(self):
-        """Detecta automáticamente el tipo de stream"""
-        if self.stream_type != "auto":
-            return self.stream_type
-            
-        # Probar si es un stream MJPEG
-        try:
-            self.cap = cv2.VideoCapture(self.url)
-            if self.cap.isOpened():
-                ret, frame = self.cap.read()
-                if ret and frame is not None:
-                    logger.info("Stream detectado como MJPEG (OpenCV)")
-                    return "mjpeg_opencv"
-                self.cap.release()
-                self.cap = None
-        except:
-            pass
-        
-        # Probar si hay un endpoint de snapshot
-        snapshot_urls = [
-            f"{self.url}/snapshot",
-            f"{self.url}/capture",
-            f"{self.url}/jpg",
-            f"{self.url}/jpeg",
-            f"{self.url}/frame.jpg",
-        ]
-        
-        for snapshot_url in snapshot_urls:
-            try:
-                async with self.session.get(snapshot_url, timeout=aiohttp.ClientTimeout(total=2)) as resp:
-                    if resp.status == 200:
-                        content_type = resp.headers.get('Content-Type', '')
-                        if 'image' in content_type:
-                            logger.info(f"Stream detectado como snapshot: {snapshot_url}")
-                            return "snapshot"
-            except:
+        self.api_preference = api_preference
+        self.reconnect_interval = reconnect_interval
+        self.name = name
+        # (seq, timestamp, frame); se reemplaza como tupla completa, así que el
+        # lector nunca ve un estado a medio escribir
+        self._slot = (0, 0.0, None)
+        self._consumed_seq = 0
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self.opened = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._loop = None
+        self._new_frame = None
+
+    def start(self):
+        """Lanza el hilo lector (llamar desde el event loop)"""
+        self._loop = asyncio.get_running_loop()
+        self._new_frame = asyncio.Event()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"reader-{self.name}", daemon=True)
+        self._thread.start()
+
+    def _publish(self, frame: np.ndarray):
+        """Reemplaza el slot; un frame que nadie consumió cuenta como descartado"""
+        seq, _, previous = self._slot
+        if previous is not None and seq > self._consumed_seq:
+            self.frames_dropped += 1
+        self._slot = (seq + 1, time.time(), frame)
+        self.frames_read += 1
+        self._loop.call_soon_threadsafe(self._new_frame.set)
+
+    def _run(self):
+        while not self._stop.is_set():
+            cap = cv2.VideoCapture(self.url, self.api_preference)
+            if not cap.isOpened():
+                cap.release()
+                logger.warning(f"[{self.name}] No se pudo abrir {self.url}, reintentando...")
+                self._stop.wait(self.reconnect_interval)
                 continue
-        
-        # Probar stream MJPEG manual
-        try:
-            async with self.session.get(self.url, timeout=aiohttp.ClientTimeout(total=2)) as resp:
-                if resp.status == 200:
-                    content_type = resp.headers.get('Content-Type', '')
-                    if 'multipart' in content_type or 'mjpeg' in content_type.lower():
-                        logger.info("Stream detectado como MJPEG (HTTP)")
-                        return "mjpeg_http"
-        except:
-            pass
-        
-        return None
-    
-    async def read_frame_mjpeg_opencv(self):
-        """Lee un frame usando OpenCV VideoCapture"""
-        if self.cap is None or not self.cap.isOpened():
-            self.cap = cv2.VideoCapture(self.url)
-            if not self.cap.isOpened():
-                return None
-            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-        
-        ret, frame = self.cap.read()
-        if ret and frame is not None:
-            return frame
-        return None
-    
-    async def read_frame_snapshot(self, snapshot_url: str = None):
-        """Lee un frame desde un endpoint de snapshot"""
-        if snapshot_url is None:
-            # Intentar diferentes rutas
-            for path in ["/snapshot", "/capture", "/jpg", "/jpeg", "/frame.jpg"]:
-                snapshot_url = f"{self.url}{path}"
-                try:
-                    async with self.session.get(snapshot_url, timeout=aiohttp.ClientTimeout(total=5)) as resp:
-                        if resp.status == 200:
-                            img_data = await resp.read()
-                            img = Image.open(BytesIO(img_data))
-                            frame = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-                            return frame
-                except:
-                    continue
-        else:
+
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            self.opened.set()
+            while not self._stop.is_set():
+                ret, frame = cap.read()
+                if not ret or frame is None:
+                    logger.warning(f"[{self.name}] Lectura OpenCV fallida, reconectando...")
+                    break
+                self._publish(frame)
+            cap.release()
+            self.opened.clear()
+            if not self._stop.is_set():
+                self._stop.wait(self.reconnect_interval)
+
+    async def wait_opened(self, timeout: float) -> bool:
+        """Espera (sin bloquear el loop) a que el stream quede abierto"""
+        return await asyncio.to_thread(self.opened.wait, timeout)
+
+    def latest(self) -> Tuple[int, float, Optional[np.ndarray]]:
+        """Retorna (seq, timestamp, frame) del slot sin esperar"""
+        return self._slot
+
+    async def next_frame(self, timeout: Optional[float] = None) -> Optional[np.ndarray]:
+        """Espera un frame más nuevo que el último entregado; None si vence el timeout"""
+        while True:
+            seq, _, frame = self._slot
+            if frame is not None and seq > self._consumed_seq:
+                self._consumed_seq = seq
+                return frame
+            self._new_frame.clear()
             try:
-                async with self.session.get(snapshot_url, timeout=aiohttp.ClientTimeout(total=5)) as resp:
-                    if resp.status == 200:
-                        img_data = await resp.read()
-                        img = Image.open(BytesIO(img_data))
-                        frame = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-                        return frame
-            except Exception as e:
-                logger.error(f"Error leyendo snapshot: {e}")
-        
-        return None
-    
-    async def read_frame(self):
-        """Lee un frame usando el método detectado"""
-        if not hasattr(self, '_stream_type'):
-            self._stream_type = await self.detect_stream_type()
-            if self._stream_type is None:
-                raise Exception(f"No se pudo detectar el tipo de stream para: {self.url}")
-        
-        if self._stream_type == "mjpeg_opencv":
-            return await self.read_frame_mjpeg_opencv()
-        elif self._stream_type == "snapshot":
-            return await self.read_frame_snapshot()
-        elif self._stream_type == "mjpeg_http":
-            # Implementar parsing de MJPEG HTTP si es necesario
-            return await self.read_frame_snapshot()  # Fallback a snapshot
-        
-        return None
-    
-    async def close(self):
-        """Cierra los recursos"""
-        if self.cap:
-            self.cap.release()
-            self.cap = None
-        if self.session:
-            await self.session.close()
-            self.session = None
+                await asyncio.wait_for(self._new_frame.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+    @property
+    def alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    async def stop(self):
+        """Detiene el hilo y libera la captura"""
+        self._stop.set()
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join, self.reconnect_interval + 5)
+            self._thread = None
 
@@ -0,0 +1,122 @@
+import asyncio
+import time
+
+import cv2
+import numpy as np
+
+from frames import Frame
+from recorder import ClipIndex, ClipRecorder
+
+JPEG = cv2.imencode('.jpg', np.zeros((48, 64, 3), np.uint8))[1].tobytes()
+
+
+def make_recorder(tmp_path, frames_budget=100, **kwargs):
+    options = {'pre_seconds': 2, 'post_seconds': 1, 'max_clip_seconds': 60, **kwargs}
+    return ClipRecorder('a', ClipIndex(tmp_path), max_bytes=len(JPEG) * frames_budget, **options)
+
+
+def feed(recorder, start, count, step=0.1):
+    for i in range(count):
+        recorder.add_frame(Frame(jpeg=JPEG, timestamp=start + i * step))
+
+
+def test_clip_is_written_when_frames_stop(tmp_path):
+    async def run():
+        recorder = make_recorder(tmp_path)
+        feed(recorder, 100, 30)                 # 100.0 .. 102.9
+        recorder.trigger(102.9, 'c1')
+        feed(recorder, 103.0, 5)                # la cámara se detiene en 103.4
+        recorder.expire(now=103.5)              # aún dentro de post_seconds
+        assert recorder.status()["recording"] == 'c1'
+        recorder.expire(now=104.0)
+        await recorder.flush()
+        return recorder
+
+    recorder = asyncio.run(run())
+    entry = recorder.index.find('c1')
+    assert entry is not None
+    assert entry['frames'] == 21 + 5           # 2 s pre-alerta + los posteriores
+    assert (tmp_path / entry['file']).stat().st_size > entry['bytes']
+    assert recorder.status()["used_bytes"] == 0
+
+
+def test_clip_closes_at_max_duration_without_frames(tmp_path):
+    async def run():
+        recorder = make_recorder(tmp_path, max_clip_seconds=5, post_seconds=100)
+        feed(recorder, 0, 3)
+        recorder.trigger(0.2, 'c1')
+        recorder.expire(now=4)
+        assert recorder.status()["recording"] == 'c1'
+        recorder.expire(now=6)
+        await recorder.flush()
+        return recorder
+
+    assert asyncio.run(run()).index.find('c1')['frames'] == 3
+
+
+def test_buffer_and_open_clip_share_one_budget(tmp_path):
+    async def run():
+        recorder = make_recorder(tmp_path, frames_budget=10, pre_seconds=60, post_seconds=60)
+        feed(recorder, 0, 30)
+        assert recorder.status()["buffer_frames"] == 10
+        recorder.trigger(3.0, 'c1')
+        feed(recorder, 3.0, 30)
+        status = recorder.status()
+        assert status["used_bytes"] <= status["max_bytes"]
+        assert status["clip_frames_dropped"] == 30
+        await recorder.flush()
+        return recorder
+
+    recorder = asyncio.run(run())
+    assert recorder.index.find('c1')['frames'] == 10
+
+
+def test_pending_write_limits_the_next_buffer(tmp_path):
+    recorder = make_recorder(tmp_path, frames_budget=10)
+    recorder._writing_bytes = len(JPEG) * 8    # un clip cerrado que aún se escribe
+    feed(recorder, 0, 5)
+    assert recorder.status()["buffer_frames"] == 2
+    assert recorder.used_bytes <= recorder.max_bytes
+
+
+def clip_entry(index, clip_id, created_at, size=100):
+    path = index.clips_dir / 'a' / f"{clip_id}.avi"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    index.append({'clip_id': clip_id, 'camera_id': 'a', 'file': f"a/{clip_id}.avi",
+                  'bytes': size, 'triggers': [f"alerta-{clip_id}"], 'created_at': created_at})
+    return path
+
+
+def test_retention_removes_oldest_clips_and_their_entries(tmp_path):
+    index = ClipIndex(tmp_path, max_clips=2, max_bytes=250)
+    now = time.time()
+    first = clip_entry(index, 'c1', now)
+    clip_entry(index, 'c2', now)
+    clip_entry(index, 'c3', now)
+    assert not first.exists()
+    assert index.find('c1') is None and index.find('alerta-c1') is None
+    assert [e['clip_id'] for e in index.list()] == ['c2', 'c3']
+    # Por bytes: 2 x 100 + 200 > 250
+    clip_entry(index, 'c4', now, size=200)
+    assert [e['clip_id'] for e in index.list()] == ['c4']
+    # El índice en disco queda compactado
+    assert [e['clip_id'] for e in ClipIndex(tmp_path).list()] == ['c4']
+
+
+def test_retention_by_age_applies_on_load(tmp_path):
+    index = ClipIndex(tmp_path)
+    old = clip_entry(index, 'viejo', time.time() - 3 * 86400)
+    clip_entry(index, 'nuevo', time.time())
+    index = ClipIndex(tmp_path, max_age=86400)
+    assert not old.exists()
+    assert [e['clip_id'] for e in index.list()] == ['nuevo']
+
+
+def test_list_is_bounded(tmp_path):
+    index = ClipIndex(tmp_path)
+    for i in range(5):
+        clip_entry(index, f"c{i}", time.time())
+    assert index.list(limit=0) == []
+    assert [e['clip_id'] for e in index.list(limit=2)] == ['c3', 'c4']
+    assert len(index.list(limit=10 ** 6)) == 5
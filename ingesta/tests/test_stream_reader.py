@@ -0,0 +1,40 @@
+import pytest
+
+from stream_reader import MJPEGParser, parse_multipart_boundary
+
+BOUNDARY = "123456789000000000000987654321"
+
+
+def part(jpeg: bytes, with_length: bool = True) -> bytes:
+    headers = b"Content-Type: image/jpeg\r\n"
+    if with_length:
+        headers += f"Content-Length: {len(jpeg)}\r\n".encode()
+    return b"--" + BOUNDARY.encode() + b"\r\n" + headers + b"\r\n" + jpeg + b"\r\n"
+
+
+FRAMES = [b"\xff\xd8" + bytes([i]) * (100 + i) + b"\xff\xd9" for i in range(4)]
+
+
+def test_boundary_from_content_type():
+    assert parse_multipart_boundary(f'multipart/x-mixed-replace; boundary="{BOUNDARY}"') == BOUNDARY
+    assert parse_multipart_boundary("image/jpeg") is None
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 100000])
+@pytest.mark.parametrize("with_length", [True, False])
+def test_frames_split_across_arbitrary_chunks(chunk_size, with_length):
+    stream = b"".join(part(frame, with_length) for frame in FRAMES)
+    # Sin Content-Length el último frame se entrega al llegar el siguiente delimitador
+    stream += b"--" + BOUNDARY.encode() + b"--\r\n"
+    parser = MJPEGParser(BOUNDARY)
+    received = []
+    for start in range(0, len(stream), chunk_size):
+        received += parser.feed(stream[start:start + chunk_size])
+    assert received == FRAMES
+    assert parser.closed
+
+
+def test_oversized_frame_is_rejected():
+    parser = MJPEGParser(BOUNDARY, max_frame_size=50)
+    with pytest.raises(ValueError):
+        parser.feed(part(FRAMES[0]))
@@ -0,0 +1,135 @@
+import base64
+import time
+import cv2
+import numpy as np
+from typing import Optional, Tuple
+
+# Marcadores SOF (Start Of Frame) que contienen el tamaño de la imagen
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+_REDUCED_GRAY_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+_REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+def jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Lee (ancho, alto) de las cabeceras de un JPEG sin decodificarlo"""
+    if data[:2] != b"\xff\xd8":
+        return None
+    pos = 2
+    length = len(data)
+    while pos + 4 <= length:
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # relleno
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        segment_length = int.from_bytes(data[pos + 2:pos + 4], 'big')
+        if marker in _SOF_MARKERS and pos + 9 <= length:
+            height = int.from_bytes(data[pos + 5:pos + 7], 'big')
+            width = int.from_bytes(data[pos + 7:pos + 9], 'big')
+            return width, height
+        pos += 2 + segment_length
+    return None
+
+def reduction_factor(size: Optional[Tuple[int, int]], min_width: int) -> int:
+    """Mayor factor de reducción JPEG (1, 2, 4, 8) que mantiene el ancho >= min_width"""
+    if size is None:
+        return 1
+    width = size[0]
+    for factor in (8, 4, 2):
+        if width // factor >= min_width:
+            return factor
+    return 1
+
+class Frame:
+    """Frame capturado que conserva los bytes JPEG originales
+
+    La imagen se decodifica solo cuando una etapa necesita píxeles y el JPEG
+    solo se codifica si el frame nació como array (OpenCV). Así el camino
+    snapshot/MJPEG reenvía la misma imagen que entregó la cámara, sin
+    decodificar, convertir color y recomprimir.
+    """
+
+    __slots__ = ('_jpeg', '_image', '_size', 'timestamp', 'jpeg_quality')
+
+    def __init__(self, jpeg: Optional[bytes] = None, image: Optional[np.ndarray] = None,
+                 timestamp: Optional[float] = None, jpeg_quality: int = 90):
+        if jpeg is None and image is None:
+            raise ValueError("Frame requiere bytes JPEG o una imagen")
+        self._jpeg = jpeg
+        self._image = image
+        self._size = None
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.jpeg_quality = jpeg_quality
+
+    @property
+    def jpeg(self) -> bytes:
+        """Bytes JPEG (los originales si existen)"""
+        if self._jpeg is None:
+            ok, buffer = cv2.imencode('.jpg', self._image,
+                                      [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if not ok:
+                raise ValueError("No se pudo codificar el frame a JPEG")
+            self._jpeg = buffer.tobytes()
+        return self._jpeg
+
+    @property
+    def image(self) -> np.ndarray:
+        """Imagen BGR a resolución completa (se decodifica una sola vez)"""
+        if self._image is None:
+            image = cv2.imdecode(np.frombuffer(self._jpeg, np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError("No se pudo decodificar el frame JPEG")
+            self._image = image
+        return self._image
+
+    @property
+    def size(self) -> Optional[Tuple[int, int]]:
+        """(ancho, alto) sin decodificar cuando es posible"""
+        if self._size is None:
+            if self._image is not None:
+                self._size = (self._image.shape[1], self._image.shape[0])
+            else:
+                self._size = jpeg_size(self._jpeg)
+        return self._size
+
+    def gray_thumbnail(self, min_width: int) -> np.ndarray:
+        """Copia en grises de al menos min_width de ancho, decodificada a escala reducida"""
+        if self._image is not None:
+            gray = cv2.cvtColor(self._image, cv2.COLOR_BGR2GRAY) if self._image.ndim == 3 else self._image
+            return gray
+        factor = reduction_factor(self.size, min_width)
+        gray = cv2.imdecode(np.frombuffer(self._jpeg, np.uint8), _REDUCED_GRAY_FLAGS[factor])
+        if gray is None:
+            raise ValueError("No se pudo decodificar el frame JPEG")
+        return gray
+
+    def decode_reduced(self, factor: int) -> np.ndarray:
+        """Imagen BGR decodificada a 1/factor de resolución (factor 1, 2, 4 u 8)"""
+        if factor == 1 or self._jpeg is None:
+            return self.image
+        image = cv2.imdecode(np.frombuffer(self._jpeg, np.uint8), _REDUCED_COLOR_FLAGS[factor])
+        if image is None:
+            raise ValueError("No se pudo decodificar el frame JPEG")
+        return image
+
+    def to_base64(self) -> str:
+        """JPEG en base64 (sin recomprimir si el frame ya venía comprimido)"""
+        return base64.b64encode(self.jpeg).decode('utf-8')
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.jpeg)
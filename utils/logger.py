@@ -1,4 +1,5 @@
 import logging
+import os
 import sys
 from pathlib import Path
 
@@ -24,7 +25,7 @@ def setup_logger(name: str, level: str = "INFO") -> logging.Logger:
     logger.addHandler(console_handler)
     
     # Handler para archivo (opcional)
-    log_dir = Path("/app/logs")
+    log_dir = Path(os.getenv("LOG_DIR", "/app/logs"))
     log_dir.mkdir(exist_ok=True, parents=True)
     file_handler = logging.FileHandler(log_dir / f"{name}.log")
     file_handler.setFormatter(formatter)
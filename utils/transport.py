@@ -0,0 +1,130 @@
+import base64
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+# Metadatos pequeños (camera_id, timestamp) cuando el cuerpo es un JPEG crudo
+FRAME_METADATA_HEADER = "X-Frame-Metadata"
+
+# binary: cuerpo image/jpeg + cabecera de metadatos
+# multipart: parte JSON `metadata` + parte `image` (para metadatos grandes, p. ej. detecciones)
+# json: compatibilidad, imagen en base64 dentro del JSON
+TRANSPORTS = ('binary', 'multipart', 'json')
+
+def _load_metadata(raw) -> Dict[str, Any]:
+    if not raw:
+        return {}
+    if isinstance(raw, bytes):
+        raw = raw.decode('utf-8')
+    metadata = json.loads(raw)
+    if not isinstance(metadata, dict):
+        raise ValueError("Los metadatos deben ser un objeto JSON")
+    return metadata
+
+async def read_image_request(request) -> Tuple[Optional[bytes], Dict[str, Any]]:
+    """Lee (jpeg, metadatos) de una petición image/jpeg, multipart/form-data o JSON base64"""
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+
+    if content_type.startswith('image/'):
+        body = await request.body()
+        metadata = _load_metadata(request.headers.get(FRAME_METADATA_HEADER))
+        return body or None, metadata
+
+    if content_type == 'multipart/form-data':
+        form = await request.form()
+        raw_metadata = form.get('metadata')
+        if hasattr(raw_metadata, 'read'):
+            raw_metadata = await raw_metadata.read()
+        metadata = _load_metadata(raw_metadata)
+        image = form.get('image')
+        jpeg = await image.read() if hasattr(image, 'read') else None
+        return jpeg or None, metadata
+
+    # Compatibilidad: {"image": <base64>, ...}
+    payload = await request.json()
+    if not isinstance(payload, dict):
+        raise ValueError("El cuerpo JSON debe ser un objeto")
+    image_b64 = payload.pop('image', None)
+    jpeg = base64.b64decode(image_b64) if image_b64 else None
+    return jpeg, payload
+
+def encode_image_request(jpeg: Optional[bytes], metadata: Dict[str, Any],
+                         transport: str = 'binary') -> Dict[str, Any]:
+    """Argumentos para session.post() con el frame y sus metadatos
+
+    Devuelve un dict nuevo en cada llamada (un FormData de aiohttp no se puede
+    reutilizar entre reintentos).
+    """
+    if transport == 'binary' and jpeg is not None:
+        return {
+            'data': jpeg,
+            'headers': {
+                'Content-Type': 'image/jpeg',
+                FRAME_METADATA_HEADER: json.dumps(metadata),
+            },
+        }
+    if transport in ('binary', 'multipart'):
+        form = aiohttp.FormData()
+        form.add_field('metadata', json.dumps(metadata), content_type='application/json')
+        if jpeg is not None:
+            form.add_field('image', jpeg, filename='frame.jpg', content_type='image/jpeg')
+        return {'data': form}
+    if transport == 'json':
+        payload = dict(metadata)
+        payload['image'] = base64.b64encode(jpeg).decode('utf-8') if jpeg is not None else ""
+        return {'json': payload}
+    raise ValueError(f"Transporte desconocido: {transport}")
+
+def encode_batch_request(items, transport: str = 'binary') -> Dict[str, Any]:
+    """Argumentos para session.post() con varios (jpeg, metadatos) en un solo cuerpo
+
+    En binario/multipart los JPEG viajan como partes `image_<i>` y cada entrada
+    de `metadata.items` indica su parte en `image`.
+    """
+    if transport in ('binary', 'multipart'):
+        form = aiohttp.FormData()
+        entries = []
+        for index, (jpeg, metadata) in enumerate(items):
+            entry = dict(metadata)
+            entry['image'] = f"image_{index}" if jpeg is not None else None
+            entries.append(entry)
+        form.add_field('metadata', json.dumps({'items': entries}), content_type='application/json')
+        for index, (jpeg, _) in enumerate(items):
+            if jpeg is not None:
+                form.add_field(f"image_{index}", jpeg, filename=f"frame_{index}.jpg", content_type='image/jpeg')
+        return {'data': form}
+    if transport == 'json':
+        entries = []
+        for jpeg, metadata in items:
+            entry = dict(metadata)
+            entry['image'] = base64.b64encode(jpeg).decode('utf-8') if jpeg is not None else ""
+            entries.append(entry)
+        return {'json': {'items': entries}}
+    raise ValueError(f"Transporte desconocido: {transport}")
+
+async def read_batch_request(request) -> List[Tuple[Optional[bytes], Dict[str, Any]]]:
+    """Lee la lista de (jpeg, metadatos) generada por encode_batch_request"""
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+
+    if content_type == 'multipart/form-data':
+        form = await request.form()
+        raw_metadata = form.get('metadata')
+        if hasattr(raw_metadata, 'read'):
+            raw_metadata = await raw_metadata.read()
+        entries = _load_metadata(raw_metadata).get('items', [])
+        items = []
+        for entry in entries:
+            part = form.get(entry.pop('image', None) or '')
+            jpeg = await part.read() if hasattr(part, 'read') else None
+            items.append((jpeg or None, entry))
+        return items
+
+    payload = await request.json()
+    if not isinstance(payload, dict) or not isinstance(payload.get('items'), list):
+        raise ValueError("Se esperaba un objeto con la lista `items`")
+    items = []
+    for entry in payload['items']:
+        image_b64 = entry.pop('image', None)
+        items.append((base64.b64decode(image_b64) if image_b64 else None, entry))
+    return items